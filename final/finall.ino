@@ -13,6 +13,9 @@
 #define WIFI_PASSWORD "Password"
 #define SERVER_URL_AUDIO "http://10.242.254.30:8000/upload_raw"
 #define SERVER_URL_IMAGE "http://10.242.254.30:8000/upload_image"
+#define SERVER_URL_INGEST "http://10.242.254.30:8000/stream/ingest"
+#define SERVER_URL_INGEST_STOP "http://10.242.254.30:8000/stream/stop"
+#define SERVER_URL_SESSION_START "http://10.242.254.30:8000/session_start"
 
 // Audio config
 #define SAMPLE_RATE   16000U
@@ -73,6 +76,42 @@ String getTimestamp() {
   return String(buf);
 }
 
+void handleSerialCommand();
+
+// ---------- Tell the server to start/stop reading /stream ----------
+void notifyServer(const char* url) {
+  if (WiFi.status() != WL_CONNECTED) return;
+  HTTPClient http;
+  WiFiClient client;
+  if (http.begin(client, url)) {
+    http.addHeader("X-Device-Id", WiFi.macAddress());
+    int httpResponseCode = http.POST("");
+    Serial.printf("📡 %s -> %d\n", url, httpResponseCode);
+    http.end();
+  }
+}
+
+// ---------- Tell the server a turn is starting, so it warms up while we record ----------
+void sessionStartTask(void *arg) {
+  String url = String(SERVER_URL_SESSION_START) + "?kind=" + (const char*)arg;
+  HTTPClient http;
+  WiFiClient client;
+  if (http.begin(client, url)) {
+    http.setTimeout(2000);
+    http.addHeader("X-Device-Id", WiFi.macAddress());
+    int httpResponseCode = http.POST("");
+    Serial.printf("📡 session_start -> %d\n", httpResponseCode);
+    http.end();
+  }
+  vTaskDelete(NULL);
+}
+
+void signalSessionStart(const char* kind) {
+  if (WiFi.status() != WL_CONNECTED) return;
+  // Own task: recording and capture never wait on the network
+  xTaskCreate(sessionStartTask, "session_start", 1024 * 4, (void*)kind, 1, NULL);
+}
+
 // ---------- Video Streaming Handler ----------
 void handleStream() {
   static char head[128];
@@ -96,6 +135,8 @@ void handleStream() {
       client.write(fb->buf, fb->len);
       client.write("\r\n");
       esp_camera_fb_return(fb);
+      // The server may keep this stream open indefinitely; stay responsive to commands
+      handleSerialCommand();
       delay(1000 / STREAM_FRAMERATE);
     } else {
       Serial.println("⚠️ Camera capture failed during streaming");
@@ -113,6 +154,8 @@ void startStreaming() {
     server.on(STREAM_URL, handleStream);
     Serial.println("🎬 Video streaming started!");
     Serial.printf("📺 Stream URL: http://%s%s\n", WiFi.localIP().toString().c_str(), STREAM_URL);
+    // Server keeps the best recent frame in memory, so questions about the view need no photo upload
+    notifyServer(SERVER_URL_INGEST);
   } else {
     Serial.println("⚠️ Streaming already active");
   }
@@ -121,6 +164,7 @@ void startStreaming() {
 void stopStreaming() {
   if (isStreaming) {
     isStreaming = false;
+    notifyServer(SERVER_URL_INGEST_STOP);
     Serial.println("⏹️ Video streaming stopped!");
   } else {
     Serial.println("⚠️ No active streaming to stop");
@@ -166,6 +210,7 @@ void uploadAudioFile(String filepath) {
   if (http.begin(client, SERVER_URL_AUDIO)) {
     http.addHeader("Content-Type", "audio/wav");
     http.addHeader("X-Filename", justName);
+    http.addHeader("X-Device-Id", WiFi.macAddress());
 
     int httpResponseCode = http.sendRequest("POST", &audioFile, audioFile.size());
 
@@ -191,6 +236,7 @@ void takePhoto() {
     Serial.println("❌ Camera capture failed");
     return;
   }
+  signalSessionStart("photo");
 
   // Create filename with timestamp
   String timestamp = getTimestamp();
@@ -217,6 +263,7 @@ void takePhoto() {
     
     if(http.begin(client, SERVER_URL_IMAGE)) {
       http.addHeader("Content-Type", "image/jpeg");
+      http.addHeader("X-Device-Id", WiFi.macAddress());
       
       // Open saved file for upload
       File uploadFile = SD.open(imageFilename, FILE_READ);
@@ -290,6 +337,7 @@ void i2s_adc(void *arg) {
     filename = "/audio_history/recording_" + getTimestamp() + ".wav";
 
     Serial.printf("🎙️ Recording started: %s\n", filename.c_str());
+    signalSessionStart("audio");
 
     File file = SD.open(filename, FILE_WRITE);
 
@@ -430,12 +478,8 @@ void setup() {
   Serial.println("=======================================");
 }
 
-// ---------- Main Loop ----------
-void loop() {
-  // Handle web server clients
-  server.handleClient();
-  
-  // Handle serial commands
+// ---------- Serial Commands ----------
+void handleSerialCommand() {
   if (Serial.available()) {
     String command = Serial.readStringUntil('\n');
     command.trim();
@@ -462,4 +506,13 @@ void loop() {
       Serial.println("❓ Unknown command. Available: start, stop, snap, streaming, stopstream");
     }
   }
+}
+
+// ---------- Main Loop ----------
+void loop() {
+  // Handle web server clients
+  server.handleClient();
+  
+  // Handle serial commands
+  handleSerialCommand();
 }
\ No newline at end of file
@@ -0,0 +1,379 @@
+import asyncio
+import os
+import time
+import uuid
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage, messages_from_dict, messages_to_dict
+from langchain_core.messages.utils import count_tokens_approximately
+from metrics import registry as metrics_registry
+from prompt_cache import prefix_fingerprint
+
+# Memory settings
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", "6000"))                  # History budget before compaction
+MEMORY_KEEP_RECENT_TOKENS = int(os.getenv("MEMORY_KEEP_RECENT_TOKENS", "2000"))  # Recent turns always kept verbatim
+MAX_OBSERVATION_CHARS = int(os.getenv("MAX_OBSERVATION_CHARS", "1500"))          # Tool results kept in history
+SUMMARY_MAX_WORDS = 150
+MEMORY_STATE_KEY = "memory:conversation"   # State backend key of the shared history
+MEMORY_SAVE_ATTEMPTS = 5                   # Tries to store a turn while other workers keep storing theirs
+
+TRUNCATION_MARK = " ... [truncated"
+SUMMARY_PREFIX = "Summary of our earlier conversation:"
+SUMMARY_ACK = "Got it, I'll keep that in mind."
+SUMMARIZE_INSTRUCTIONS = (
+    "You maintain the running memory of a voice assistant on smart glasses. "
+    f"Merge the existing summary and the new conversation turns into one summary of at most {SUMMARY_MAX_WORDS} words. "
+    "Keep facts about the user, names, email addresses, decisions, open tasks and anything the user asked to remember. "
+    "Drop pleasantries and raw tool output. Plain sentences, no formatting."
+)
+
+
+def count_tokens(messages) -> int:
+    return count_tokens_approximately(messages) if messages else 0
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return str(content)
+
+
+def _truncate_observation(message):
+    """Copy of a ToolMessage with its content cut to MAX_OBSERVATION_CHARS (None if already short)."""
+    text = _text(message.content)
+    if len(text) <= MAX_OBSERVATION_CHARS or text.startswith(TRUNCATION_MARK, MAX_OBSERVATION_CHARS):
+        return None
+    cut = text[:MAX_OBSERVATION_CHARS]
+    note = f"{TRUNCATION_MARK} {len(text) - MAX_OBSERVATION_CHARS} chars]"
+    return message.model_copy(update={"content": cut + note})
+
+
+class AgentMemory:
+    """
+    Bounded, summarizing memory around an MCPAgent. Exposes the same run()/stream()
+    calls; after each turn, large tool observations in the history are truncated and,
+    once the history is over MEMORY_MAX_TOKENS, the oldest turns are folded into a
+    rolling summary (one extra LLM call, in the background) so the context sent on
+    every turn stays roughly constant. Turns are serialized because the agent keeps
+    a single shared history.
+    With a shared state backend (`store`), the history after the pinned prefix is
+    loaded before each turn and saved after it, so workers continue one conversation.
+    """
+
+    def __init__(self, agent, llm=None, max_tokens: int = MEMORY_MAX_TOKENS,
+                 keep_recent_tokens: int = MEMORY_KEEP_RECENT_TOKENS, store=None):
+        self.agent = agent
+        self.llm = llm or agent.llm
+        self.max_tokens = max_tokens
+        self.keep_recent_tokens = keep_recent_tokens
+        self.store = store if store is not None and store.shared else None
+        self.summary = ""
+        self._pinned = 0                 # Leading messages never summarized (the startup prompt turn)
+        self._sharing = False            # History is synced with the store once pinned
+        self._version = None             # Token of the stored history this process last saw or wrote
+        self._generation = 0             # Bumped when another worker's history is loaded
+        self._prefix = None              # Fingerprint of the agent's system prompt + tool set
+        self._turn_lock = asyncio.Lock()
+        self._compactor = None
+        self.turns = 0
+        self.compactions = 0
+        self.summary_failures = 0
+        self.truncated_observations = 0
+        self.last_context_tokens = 0
+        self.last_summary_ms = None
+        self.prefix_refreshes = 0
+        self.save_conflicts = 0
+
+    # -- agent calls ---------------------------------------------------------
+
+    async def run(self, query: str, **kwargs):
+        async with self._turn_lock:
+            await self._load()
+            turn_start = len(self.history())
+            self.last_context_tokens = self.context_tokens()
+            result = await self.agent.run(query, **kwargs)
+            await self._end_turn(turn_start)
+        self._after_turn()
+        return result
+
+    async def stream(self, query: str, **kwargs):
+        async with self._turn_lock:
+            await self._load()
+            turn_start = len(self.history())
+            self.last_context_tokens = self.context_tokens()
+            metrics_registry.observe("context_tokens", self.last_context_tokens)
+            async for step in self.agent.stream(query, **kwargs):
+                yield step
+            await self._end_turn(turn_start)
+        self._after_turn()
+
+    async def stream_direct(self, query: str, system_prompt: str, cached_content: str = None):
+        """
+        Tool-free turn: one streamed LLM call with the conversation so far but no tool
+        schema and no agent loop. Yields text chunks; the exchange is added to the
+        shared history only if the stream runs to the end (an abandoned stream, e.g.
+        one escalated to the agent, leaves no trace). With `cached_content` (a Gemini
+        cache holding system_prompt) the system prompt is not sent again.
+        """
+        async with self._turn_lock:
+            await self._load()
+            turn_start = len(self.history())
+            self.last_context_tokens = self.context_tokens()
+            metrics_registry.observe("context_tokens", self.last_context_tokens)
+            messages = [] if cached_content else [SystemMessage(content=system_prompt)]
+            for message in self.history():
+                # Tool plumbing means nothing to a model without tools; keep the spoken text
+                if isinstance(message, HumanMessage):
+                    messages.append(message)
+                elif isinstance(message, AIMessage) and _text(message.content).strip():
+                    messages.append(AIMessage(content=_text(message.content)))
+            messages.append(HumanMessage(content=query))
+
+            parts = []
+            extra = {"cached_content": cached_content} if cached_content else {}
+            async for chunk in self.llm.astream(messages, config={"tags": ["direct"]}, **extra):
+                text = _text(chunk.content)
+                if text:
+                    parts.append(text)
+                    yield text
+            self.agent.add_to_history(HumanMessage(content=query))
+            self.agent.add_to_history(AIMessage(content="".join(parts)))
+            await self._end_turn(turn_start)
+        self._after_turn()
+
+    def tools(self) -> list:
+        """The MCP tools the agent was initialized with (empty before initialize())."""
+        return getattr(self.agent, "_tools", None) or []
+
+    async def refresh_prefix(self, system_prompt: str) -> bool:
+        """
+        Rebuild the agent's static prefix (system message with tool descriptions, plus
+        tool schemas) if the system prompt or the MCP tool set changed. Tools are put
+        in name order so the prefix is byte-identical on every turn and worker, which
+        is what Gemini's implicit prefix caching matches on. Returns True if rebuilt.
+        """
+        tools = getattr(self.agent, "_tools", None)
+        if not tools:
+            return False
+        fingerprint = prefix_fingerprint(system_prompt, tools)
+        if fingerprint == self._prefix:
+            return False
+        async with self._turn_lock:
+            # mcp_use has no public hook for this; same steps as MCPAgent.initialize()
+            tools.sort(key=lambda tool: tool.name)
+            self.agent.system_prompt = system_prompt
+            await self.agent._create_system_message_from_tools(tools)
+            self.agent._agent_executor = self.agent._create_agent()
+            self._prefix = fingerprint
+            self.prefix_refreshes += 1
+        return True
+
+    # -- pre-warming ---------------------------------------------------------
+
+    async def warm_llm(self):
+        """Open the chat model's connection to Gemini (a model lookup, no tokens) ahead of a turn."""
+        client = getattr(self.llm, "client", None)
+        if client is None:
+            return False
+        await client.aio.models.get(model=self.llm.model)
+
+    async def warm_tools(self):
+        """Ping every MCP session, reconnecting any that dropped, so the turn's first tool call doesn't wait."""
+        sessions = self.agent.client.get_all_active_sessions() if self.agent.client else {}
+        if not sessions:
+            return False
+
+        async def touch(session):
+            if session.is_connected:
+                await session.connector.client_session.send_ping()
+            else:
+                await session.connect()
+                await session.initialize()
+
+        await asyncio.gather(*(touch(session) for session in sessions.values()))
+
+    def pin(self):
+        """
+        Keep everything currently in the history (e.g. the startup prompt turn) out of
+        summaries. Every worker pins its own startup turn; only what follows is shared.
+        """
+        self._pinned = len(self.agent.get_conversation_history())
+        self._sharing = self.store is not None
+
+    def clear(self):
+        self.agent.clear_conversation_history()
+        self.summary = ""
+        self._pinned = 0
+        self._sharing = False
+
+    # -- shared state --------------------------------------------------------
+
+    async def _load(self):
+        """Adopt the stored history if another worker changed it since we last looked."""
+        if not self._sharing:
+            return
+        state = await self.store.get(MEMORY_STATE_KEY)
+        if not state:
+            self._version = None
+            return
+        if state["version"] == self._version:
+            return
+        history = self.history()
+        history[:] = history[:self._pinned] + messages_from_dict(state["messages"])
+        self.summary = state["summary"]
+        self._version = state["version"]
+        self._generation += 1
+
+    async def _save(self, turn_start: int = None) -> bool:
+        """
+        Store the history unless another worker stored one since we loaded it (a
+        compare-and-set on the version). On a conflict their history is loaded and,
+        given `turn_start`, the messages this turn added are replayed on top of it and
+        the save retried; without it (compaction) the change is dropped. False if
+        nothing was stored.
+        """
+        if not self._sharing:
+            return True
+        for _ in range(MEMORY_SAVE_ATTEMPTS):
+            version = uuid.uuid4().hex
+            stored = await self.store.compare_and_set(MEMORY_STATE_KEY, {
+                "version": version,
+                "summary": self.summary,
+                "messages": messages_to_dict(self.history()[self._pinned:]),
+            }, self._version)
+            if stored:
+                self._version = version
+                return True
+            self.save_conflicts += 1
+            turn = self.history()[turn_start:] if turn_start is not None else None
+            await self._load()
+            if turn is None:
+                return False
+            turn_start = len(self.history())
+            self.history().extend(turn)
+        print(f"⚠️ Conversation memory not stored after {MEMORY_SAVE_ATTEMPTS} conflicting writes")
+        return False
+
+    async def _end_turn(self, turn_start: int = None):
+        self._truncate_observations()
+        await self._save(turn_start)
+
+    # -- compaction ----------------------------------------------------------
+
+    def history(self) -> list:
+        return self.agent.get_conversation_history()
+
+    def context_tokens(self) -> int:
+        """Approximate tokens of history the next turn will resend."""
+        return count_tokens(self.history())
+
+    def _after_turn(self):
+        self.turns += 1
+        if self.context_tokens() > self.max_tokens and (self._compactor is None or self._compactor.done()):
+            self._compactor = asyncio.create_task(self._compact())
+
+    def _truncate_observations(self):
+        history = self.history()
+        for i, message in enumerate(history):
+            if isinstance(message, ToolMessage):
+                short = _truncate_observation(message)
+                if short is not None:
+                    history[i] = short
+                    self.truncated_observations += 1
+
+    def _split_point(self, history) -> int:
+        """
+        Index where the verbatim tail starts: the earliest turn boundary (a human
+        message) such that the tail fits in keep_recent_tokens. Cutting only at
+        human messages keeps tool calls together with their results.
+        """
+        cut = len(history)
+        tail_tokens = 0
+        for i in range(len(history) - 1, self._pinned - 1, -1):
+            tail_tokens += count_tokens([history[i]])
+            if tail_tokens > self.keep_recent_tokens:
+                break
+            if isinstance(history[i], HumanMessage) and not _text(history[i].content).startswith(SUMMARY_PREFIX):
+                cut = i
+        if cut == len(history):
+            # Even the last turn is over budget: keep it anyway, fold everything before it
+            for i in range(len(history) - 1, self._pinned - 1, -1):
+                if isinstance(history[i], HumanMessage):
+                    cut = i
+                    break
+        return cut
+
+    async def _compact(self):
+        """Fold the turns before the recent tail into the rolling summary."""
+        history = list(self.history())
+        generation = self._generation
+        cut = self._split_point(history)
+        old = [m for m in history[self._pinned:cut] if not self._is_summary(m)]
+        if not old:
+            return
+
+        start = time.perf_counter()
+        summary_text = self.summary
+        try:
+            summary_text = await self._summarize(old)
+        except Exception as e:
+            # Keep memory bounded even without a summary: the old turns are just dropped
+            self.summary_failures += 1
+            print(f"⚠️ Memory summary failed, dropping {len(old)} old messages: {e}")
+        self.last_summary_ms = (time.perf_counter() - start) * 1000
+        metrics_registry.observe("memory_summarize", self.last_summary_ms)
+
+        async with self._turn_lock:
+            if generation != self._generation:
+                # Another worker's history was loaded meanwhile; `cut` no longer applies
+                return
+            # Turns that finished while summarizing were appended after `cut`; keep them
+            self.summary = summary_text
+            current = self.history()
+            summary = [HumanMessage(content=f"{SUMMARY_PREFIX} {self.summary}"), AIMessage(content=SUMMARY_ACK)] if self.summary else []
+            current[:] = current[:self._pinned] + summary + current[cut:]
+            if not await self._save():
+                # Another worker stored its turn first; its history is loaded, compact again later
+                return
+        self.compactions += 1
+        metrics_registry.incr("memory_compactions")
+        print(f"🧠 Memory compacted: {len(old)} messages folded, {self.context_tokens()} tokens left")
+
+    @staticmethod
+    def _is_summary(message) -> bool:
+        return (isinstance(message, HumanMessage) and _text(message.content).startswith(SUMMARY_PREFIX)) or \
+               (isinstance(message, AIMessage) and message.content == SUMMARY_ACK)
+
+    async def _summarize(self, messages) -> str:
+        lines = []
+        for m in messages:
+            if isinstance(m, HumanMessage):
+                lines.append(f"User: {_text(m.content)}")
+            elif isinstance(m, ToolMessage):
+                lines.append(f"Tool result: {_text(m.content)[:300]}")
+            elif isinstance(m, AIMessage) and _text(m.content).strip():
+                lines.append(f"Assistant: {_text(m.content)}")
+        prompt = f"Existing summary: {self.summary or '(none)'}\n\nNew turns:\n" + "\n".join(lines)
+        response = await self.llm.ainvoke([SystemMessage(content=SUMMARIZE_INSTRUCTIONS), HumanMessage(content=prompt)],
+                                          config={"tags": ["memory"]})
+        return _text(response.content).strip()
+
+    async def close(self):
+        if self._compactor is not None and not self._compactor.done():
+            self._compactor.cancel()
+
+    def get_stats(self) -> dict:
+        return {
+            "messages": len(self.history()),
+            "shared": self._sharing,
+            "context_tokens": self.context_tokens(),
+            "max_tokens": self.max_tokens,
+            "summary_tokens": count_tokens([HumanMessage(content=self.summary)]) if self.summary else 0,
+            "turns": self.turns,
+            "compactions": self.compactions,
+            "summary_failures": self.summary_failures,
+            "truncated_observations": self.truncated_observations,
+            "last_summary_ms": round(self.last_summary_ms) if self.last_summary_ms is not None else None,
+            "prefix_refreshes": self.prefix_refreshes,
+            "save_conflicts": self.save_conflicts,
+        }
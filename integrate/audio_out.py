@@ -0,0 +1,272 @@
+import asyncio
+import collections
+import os
+import struct
+import time
+import numpy as np
+
+# Device output settings
+SOURCE_RATE = 24000                 # What the TTS engine produces (Deepgram linear16)
+OUTPUT_RATES = (8000, 16000, 24000)
+DEFAULT_OUTPUT_RATE = int(os.getenv("AUDIO_OUT_RATE", "16000"))   # The glasses' I2S rate
+CODECS = ("pcm16", "mulaw")         # mulaw: G.711, 8 bits per sample, half the bytes of pcm16
+DEFAULT_CODEC = os.getenv("AUDIO_OUT_CODEC", "pcm16")
+REPLY_WAIT_SECONDS = 30             # How long a client may wait for a reply to start
+MAX_REPLY_SECONDS = 120             # Audio kept per reply; beyond this chunks are dropped
+REPLIES_PER_DEVICE = 2              # Recent replies kept for late or repeated fetches
+MAX_DEVICES = 256
+LOWPASS_TAPS = 33                   # Anti-alias filter length when downsampling
+
+MAX_REPLY_BYTES = MAX_REPLY_SECONDS * SOURCE_RATE * 2
+
+
+def _lowpass(in_rate: int, out_rate: int, taps: int = LOWPASS_TAPS) -> np.ndarray:
+    """Windowed-sinc FIR with its cutoff just under the output Nyquist frequency."""
+    cutoff = 0.45 * out_rate / in_rate          # Fraction of the input rate
+    n = np.arange(taps) - (taps - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (h / h.sum()).astype(np.float32)
+
+
+class StreamResampler:
+    """
+    Chunk-by-chunk 16-bit PCM resampler (low-pass FIR, then linear interpolation).
+    Filter history and the interpolation phase carry across calls, so chunks of any
+    size join without clicks. Equal rates pass through untouched.
+    """
+
+    def __init__(self, in_rate: int, out_rate: int):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.step = in_rate / out_rate
+        self._fir = _lowpass(in_rate, out_rate) if out_rate < in_rate else None
+        self._history = np.zeros(LOWPASS_TAPS - 1, dtype=np.float32)
+        self._carry = np.zeros(0, dtype=np.float32)   # Filtered samples not yet passed
+        self._t = 0.0                                 # Next output position, in input samples from _carry[0]
+
+    def process(self, pcm) -> np.ndarray:
+        samples = np.frombuffer(pcm, dtype="<i2")
+        if self.in_rate == self.out_rate:
+            return samples
+        x = samples.astype(np.float32)
+        if self._fir is not None:
+            padded = np.concatenate((self._history, x))
+            x = np.convolve(padded, self._fir, mode="valid")
+            self._history = padded[len(padded) - (LOWPASS_TAPS - 1):]
+        y = np.concatenate((self._carry, x))
+        last = len(y) - 1
+        if last < self._t:
+            self._carry = y
+            return np.zeros(0, dtype=np.int16)
+        n = int((last - self._t) // self.step) + 1
+        positions = self._t + self.step * np.arange(n)
+        out = np.interp(positions, np.arange(len(y)), y)
+        next_t = self._t + self.step * n
+        keep = min(int(next_t), last)
+        self._carry = y[keep:]
+        self._t = next_t - keep
+        return np.clip(np.rint(out), -32768, 32767).astype(np.int16)
+
+
+_MULAW_SEGMENT_ENDS = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+
+
+def mulaw_encode(samples: np.ndarray) -> bytes:
+    """G.711 mu-law, vectorized (bit-exact with audioop.lin2ulaw, which 3.13 drops)."""
+    v = samples.astype(np.int32) >> 2                      # 14-bit, as in the G.711 reference
+    negative = v < 0
+    magnitude = np.minimum(np.where(negative, -v, v), 8159) + 0x21
+    segment = np.searchsorted(_MULAW_SEGMENT_ENDS, magnitude)
+    mantissa = (magnitude >> (segment + 1)) & 0x0F
+    code = np.where(segment > 7, 0x7F, (segment << 4) | mantissa)   # Clipped: top of the scale
+    return (code ^ np.where(negative, 0x7F, 0xFF)).astype(np.uint8).tobytes()
+
+
+class AudioEncoder:
+    """24 kHz linear16 in, the device's rate and codec out."""
+
+    def __init__(self, rate: int = DEFAULT_OUTPUT_RATE, codec: str = DEFAULT_CODEC):
+        if rate not in OUTPUT_RATES:
+            raise ValueError(f"rate must be one of {OUTPUT_RATES}")
+        if codec not in CODECS:
+            raise ValueError(f"codec must be one of {CODECS}")
+        self.rate = rate
+        self.codec = codec
+        self._resampler = StreamResampler(SOURCE_RATE, rate)
+
+    @property
+    def media_type(self) -> str:
+        return f"audio/PCMU;rate={self.rate}" if self.codec == "mulaw" else f"audio/L16;rate={self.rate}"
+
+    @property
+    def bitrate(self) -> int:
+        return self.rate * (8 if self.codec == "mulaw" else 16)
+
+    def encode(self, pcm) -> bytes:
+        samples = self._resampler.process(pcm)
+        if self.codec == "mulaw":
+            return mulaw_encode(samples)
+        return samples.astype("<i2").tobytes()
+
+    def wav_header(self) -> bytes:
+        """Streaming WAV header (unknown length) for clients that want a playable file."""
+        fmt_tag, width = (7, 1) if self.codec == "mulaw" else (1, 2)
+        unknown = 0xFFFFFFFF
+        return (b"RIFF" + struct.pack("<I", unknown) + b"WAVE"
+                + b"fmt " + struct.pack("<IHHIIHH", 16, fmt_tag, 1, self.rate, self.rate * width, width, width * 8)
+                + b"data" + struct.pack("<I", unknown))
+
+
+class ReplyAudio:
+    """
+    PCM of one spoken reply, appended as it is synthesized. Any number of readers can
+    follow it from the start while it grows; it ends when the reply finishes or is
+    cancelled (barge-in).
+    """
+
+    def __init__(self, device_id: str, reply_id: str):
+        self.device_id = device_id
+        self.reply_id = reply_id
+        self.chunks = []
+        self.bytes = 0
+        self.dropped_bytes = 0
+        self.finished = False
+        self.cancelled = False
+        self.created = time.time()
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.finished or self.cancelled
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def append(self, pcm):
+        if self.done:
+            return
+        if self.bytes + len(pcm) > MAX_REPLY_BYTES:
+            self.dropped_bytes += len(pcm)
+            return
+        self.chunks.append(bytes(pcm))   # The engine reuses its ring buffer; copy
+        self.bytes += len(pcm)
+        self._notify()
+
+    def finish(self):
+        self.finished = True
+        self._notify()
+
+    def cancel(self):
+        self.cancelled = True
+        self._notify()
+
+    async def follow(self):
+        """Yield PCM chunks from the beginning, waiting for new ones until the reply ends."""
+        i = 0
+        while True:
+            changed = self._changed
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                return
+            await changed.wait()
+
+
+class AudioOutHub:
+    """
+    Per-device reply audio. The TTS engine opens a ReplyAudio per reply and appends
+    to it; /audio/reply streams it to the glasses as it is synthesized. Only the last
+    REPLIES_PER_DEVICE replies per device are kept.
+    """
+
+    def __init__(self, max_devices: int = MAX_DEVICES):
+        self.max_devices = max_devices
+        self._devices = collections.OrderedDict()   # device_id -> deque of ReplyAudio
+        self._started = None
+        self.replies = 0
+        self.streams = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def begin(self, device_id: str, reply_id: str) -> ReplyAudio:
+        reply = ReplyAudio(device_id, reply_id)
+        replies = self._devices.get(device_id)
+        if replies is None:
+            replies = self._devices[device_id] = collections.deque(maxlen=REPLIES_PER_DEVICE)
+            while len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+        self._devices.move_to_end(device_id)
+        if replies and not replies[-1].done:
+            replies[-1].cancel()
+        replies.append(reply)
+        self.replies += 1
+        self._wake()
+        return reply
+
+    def _wake(self):
+        if self._started is not None:
+            started, self._started = self._started, None
+            started.set()
+
+    def _lookup(self, device_id: str, reply_id: str):
+        replies = self._devices.get(device_id)
+        if not replies:
+            return None
+        if reply_id == "latest":
+            return replies[-1]
+        for reply in replies:
+            if reply.reply_id == reply_id:
+                return reply
+        return None
+
+    async def find(self, device_id: str, reply_id: str = "latest", since: float = None,
+                   wait: float = REPLY_WAIT_SECONDS):
+        """
+        The device's reply `reply_id` (a trace id) or its latest one, waiting up to
+        `wait` seconds for it to start. With `since`, only replies begun after that
+        time count. Returns None on timeout.
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            reply = self._lookup(device_id, reply_id)
+            if reply is not None and (since is None or reply.created >= since):
+                return reply
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if self._started is None:
+                self._started = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._started.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    async def stream(self, reply: ReplyAudio, encoder: AudioEncoder, wav: bool = False):
+        """Encoded audio of `reply` for a chunked HTTP response."""
+        self.streams += 1
+        if wav:
+            yield encoder.wav_header()
+        async for pcm in reply.follow():
+            data = encoder.encode(pcm)
+            self.bytes_in += len(pcm)
+            self.bytes_out += len(data)
+            if data:
+                yield data
+
+    def get_stats(self) -> dict:
+        return {
+            "devices": len(self._devices),
+            "replies": self.replies,
+            "streams": self.streams,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "compression": round(self.bytes_in / self.bytes_out, 2) if self.bytes_out else None,
+            "default_rate": DEFAULT_OUTPUT_RATE,
+            "default_codec": DEFAULT_CODEC,
+        }
+
+
+# Shared hub: the TTS engine publishes, the server streams
+hub = AudioOutHub()
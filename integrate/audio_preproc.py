@@ -0,0 +1,170 @@
+import io
+import os
+import struct
+import wave
+import numpy as np
+
+# Preprocessing settings
+VAD_FRAME_MS = 30                                                   # Energy analysis window
+VAD_MIN_RMS = float(os.getenv("VAD_MIN_RMS", "400"))                # Absolute floor for "voiced" (int16 RMS)
+VAD_NOISE_FACTOR = float(os.getenv("VAD_NOISE_FACTOR", "3"))        # Voiced = this many times the noise floor
+VAD_PAD_MS = 200                                                    # Keep a little context around speech
+VAD_MAX_GAP_MS = int(os.getenv("VAD_MAX_GAP_MS", "700"))            # Longer pauses inside speech get shortened
+NORMALIZE_PEAK = 0.9                                                # Target peak (fraction of full scale)
+
+
+def frame_rms(samples: np.ndarray, frame_len: int) -> np.ndarray:
+    """
+    AC RMS of each complete frame of frame_len samples (int16 scale).
+    The per-frame mean is removed first: the PDM mic has a large DC offset
+    that would otherwise swamp the speech energy.
+    """
+    usable = len(samples) - len(samples) % frame_len
+    if usable == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = samples[:usable].reshape(-1, frame_len).astype(np.float32)
+    frames -= frames.mean(axis=1, keepdims=True)
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+
+def parse_wav(data: bytes):
+    """
+    Parse a PCM WAV, trusting the real payload length over the header.
+    The firmware always writes a data size for the full RECORD_TIME, so the
+    header length is clamped to what actually arrived.
+    Returns (channels, sample_rate, sample_width, pcm_bytes).
+    """
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("Not a RIFF/WAVE file")
+
+    channels, sample_rate, sample_width = 1, 16000, 2
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        chunk_size = struct.unpack("<I", data[pos + 4:pos + 8])[0]
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            _, channels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", data[body:body + 16])
+            sample_width = bits // 8
+        elif chunk_id == b"data":
+            end = min(body + chunk_size, len(data))
+            frame = channels * sample_width
+            end -= (end - body) % frame
+            return channels, sample_rate, sample_width, data[body:end]
+        pos = body + chunk_size + (chunk_size & 1)
+
+    raise ValueError("WAV has no data chunk")
+
+
+def _to_wav(samples: np.ndarray, sample_rate: int) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(samples.astype("<i2").tobytes())
+    return buf.getvalue()
+
+
+def voiced_mask(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Per-frame voice activity from frame energy against an adaptive noise floor."""
+    frame_len = sample_rate * VAD_FRAME_MS // 1000
+    rms = frame_rms(samples, frame_len)
+    if len(rms) == 0:
+        return np.zeros(0, dtype=bool)
+    noise_floor = np.percentile(rms, 10)
+    threshold = max(VAD_MIN_RMS, noise_floor * VAD_NOISE_FACTOR)
+    return rms >= threshold
+
+
+def preprocess_wav(data: bytes, normalize: bool = True, max_gap_ms: int = VAD_MAX_GAP_MS):
+    """
+    Repair, downmix, trim and (optionally) normalize an uploaded WAV before STT.
+    Returns (wav_bytes or None if no speech was found, stats dict).
+    """
+    channels, sample_rate, sample_width, pcm = parse_wav(data)
+    if sample_width != 2:
+        raise ValueError(f"Unsupported sample width: {sample_width * 8} bits")
+
+    samples = np.frombuffer(pcm, dtype="<i2")
+    if channels > 1:
+        # Downmix to mono
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+
+    # Remove the mic's DC offset so trimming and normalization see real signal levels
+    samples = np.clip(samples - np.rint(samples.mean()), -32768, 32767).astype(np.int16)
+
+    frame_len = sample_rate * VAD_FRAME_MS // 1000
+    voiced = voiced_mask(samples, sample_rate)
+    stats = {
+        "bytes_in": len(data),
+        "duration_in": round(len(samples) / sample_rate, 2),
+    }
+
+    if not voiced.any():
+        stats.update(bytes_out=0, bytes_saved=len(data), duration_out=0.0, speech=False)
+        return None, stats
+
+    # Keep everything from the first word's onset to the last word's tail (with padding)
+    pad = max(1, VAD_PAD_MS // VAD_FRAME_MS)
+    voiced_at = np.flatnonzero(voiced)
+    first = max(0, voiced_at[0] - pad)
+    last = min(len(voiced) - 1, voiced_at[-1] + pad)
+    keep = np.zeros(len(voiced), dtype=bool)
+    keep[first:last + 1] = True
+
+    # Shorten each pause longer than max_gap to max_gap. The cut is taken from inside
+    # the pause, leaving the next word its lead-in; shorter pauses pass untouched.
+    max_gap = max(1, max_gap_ms // VAD_FRAME_MS)
+    lead = min(pad, max_gap // 2)
+    gaps = np.diff(voiced_at) - 1
+    for k in np.flatnonzero(gaps > max_gap):
+        gap_start, gap_end = voiced_at[k] + 1, voiced_at[k + 1]
+        keep[gap_start + max_gap - lead:gap_end - lead] = False
+
+    frame_keep = np.repeat(keep, frame_len)
+    trimmed = samples[:len(frame_keep)][frame_keep]
+
+    if normalize and len(trimmed):
+        peak = np.abs(trimmed.astype(np.int32)).max()
+        if peak > 0:
+            gain = NORMALIZE_PEAK * 32767 / peak
+            trimmed = np.clip(trimmed.astype(np.float32) * gain, -32768, 32767).astype(np.int16)
+
+    out = _to_wav(trimmed, sample_rate)
+    stats.update(
+        bytes_out=len(out),
+        bytes_saved=len(data) - len(out),
+        duration_out=round(len(trimmed) / sample_rate, 2),
+        speech=True,
+    )
+    return out, stats
+
+
+def preprocess_wav_file(path: str, **kwargs):
+    """preprocess_wav() on a WAV on disk (the upload is never held in memory before this)."""
+    with open(path, "rb") as f:
+        return preprocess_wav(f.read(), **kwargs)
+
+
+def _self_check():
+    """Synthetic clip: tone, pause, tone. A short pause must survive intact, a long one shrink to max_gap."""
+    rate = 16000
+    tone = (8000 * np.sin(2 * np.pi * 440 * np.arange(rate) / rate)).astype(np.int16)
+
+    def clip(pause_ms):
+        silence = np.zeros(rate * pause_ms // 1000, dtype=np.int16)
+        return _to_wav(np.concatenate((silence, tone, silence, tone, silence)), rate)
+
+    pad_s = max(1, VAD_PAD_MS // VAD_FRAME_MS) * VAD_FRAME_MS / 1000
+    for pause_ms, max_gap_ms in ((300, 700), (3000, 700), (3000, 2000)):
+        _, stats = preprocess_wav(clip(pause_ms), max_gap_ms=max_gap_ms)
+        # Both tones, the pause (shortened only if over max_gap), the lead-in and the tail
+        want = 2 + min(pause_ms, max_gap_ms) / 1000 + 2 * pad_s
+        assert abs(stats["duration_out"] - want) <= 2 * VAD_FRAME_MS / 1000, (pause_ms, max_gap_ms, stats)
+        print(f"✅ {pause_ms} ms pause, max_gap {max_gap_ms} ms: {stats['duration_in']}s -> {stats['duration_out']}s")
+
+
+if __name__ == "__main__":
+    # python audio_preproc.py: check trimming and pause shortening on a synthetic clip
+    _self_check()
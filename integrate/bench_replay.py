@@ -0,0 +1,603 @@
+"""
+Replay benchmark for the Smart Glass server.
+
+Replays the recorded corpus (WAVs in audio_history/ and uploads/, JPEGs in
+uploads/) against server.app, with local stub servers standing in for
+ElevenLabs STT, Gemini, the MCP tools and Deepgram TTS. Each stub has its own
+injectable latency, so a run measures our pipeline rather than the vendors.
+
+Results (throughput, client-side latency per request kind and the server's
+per-stage percentiles) are printed and saved as JSON under bench_results/;
+pass --compare with an earlier file to see what regressed.
+
+Examples:
+    python bench_replay.py --requests 40 --concurrency 4
+    python bench_replay.py --rate 3 --requests 100 --gemini-ttft 900 --stt-latency 400
+    python bench_replay.py --compare bench_results/bench_2025-09-27_10-00-00.json
+"""
+import argparse
+import asyncio
+import datetime
+import glob
+import json
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import types as pytypes
+from aiohttp import web
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, "bench_results")
+
+# Stage series that matter most for run-to-run comparison
+KEY_STAGES = (
+    "request[endpoint=/upload_raw]",
+    "request[endpoint=/upload_image]",
+    "preprocess",
+    "stt",
+    "agent_stream",          # chat(), tool path
+    "direct_llm",            # chat(), routed past the agent
+    "gemini_vision",         # chat_with_image_native()
+    "gemini_vision_ttft",
+    "first_sentence",
+    "tts_ttfb",              # speak_text() / engine
+    "tts_playback",
+)
+
+# What the STT stub "hears"; the stub agent calls a tool for the email ones
+SCRIPTED_QUERIES = (
+    "What's the weather like today?",
+    "Check my top 5 recent emails.",
+    "Tell me something interesting about the moon.",
+    "Do I have any unread mail from Alex?",
+    "What am I looking at right now?",
+    "Read the text in front of me.",
+)
+TOOL_KEYWORDS = ("email", "mail", "inbox")
+
+STUB_ANSWER = (
+    "Here is what I found. The scene shows a desk with a laptop and a coffee mug. "
+    "There is a notebook on the left with some handwritten notes. "
+    "Let me know if you want more detail about any of it."
+)
+
+# Shaped like the Zapier and browser MCP servers' tools: what the direct path's cached prefix lists
+_ZAPIER_ARGS = {"instructions": {"type": "string", "description": "Instructions for running this tool. Any parameters "
+                                 "that are not given a value will be guessed based on the instructions."}}
+STUB_TOOLS = tuple(
+    pytypes.SimpleNamespace(name=name, description=description, args=args)
+    for name, description, args in (
+        *((f"gmail_{action}", f"Gmail: {action.replace('_', ' ')}. {detail}", _ZAPIER_ARGS) for action, detail in (
+            ("find_email", "Finds an email message matching a Gmail search string, newest first."),
+            ("send_email", "Creates and sends a new email message to one or more recipients."),
+            ("reply_to_email", "Sends a reply to an email message in its existing thread."),
+            ("create_draft", "Creates a draft email message without sending it."),
+            ("add_label_to_email", "Adds a label to an email message, creating the label if needed."),
+            ("archive_email", "Archives an email message, removing it from the inbox."),
+        )),
+        *((f"google_calendar_{action}", f"Google Calendar: {action.replace('_', ' ')}. {detail}", _ZAPIER_ARGS)
+          for action, detail in (
+            ("find_events", "Finds events in a calendar within a time range or matching a search term."),
+            ("quick_add_event", "Creates an event from a piece of text, like 'Lunch with Sam tomorrow at noon'."),
+            ("create_detailed_event", "Creates an event with attendees, location, reminders and description."),
+            ("update_event", "Updates the time, title, attendees or description of an existing event."),
+            ("delete_event", "Deletes an event, optionally notifying its attendees."),
+        )),
+        ("browser_navigate", "Navigate the browser to a URL.",
+         {"url": {"type": "string", "description": "The URL to navigate to"}}),
+        ("browser_snapshot", "Capture an accessibility snapshot of the current page; better than a screenshot.", {}),
+        ("browser_click", "Perform a click on an element of the page.",
+         {"element": {"type": "string", "description": "Human-readable element description used to obtain permission"},
+          "ref": {"type": "string", "description": "Exact target element reference from the page snapshot"}}),
+        ("browser_type", "Type text into an editable element.",
+         {"element": {"type": "string", "description": "Human-readable element description used to obtain permission"},
+          "ref": {"type": "string", "description": "Exact target element reference from the page snapshot"},
+          "text": {"type": "string", "description": "Text to type into the element"},
+          "submit": {"type": "boolean", "description": "Whether to submit the entered text (press Enter after)"}}),
+        ("browser_search", "Search the web and return the result page's snapshot.",
+         {"query": {"type": "string", "description": "The search query"}}),
+        ("browser_go_back", "Go back to the previous page.", {}),
+        ("browser_wait", "Wait for a specified time in seconds.",
+         {"time": {"type": "number", "description": "The time to wait in seconds"}}),
+    )
+)
+
+
+def _percentiles(values) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+    return {
+        "count": len(ordered),
+        "avg_ms": round(sum(ordered) / len(ordered), 1),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1], 1),
+    }
+
+
+class StubLatency:
+    """Fixed latency in ms plus uniform +/- jitter (a fraction of it)."""
+
+    def __init__(self, ms: float, jitter: float):
+        self.ms = ms
+        self.jitter = jitter
+
+    async def sleep(self, scale: float = 1.0):
+        ms = self.ms * scale
+        if ms > 0:
+            await asyncio.sleep(max(0.0, random.uniform(ms * (1 - self.jitter), ms * (1 + self.jitter))) / 1000)
+
+
+class StubServers:
+    """
+    One aiohttp app serving all vendor stubs on a local port:
+      POST /v1/speech-to-text                      ElevenLabs STT
+      POST /v1beta/models/{model}:{method}         Gemini (streamGenerateContent SSE / generateContent)
+      GET  /v1beta/models/{model}                  Gemini model lookup (pre-warm)
+      POST|PATCH|DELETE /v1beta/cachedContents     Gemini context caches
+      POST /mcp/tools/{tool}                       MCP tool calls
+      POST /v1/speak                               Deepgram TTS (raw 24 kHz PCM, chunked)
+    """
+
+    def __init__(self, args):
+        self.stt = StubLatency(args.stt_latency, args.jitter)
+        self.gemini_ttft = StubLatency(args.gemini_ttft, args.jitter)
+        self.gemini_chunk = StubLatency(args.gemini_chunk_ms, args.jitter)
+        self.mcp = StubLatency(args.mcp_latency, args.jitter)
+        self.tts_ttfb = StubLatency(args.tts_ttfb, args.jitter)
+        self.tts_chunk = StubLatency(args.tts_chunk_ms, args.jitter)
+        self.calls = {"stt": 0, "gemini": 0, "gemini_cached": 0, "caches": 0, "mcp": 0, "tts": 0}
+        self.caches = {}   # cache name -> token count
+        self._runner = None
+        self.url = None
+
+    async def start(self, port: int = 0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/speech-to-text", self.speech_to_text)
+        app.router.add_post("/v1beta/models/{target}", self.gemini)
+        app.router.add_get("/v1beta/models/{target}", self.gemini_model)
+        app.router.add_post("/v1beta/cachedContents", self.create_cache)
+        app.router.add_patch("/v1beta/cachedContents/{cache}", self.update_cache)
+        app.router.add_delete("/v1beta/cachedContents/{cache}", self.delete_cache)
+        app.router.add_post("/mcp/tools/{tool}", self.mcp_tool)
+        app.router.add_post("/v1/speak", self.speak)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def speech_to_text(self, request):
+        self.calls["stt"] += 1
+        body = await request.read()
+        await self.stt.sleep()
+        text = SCRIPTED_QUERIES[sum(body[-64:]) % len(SCRIPTED_QUERIES)]
+        return web.json_response({
+            "language_code": "eng",
+            "language_probability": 0.99,
+            "text": text,
+            "words": [],
+        })
+
+    async def gemini(self, request):
+        self.calls["gemini"] += 1
+        # A request on a context cache reports the cached prefix as cached input tokens
+        cached_tokens = self.caches.get((await request.json()).get("cachedContent"), 0)
+        self.calls["gemini_cached"] += bool(cached_tokens)
+        method = request.match_info["target"].rsplit(":", 1)[-1]
+        await self.gemini_ttft.sleep()
+        if method != "streamGenerateContent":
+            return web.json_response(_gemini_chunk(STUB_ANSWER, cached_tokens))
+
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        words = STUB_ANSWER.split(" ")
+        step = max(1, len(words) // 4)
+        try:
+            await resp.prepare(request)
+            for i in range(0, len(words), step):
+                if i:
+                    await self.gemini_chunk.sleep()
+                text = " ".join(words[i:i + step]) + ("" if i + step >= len(words) else " ")
+                await resp.write(b"data: " + json.dumps(_gemini_chunk(text, cached_tokens)).encode() + b"\r\n\r\n")
+            await resp.write_eof()
+        except ConnectionResetError:
+            pass
+        return resp
+
+    async def gemini_model(self, request):
+        return web.json_response({"name": f"models/{request.match_info['target']}"})
+
+    async def create_cache(self, request):
+        self.calls["caches"] += 1
+        body = await request.json()
+        name = f"cachedContents/stub-{len(self.caches) + 1}"
+        self.caches[name] = max(1, len(json.dumps(body.get("systemInstruction", ""))) // 4)
+        return web.json_response(self._cache_info(name, body.get("model", "")))
+
+    async def update_cache(self, request):
+        name = f"cachedContents/{request.match_info['cache']}"
+        if name not in self.caches:
+            return web.json_response({"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}}, status=404)
+        return web.json_response(self._cache_info(name, ""))
+
+    async def delete_cache(self, request):
+        self.caches.pop(f"cachedContents/{request.match_info['cache']}", None)
+        return web.json_response({})
+
+    def _cache_info(self, name: str, model: str) -> dict:
+        expire = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        return {"name": name, "model": model, "expireTime": expire.isoformat(),
+                "usageMetadata": {"totalTokenCount": self.caches[name]}}
+
+    async def mcp_tool(self, request):
+        self.calls["mcp"] += 1
+        await request.read()
+        await self.mcp.sleep()
+        return web.json_response({
+            "tool": request.match_info["tool"],
+            "content": [{"type": "text", "text": "3 messages: invoice, meeting notes, newsletter"}],
+        })
+
+    async def speak(self, request):
+        self.calls["tts"] += 1
+        text = (await request.json()).get("text", "")
+        await self.tts_ttfb.sleep()
+        resp = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+        # ~60 ms of speech per character, as a quiet tone rather than digital silence
+        samples = int(24000 * 0.06 * max(1, len(text)))
+        tone = struct.pack("<8h", 0, 700, 1000, 700, 0, -700, -1000, -700)
+        pcm = (tone * (samples // 8 + 1))[:samples * 2]
+        try:
+            await resp.prepare(request)
+            for i in range(0, len(pcm), 4800):
+                if i:
+                    await self.tts_chunk.sleep()
+                await resp.write(pcm[i:i + 4800])
+            await resp.write_eof()
+        except ConnectionResetError:
+            pass   # Playback was cancelled (barge-in) and the client hung up
+        return resp
+
+
+def _gemini_chunk(text: str, cached_tokens: int = 0) -> dict:
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}],
+        "usageMetadata": {"promptTokenCount": 300 + cached_tokens, "cachedContentTokenCount": cached_tokens,
+                          "candidatesTokenCount": len(text) // 4},
+        "modelVersion": "gemini-2.5-flash",
+    }
+
+
+class StubAgent:
+    """
+    Stands in for MCPAgent: same stream() shape (tool steps as (action, observation)
+    tuples, then the final answer as a string). Tool calls go to the MCP stub and the
+    answer comes from the Gemini stub, so both latencies show up in agent_stream.
+    """
+
+    def __init__(self, http: httpx.AsyncClient, gemini_client, model: str, tool_cache=None, prefix_cache=None):
+        self._http = http
+        self._gemini = gemini_client
+        self._model = model
+        self._tool_cache = tool_cache
+        self._prefix_cache = prefix_cache
+
+    async def stream(self, query, max_steps=30, **kwargs):
+        if any(k in query.lower() for k in TOOL_KEYWORDS):
+            tool_input = {"instructions": query}
+            call = lambda: self._http.post("/mcp/tools/gmail_find_email", json=tool_input)
+            if self._tool_cache is not None:
+                resp = await self._tool_cache.call("gmail_find_email", tool_input, call)
+            else:
+                resp = await call()
+            action = pytypes.SimpleNamespace(tool="gmail_find_email", tool_input=tool_input)
+            yield action, resp.text
+        response = await self._gemini.aio.models.generate_content(model=self._model, contents=query)
+        yield response.text
+
+    def tools(self) -> list:
+        return list(STUB_TOOLS)
+
+    async def stream_direct(self, query, system_prompt, cached_content=None):
+        from google.genai import types
+        config = types.GenerateContentConfig(
+            cached_content=cached_content, system_instruction=None if cached_content else system_prompt)
+        stream = await self._gemini.aio.models.generate_content_stream(model=self._model, contents=query, config=config)
+        usage = None
+        async for chunk in stream:
+            usage = chunk.usage_metadata or usage
+            if chunk.text:
+                yield chunk.text
+        if usage is not None and self._prefix_cache is not None:
+            # What the LangChain usage callback reports for the real direct path
+            self._prefix_cache.record_usage("direct", usage.prompt_token_count, usage.cached_content_token_count)
+
+
+def load_corpus(limit_audio: int = None):
+    audio = sorted(glob.glob(os.path.join(HERE, "uploads", "*.wav")))
+    audio += sorted(glob.glob(os.path.join(HERE, "audio_history", "*.wav")))
+    images = sorted(glob.glob(os.path.join(HERE, "uploads", "*.jpg")))
+    if limit_audio:
+        audio = audio[:limit_audio]
+    audio = [(os.path.basename(p), open(p, "rb").read()) for p in audio]
+    images = [(os.path.basename(p), open(p, "rb").read()) for p in images]
+    return audio, images
+
+
+class Replay:
+    """Builds the job list from the corpus and drives it at a fixed concurrency or arrival rate."""
+
+    def __init__(self, client: httpx.AsyncClient, audio, images, args):
+        self.client = client
+        self.audio = audio
+        self.images = images
+        self.args = args
+        self.latency = {"upload_raw": [], "upload_image": [], "audio_with_image": []}
+        self.ok = 0
+        self.failed = 0
+        self.errors = {}
+        self.rng = random.Random(args.seed)
+
+    def _jobs(self):
+        for i in range(self.args.requests):
+            with_image = bool(self.images) and self.rng.random() < self.args.image_ratio
+            # Drawn only when asked for, so runs without pre-warming keep their job sequence
+            prewarm = self.args.prewarm_ratio > 0 and self.rng.random() < self.args.prewarm_ratio
+            yield {
+                "index": i,
+                "audio": self.audio[i % len(self.audio)],
+                "image": self.images[i % len(self.images)] if with_image else None,
+                "prewarm": prewarm,
+            }
+
+    async def _post(self, kind, path, name, body, device_id):
+        start = time.perf_counter()
+        try:
+            resp = await self.client.post(path, content=body, headers={
+                "X-Filename": f"bench_{device_id}_{name}",
+                "X-Device-Id": device_id,
+            })
+            result = resp.json() if resp.status_code == 200 else {"success": False, "error": f"HTTP {resp.status_code}"}
+        except Exception as e:
+            result = {"success": False, "error": type(e).__name__}
+        self.latency[kind].append((time.perf_counter() - start) * 1000)
+        return result
+
+    async def run_job(self, job, device_id):
+        kind = "upload_raw"
+        if job["prewarm"]:
+            # What the firmware sends when it takes the photo / starts recording
+            await self.client.post("/session_start", params={"kind": "photo" if job["image"] else "audio"},
+                                   headers={"X-Device-Id": device_id})
+        if job["image"] is not None:
+            name, data = job["image"]
+            result = await self._post("upload_image", "/upload_image", name, data, device_id)
+            if not result.get("success"):
+                self._fail(result)
+                return
+            kind = "audio_with_image"
+        name, data = job["audio"]
+        if job["prewarm"]:
+            await asyncio.sleep(self.args.speak_ms / 1000)
+        result = await self._post(kind, "/upload_raw", name, data, device_id)
+        if result.get("success"):
+            self.ok += 1
+        else:
+            self._fail(result)
+
+    def _fail(self, result):
+        self.failed += 1
+        error = str(result.get("error") or "unknown")[:80]
+        self.errors[error] = self.errors.get(error, 0) + 1
+
+    async def closed_loop(self):
+        """`concurrency` workers, each its own device, taking the next job as soon as one finishes."""
+        jobs = iter(self._jobs())
+
+        async def worker(n):
+            for job in jobs:
+                await self.run_job(job, f"bench-{n}")
+
+        await asyncio.gather(*(worker(n) for n in range(self.args.concurrency)))
+
+    async def open_loop(self):
+        """Poisson arrivals at `rate` req/s; at most `concurrency` jobs in flight (the rest queue)."""
+        limit = asyncio.Semaphore(self.args.concurrency)
+        tasks = []
+
+        async def one(job):
+            async with limit:
+                await self.run_job(job, f"bench-{job['index'] % self.args.concurrency}")
+
+        for job in self._jobs():
+            tasks.append(asyncio.create_task(one(job)))
+            await asyncio.sleep(self.rng.expovariate(self.args.rate))
+        await asyncio.gather(*tasks)
+
+
+async def _wait_for_tts(client: httpx.AsyncClient, timeout: float = 120):
+    """Replies keep speaking after the HTTP response; wait for the engine to drain."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        tts = (await client.get("/status")).json().get("tts", {})
+        if not tts.get("queue_depth") and not tts.get("speaking"):
+            return
+        await asyncio.sleep(0.2)
+
+
+async def run(args) -> dict:
+    stubs = StubServers(args)
+    await stubs.start(args.stub_port)
+
+    # Point the server's vendor clients at the stubs before anything imports them
+    os.environ["ELEVENLABS_BASE_URL"] = stubs.url
+    os.environ["DEEPGRAM_BASE_URL"] = stubs.url
+    os.environ.setdefault("TTS_PLAYBACK", "0")
+    os.environ.setdefault("TRACE_LOG", "0")
+    # The stub prompts are far below Gemini's explicit-cache minimum; cache them anyway
+    os.environ.setdefault("PROMPT_CACHE_MIN_TOKENS", "0")
+
+    audio, images = load_corpus(args.limit_audio)
+    if not audio:
+        raise SystemExit("No WAV files found in audio_history/ or uploads/")
+
+    # Run in a scratch directory so uploads, TTS output and the TTS cache never touch the corpus
+    workdir = tempfile.mkdtemp(prefix="wave_lens_bench_")
+    os.chdir(workdir)
+    sys.path.insert(0, HERE)
+    import server
+    from google import genai
+    from google.genai import types
+
+    stub_http = httpx.AsyncClient(base_url=stubs.url, timeout=60)
+    server.gemini_client = genai.Client(api_key="bench", http_options=types.HttpOptions(base_url=stubs.url))
+    server.agent = StubAgent(stub_http, server.gemini_client, server.VISION_MODEL, server.tool_cache, server.prefix_cache)
+    server.prefix_cache.attach(server.gemini_client)
+    server.sessions.start()
+    await server.tts_engine.start()
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench", timeout=300)
+    replay = Replay(client, audio, images, args)
+    print(f"▶️ Replaying {args.requests} requests ({len(audio)} WAVs, {len(images)} JPEGs), "
+          + (f"{args.rate}/s arrivals" if args.rate else "closed loop")
+          + f", concurrency {args.concurrency}")
+    start = time.perf_counter()
+    try:
+        if args.rate:
+            await replay.open_loop()
+        else:
+            await replay.closed_loop()
+        elapsed = time.perf_counter() - start
+        await _wait_for_tts(client)
+        stages = (await client.get("/metrics/summary")).json()
+        status = (await client.get("/status")).json()
+    finally:
+        await client.aclose()
+        await stub_http.aclose()
+        await server.close_stt_clients()
+        await server.tts_engine.stop()
+        await server.sessions.stop()
+        await stubs.stop()
+        os.chdir(HERE)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output")},
+        "corpus": {"audio_files": len(audio), "images": len(images)},
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(args.requests / elapsed, 2) if elapsed else None,
+        "requests": {"total": args.requests, "ok": replay.ok, "failed": replay.failed, "errors": replay.errors},
+        "latency": {kind: _percentiles(values) for kind, values in replay.latency.items()},
+        "stages": stages,
+        "stub_calls": stubs.calls,
+        "tts": status.get("tts"),
+        "vision_cache": status.get("vision_cache"),
+        "tool_cache": status.get("tool_cache"),
+        "prompt_cache": status.get("prompt_cache"),
+        "prewarm": status.get("prewarm"),
+    }
+
+
+def print_report(result: dict):
+    print(f"\n📊 {result['requests']['ok']}/{result['requests']['total']} ok in {result['elapsed_s']}s "
+          f"-> {result['throughput_rps']} req/s")
+    for error, count in result["requests"]["errors"].items():
+        print(f"   ❌ {count}x {error}")
+    print(f"\n{'client latency':<36}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for kind, p in result["latency"].items():
+        if p["count"]:
+            print(f"{kind:<36}{p['count']:>7}{p['p50_ms']:>9}{p['p95_ms']:>9}{p['p99_ms']:>9}")
+    print(f"\n{'server stage':<36}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, p in result["stages"].items():
+        print(f"{name:<36}{p['count']:>7}{str(p['p50_ms']):>9}{str(p['p95_ms']):>9}{str(p['p99_ms']):>9}")
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> list:
+    """Print p50/p95 deltas against a baseline run; returns the regressed series."""
+    regressions = []
+    rows = [(f"client {k}", v, baseline.get("latency", {}).get(k)) for k, v in result["latency"].items()]
+    rows += [(k, result["stages"].get(k), baseline.get("stages", {}).get(k)) for k in KEY_STAGES]
+    print(f"\n{'vs baseline (' + baseline.get('timestamp', '?') + ')':<36}{'p50':>16}{'p95':>16}")
+    for name, now, before in rows:
+        if not now or not before or not now.get("count") or not before.get("count"):
+            continue
+        cells = []
+        for q in ("p50_ms", "p95_ms"):
+            old, new = before[q], now[q]
+            change = (new - old) / old if old else 0.0
+            if q == "p95_ms" and change > threshold:
+                regressions.append(name)
+            cells.append(f"{old:.0f}->{new:.0f} {change:+.0%}")
+        print(f"{name:<36}{cells[0]:>16}{cells[1]:>16}{'  ⚠️' if name in regressions else ''}")
+    if baseline.get("throughput_rps"):
+        print(f"{'throughput (req/s)':<36}{baseline['throughput_rps']:>8} -> {result['throughput_rps']}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the recorded corpus against server.app with stubbed vendors.")
+    load = parser.add_argument_group("load")
+    load.add_argument("--requests", type=int, default=30, help="Audio uploads to replay")
+    load.add_argument("--concurrency", type=int, default=4, help="Parallel devices / max jobs in flight")
+    load.add_argument("--rate", type=float, default=0, help="Open-loop Poisson arrival rate (req/s); 0 = closed loop")
+    load.add_argument("--image-ratio", type=float, default=0.3, help="Fraction of uploads preceded by a photo")
+    load.add_argument("--prewarm-ratio", type=float, default=0, help="Fraction of uploads preceded by POST /session_start")
+    load.add_argument("--speak-ms", type=float, default=1000, help="Time between /session_start and the audio upload")
+    load.add_argument("--limit-audio", type=int, default=None, help="Use only the first N WAVs")
+    load.add_argument("--seed", type=int, default=1)
+    stubs = parser.add_argument_group("stub latency (ms)")
+    stubs.add_argument("--stt-latency", type=float, default=300)
+    stubs.add_argument("--gemini-ttft", type=float, default=600)
+    stubs.add_argument("--gemini-chunk-ms", type=float, default=80)
+    stubs.add_argument("--mcp-latency", type=float, default=400)
+    stubs.add_argument("--tts-ttfb", type=float, default=150)
+    stubs.add_argument("--tts-chunk-ms", type=float, default=10)
+    stubs.add_argument("--jitter", type=float, default=0.2, help="Uniform +/- fraction applied to every stub latency")
+    stubs.add_argument("--stub-port", type=int, default=0, help="Port for the stub servers (0 = any free port)")
+    out = parser.add_argument_group("output")
+    out.add_argument("--output", default=None, help="Result JSON path (default bench_results/bench_<time>.json)")
+    out.add_argument("--compare", default=None, help="Earlier result JSON to compare against")
+    out.add_argument("--threshold", type=float, default=0.10, help="p95 increase counted as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    result = asyncio.run(run(args))
+    print_report(result)
+
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        output = os.path.join(RESULTS_DIR, f"bench_{stamp}.json")
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\n💾 Results saved to {output}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        if regressions:
+            print(f"⚠️ p95 regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,7 +5,10 @@ from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
 from prompt import SYSTEM_PROMPT, STARTUP_PROMPT
 from mcp_use import MCPAgent, MCPClient
-from streaming_tts import speak_text  
+from streaming_tts import speak_text
+from speech_pipeline import SpeechPipeline
+from agent_memory import AgentMemory
+from tool_cache import ToolResultCache
 
 async def main():
     load_dotenv()
@@ -18,18 +21,24 @@ async def main():
         temperature=0.0
     )
 
-    agent = MCPAgent(
+    agent = AgentMemory(MCPAgent(
         llm=llm,
         client=client,
         max_steps=100,
         memory_enabled=True,
         system_prompt=SYSTEM_PROMPT
-    )
+    ))
     
     print("Welcome to Smart Glass Chatbot! Type 'exit' to quit.\n")
     # Initial startup message
     start_startup = time.time()
     response = await agent.run(STARTUP_PROMPT)
+    agent.pin()
+    # Tools in name order: the same prefix every turn, so Gemini can cache it
+    await agent.refresh_prefix(SYSTEM_PROMPT)
+    # Sessions exist once the first run has initialized the agent
+    tool_cache = ToolResultCache()
+    tool_cache.attach(client)
     end_startup = time.time()
     print("Startup AI Response:", response)
     print(f"⏱ Startup response time: {end_startup - start_startup:.2f} seconds\n")
@@ -42,11 +51,11 @@ async def main():
             break
 
         query_start = time.time()  # Start timer for user query
-        final_response = ""
+        pipeline = SpeechPipeline()  # Speaks each sentence as soon as it is complete
         async for step in agent.stream(user_input, max_steps=30):
             if isinstance(step, str):
                 print("AI:", step)
-                final_response += step + " "  # Collect LLM response text
+                pipeline.feed(step + " ")
             else:
                 action, observation = step
                 print("Calling:", action.tool)
@@ -58,11 +67,11 @@ async def main():
 
         query_end = time.time()  # End timer for user query
         elapsed = query_end - query_start
-        print(f"⏱ Time taken for this query: {elapsed:.2f} seconds\n")
+        print(f"⏱ Time taken for this query: {elapsed:.2f} seconds (context: {agent.last_context_tokens} tokens)\n")
 
-        # Speak full LLM response after streaming finishes
-        if final_response.strip():
-            await speak_text(final_response)
+        # Wait for the last sentences to finish playing
+        pipeline.close()
+        await pipeline.wait()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,303 @@
+import asyncio
+import collections
+import io
+import os
+import time
+import aiohttp
+import numpy as np
+from PIL import Image
+from image_pipeline import dhash
+
+# Ingest settings
+INGEST_SAMPLE_FPS = float(os.getenv("INGEST_SAMPLE_FPS", "2"))        # Frames decoded per second (the device sends ~10)
+KEYFRAME_RING = int(os.getenv("KEYFRAME_RING", "8"))                  # Recent keyframes kept per device
+KEYFRAME_MAX_AGE = float(os.getenv("KEYFRAME_MAX_AGE", "5"))          # Seconds a keyframe still counts as "what I see"
+CHANGE_THRESHOLD = float(os.getenv("KEYFRAME_CHANGE_THRESHOLD", "0.08"))  # Mean abs difference (0-1) that starts a new scene
+SHARPER_MARGIN = 0.10              # A same-scene frame replaces the keyframe if this much sharper
+ANALYSIS_SIZE = (160, 120)         # Grayscale size frames are scored at
+MAX_FRAME_BYTES = 2 * 1024 * 1024  # Parser resyncs if a part grows past this
+INGEST_READ_TIMEOUT = 10           # Seconds without stream data before reconnecting
+INGEST_MAX_BACKOFF = 30            # Seconds between reconnect attempts, at most
+STREAM_PATH = "/stream"            # Where the firmware serves MJPEG (port 80)
+
+
+def boundary_from(content_type: str) -> bytes:
+    """Multipart boundary from a Content-Type header (the firmware uses 'frame')."""
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary" and value:
+            return value.strip('"').encode()
+    return b"frame"
+
+
+class MJPEGParser:
+    """
+    Incremental multipart/x-mixed-replace parser: feed() network chunks, get whole
+    JPEG parts back. Parts with a Content-Length are cut by length; others at the
+    next boundary.
+    """
+
+    def __init__(self, boundary: bytes):
+        # Some servers put the dashes in the boundary parameter itself
+        self._delimiter = boundary if boundary.startswith(b"--") else b"--" + boundary
+        self._buf = bytearray()
+        self._length = None        # Body length of the current part; -1 if unknown; None between parts
+        self.resyncs = 0
+
+    def feed(self, data) -> list:
+        self._buf += data
+        parts = []
+        while True:
+            if self._length is None:
+                start = self._buf.find(self._delimiter)
+                if start < 0:
+                    del self._buf[:max(0, len(self._buf) - len(self._delimiter))]
+                    break
+                end = self._buf.find(b"\r\n\r\n", start)
+                if end < 0:
+                    del self._buf[:start]
+                    break
+                self._length = -1
+                for line in bytes(self._buf[start + len(self._delimiter):end]).split(b"\r\n"):
+                    name, _, value = line.partition(b":")
+                    if name.strip().lower() == b"content-length" and value.strip().isdigit():
+                        self._length = int(value)
+                del self._buf[:end + 4]
+            if self._length >= 0:
+                if len(self._buf) < self._length:
+                    break
+                parts.append(bytes(self._buf[:self._length]))
+                del self._buf[:self._length]
+            else:
+                end = self._buf.find(b"\r\n" + self._delimiter)
+                if end < 0:
+                    if len(self._buf) > MAX_FRAME_BYTES:
+                        self._resync()
+                    break
+                parts.append(bytes(self._buf[:end]))
+                del self._buf[:end + 2]
+            self._length = None
+        if self._length is not None and self._length > MAX_FRAME_BYTES:
+            self._resync()
+        return parts
+
+    def _resync(self):
+        self._buf.clear()
+        self._length = None
+        self.resyncs += 1
+
+
+def analyze_frame(jpeg: bytes):
+    """
+    Decode a JPEG at reduced scale (libjpeg DCT scaling via draft mode, so an SVGA
+    frame costs about a sixteenth of a full decode) and score it.
+    Returns (gray float32 array at ANALYSIS_SIZE, sharpness, dhash).
+    """
+    image = Image.open(io.BytesIO(jpeg))
+    image.draft("L", ANALYSIS_SIZE)
+    small = image.convert("L").resize(ANALYSIS_SIZE, Image.BILINEAR)
+    gray = np.asarray(small, dtype=np.float32)
+    # Variance of the Laplacian: low for motion blur and defocus
+    laplacian = (4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1]
+                 - gray[1:-1, :-2] - gray[1:-1, 2:])
+    return gray, float(laplacian.var()), dhash(small)
+
+
+class Keyframe:
+    """One kept frame: the original JPEG plus its scores."""
+
+    __slots__ = ("jpeg", "captured_at", "confirmed_at", "sharpness", "change", "phash", "_gray")
+
+    def __init__(self, jpeg: bytes, gray, sharpness: float, change: float, phash: int):
+        self.jpeg = jpeg
+        self.captured_at = time.time()
+        self.confirmed_at = self.captured_at   # Last time a frame of the same scene was seen
+        self.sharpness = sharpness
+        self.change = change
+        self.phash = phash
+        self._gray = gray
+
+    def age(self) -> float:
+        return time.time() - self.confirmed_at
+
+    def info(self) -> dict:
+        return {
+            "bytes": len(self.jpeg),
+            "age_s": round(self.age(), 1),
+            "sharpness": round(self.sharpness, 1),
+            "change": round(self.change, 3),
+        }
+
+
+class FrameIngester:
+    """
+    Follows one device's MJPEG stream in the background. Every frame is parsed but
+    only INGEST_SAMPLE_FPS of them are decoded and scored. A frame that differs
+    enough from the newest keyframe starts a new one (a scene change); a sharper
+    frame of the same scene replaces it, so the newest keyframe is always the best
+    view of what the wearer is looking at now. Reconnects with backoff.
+    """
+
+    def __init__(self, device_id: str, url: str, sample_fps: float = INGEST_SAMPLE_FPS,
+                 ring: int = KEYFRAME_RING):
+        self.device_id = device_id
+        self.url = url
+        self.sample_interval = 1 / sample_fps if sample_fps > 0 else 0
+        self.keyframes = collections.deque(maxlen=ring)
+        self.connected = False
+        self.last_error = None
+        self._task = None
+        self._last_sample = 0.0
+        self.frames_seen = 0
+        self.frames_decoded = 0
+        self.decode_failures = 0
+        self.keyframes_added = 0
+        self.keyframes_replaced = 0
+        self.reconnects = 0
+        self.bytes_received = 0
+        self.analyze_ms = 0.0
+
+    def start(self, http: aiohttp.ClientSession):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(http))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.connected = False
+
+    def best_frame(self, max_age: float = KEYFRAME_MAX_AGE):
+        """Newest keyframe if its scene was seen within max_age seconds, else None."""
+        if not self.keyframes:
+            return None
+        frame = self.keyframes[-1]
+        return frame if frame.age() <= max_age else None
+
+    async def _run(self, http):
+        backoff = 1
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=INGEST_READ_TIMEOUT)
+        while True:
+            try:
+                async with http.get(self.url, timeout=timeout) as resp:
+                    resp.raise_for_status()
+                    parser = MJPEGParser(boundary_from(resp.headers.get("Content-Type", "")))
+                    self.connected = True
+                    self.last_error = None
+                    backoff = 1
+                    print(f"📹 Ingesting {self.url} for {self.device_id}")
+                    async for data in resp.content.iter_any():
+                        self.bytes_received += len(data)
+                        for jpeg in parser.feed(data):
+                            await self._on_frame(jpeg)
+                self.last_error = "stream ended"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e) or type(e).__name__
+            self.connected = False
+            self.reconnects += 1
+            print(f"⚠️ Stream from {self.device_id} lost ({self.last_error}), retrying in {backoff}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, INGEST_MAX_BACKOFF)
+
+    async def _on_frame(self, jpeg: bytes):
+        self.frames_seen += 1
+        now = time.monotonic()
+        if now - self._last_sample < self.sample_interval:
+            return
+        self._last_sample = now
+        start = time.perf_counter()
+        try:
+            gray, sharpness, phash = await asyncio.to_thread(analyze_frame, jpeg)
+        except Exception:
+            self.decode_failures += 1
+            return
+        self.analyze_ms += (time.perf_counter() - start) * 1000
+        self.frames_decoded += 1
+        self._select(jpeg, gray, sharpness, phash)
+
+    def _select(self, jpeg, gray, sharpness, phash):
+        newest = self.keyframes[-1] if self.keyframes else None
+        change = float(np.abs(gray - newest._gray).mean() / 255) if newest is not None else 1.0
+        if newest is None or change >= CHANGE_THRESHOLD:
+            self.keyframes.append(Keyframe(jpeg, gray, sharpness, change, phash))
+            self.keyframes_added += 1
+        elif sharpness > newest.sharpness * (1 + SHARPER_MARGIN):
+            self.keyframes[-1] = Keyframe(jpeg, gray, sharpness, newest.change, phash)
+            self.keyframes_replaced += 1
+        else:
+            newest.confirmed_at = time.time()
+
+    def get_stats(self) -> dict:
+        best = self.best_frame()
+        return {
+            "url": self.url,
+            "connected": self.connected,
+            "last_error": self.last_error,
+            "frames_seen": self.frames_seen,
+            "frames_decoded": self.frames_decoded,
+            "decode_failures": self.decode_failures,
+            "keyframes": len(self.keyframes),
+            "keyframes_added": self.keyframes_added,
+            "keyframes_replaced": self.keyframes_replaced,
+            "reconnects": self.reconnects,
+            "bytes_received": self.bytes_received,
+            "analyze_ms_avg": round(self.analyze_ms / self.frames_decoded, 2) if self.frames_decoded else None,
+            "best_frame": best.info() if best is not None else None,
+        }
+
+
+class IngestManager:
+    """One FrameIngester per device, sharing one HTTP session."""
+
+    def __init__(self):
+        self._ingesters = {}
+        self._http = None
+
+    def start(self, device_id: str, url: str) -> FrameIngester:
+        ingester = self._ingesters.get(device_id)
+        if ingester is not None and ingester.url == url:
+            return ingester
+        if ingester is not None:
+            asyncio.create_task(ingester.stop())
+        if self._http is None:
+            self._http = aiohttp.ClientSession()
+        ingester = self._ingesters[device_id] = FrameIngester(device_id, url)
+        ingester.start(self._http)
+        return ingester
+
+    def start_configured(self, config: str):
+        """Start ingesters from 'device=url,device=url' (the MJPEG_STREAMS setting)."""
+        for item in filter(None, (part.strip() for part in config.split(","))):
+            device_id, _, url = item.partition("=")
+            if url:
+                self.start(device_id.strip(), url.strip())
+
+    async def stop(self, device_id: str) -> bool:
+        ingester = self._ingesters.pop(device_id, None)
+        if ingester is None:
+            return False
+        await ingester.stop()
+        return True
+
+    def get(self, device_id: str):
+        return self._ingesters.get(device_id)
+
+    def best_frame(self, device_id: str, max_age: float = KEYFRAME_MAX_AGE):
+        ingester = self._ingesters.get(device_id)
+        return ingester.best_frame(max_age) if ingester is not None else None
+
+    async def close(self):
+        for device_id in list(self._ingesters):
+            await self.stop(device_id)
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    def get_stats(self) -> dict:
+        return {device_id: ingester.get_stats() for device_id, ingester in self._ingesters.items()}
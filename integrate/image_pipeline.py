@@ -0,0 +1,111 @@
+import io
+import os
+import re
+import time
+import collections
+import numpy as np
+from PIL import Image, ImageOps
+
+# Vision preprocessing settings
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "640"))          # Longest side sent to Gemini (pixels)
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "75"))   # Recompression quality
+VISION_CACHE_TTL = float(os.getenv("VISION_CACHE_TTL", "300"))      # Seconds a cached answer stays valid
+VISION_CACHE_SIZE = 128                                             # Cached (image, prompt) answers
+NEAR_DUPLICATE_BITS = 6                                             # dHash distance still treated as "same scene"
+
+
+def dhash(image: Image.Image, size: int = 8) -> int:
+    """64-bit difference hash: robust to recompression, small shifts and exposure changes."""
+    gray = np.asarray(image.convert("L").resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def prepare_image(data: bytes):
+    """
+    Downscale and recompress a JPEG for upload and compute its perceptual hash.
+    Returns (jpeg_bytes, phash, stats). The original bytes are kept if
+    recompressing would not make them smaller.
+    """
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    phash = dhash(image)
+
+    original_size = image.size
+    image.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE), Image.LANCZOS)
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    out = buf.getvalue()
+    if len(out) >= len(data):
+        out = data
+
+    stats = {
+        "bytes_in": len(data),
+        "bytes_out": len(out),
+        "size_in": original_size,
+        "size_out": image.size if out is not data else original_size,
+    }
+    return out, phash, stats
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", prompt.lower()).split())
+
+
+class VisionCache:
+    """
+    LRU cache of (image hash, normalized prompt) -> answer with a TTL. A lookup
+    also matches near-duplicate frames of the same scene (small dHash distance).
+    """
+
+    def __init__(self, max_entries: int = VISION_CACHE_SIZE, ttl: float = VISION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()   # (phash, prompt) -> (answer, expires_at)
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def get(self, phash: int, prompt: str):
+        prompt = normalize_prompt(prompt)
+        now = time.time()
+        key = (phash, prompt)
+        entry = self._entries.get(key)
+        near = False
+        if entry is None:
+            # Near-duplicate frame with the same question
+            for (other_hash, other_prompt), candidate in self._entries.items():
+                if other_prompt == prompt and hamming(other_hash, phash) <= NEAR_DUPLICATE_BITS:
+                    key, entry = (other_hash, other_prompt), candidate
+                    near = True
+                    break
+        if entry is None or entry[1] < now:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.near_hits += near
+        return entry[0]
+
+    def put(self, phash: int, prompt: str, answer: str):
+        key = (phash, normalize_prompt(prompt))
+        self._entries[key] = (answer, time.time() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "near_duplicate_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
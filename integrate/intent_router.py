@@ -0,0 +1,105 @@
+import collections
+import os
+import re
+from metrics import registry as metrics_registry
+
+# Router settings
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") != "0"
+ROUTER_STATS_WINDOW = 50          # Recent turns per route used for the time-saved estimate
+ESCALATE_TOKEN = "NEEDS_TOOLS"    # What the direct model answers with when it can't help without tools
+
+# Requests that need a tool (Zapier/Gmail, browser, live data). Anything else is
+# small talk or a general question the model can answer without the tool schema.
+TOOL_RULES = {
+    "email": r"\b(e-?mails?|g-?mail|mails?|inbox|unread|send|reply|forward|draft|compose)\b",
+    "calendar": r"\b(calendar|meetings?|schedule|appointments?|remind(er)?s?|events?)\b",
+    "web": r"\b(search|google|look (it )?up|browse|website|web ?page|open|link|url|download)\b",
+    "live": r"\b(news|latest|current(ly)?|today'?s?|tonight|weather|forecast|price|stocks?|scores?|traffic)\b",
+    "apps": r"\b(zapier|slack|sheets?|spreadsheet|drive|docs?|notion|to-?do|tasks?|contacts?|whatsapp|message)\b",
+    "explicit": r"\b(use (the |a |your )?tools?|call (the |a )?tool)\b",
+}
+_TOOL_RE = {name: re.compile(pattern, re.IGNORECASE) for name, pattern in TOOL_RULES.items()}
+
+# Questions about what the wearer is looking at. Only these are answered from the
+# live video keyframe; everything else keeps the direct/agent path and its memory.
+VISUAL_RULE = (
+    r"\b(what('?s| is| are) (this|that|these|those|here|over there|in front of me)|"
+    r"what am i (looking at|seeing|holding|wearing)|(do|can) you see|what do you see|"
+    r"(look|looking) at (this|that|it|these|those)|in front of me|around me|"
+    r"describe (this|that|it|what)|identify|recogni[sz]e (this|that|it)|read (this|that|it|the)|"
+    r"what (colou?r|brand|kind|type|breed|model|language) (is|are)|who('?s| is) (this|that)|where am i|"
+    r"how many .+ (here|there|can you see)|"
+    r"this (sign|label|thing|object|plant|flower|dish|food|product|text|menu|screen|building|place|animal|car))\b"
+    r"|\b(is|are) (this|these)\W*$"   # "what kind of plant is this?"
+)
+_VISUAL_RE = re.compile(VISUAL_RULE, re.IGNORECASE)
+
+Decision = collections.namedtuple("Decision", "route reason")
+
+
+class IntentRouter:
+    """
+    Keyword router in front of the agent: tool requests go to the MCPAgent, small
+    talk and general questions to a direct, tool-free LLM call (no tool schema in the
+    prompt, no agent loop). The direct model can still hand a request back with
+    ESCALATE_TOKEN, so a missed keyword costs one short call rather than a wrong answer.
+    """
+
+    def __init__(self, enabled: bool = ROUTER_ENABLED):
+        self.enabled = enabled
+        self.counts = collections.Counter()
+        self._latency = {
+            "agent": collections.deque(maxlen=ROUTER_STATS_WINDOW),
+            "direct": collections.deque(maxlen=ROUTER_STATS_WINDOW),
+        }
+        self.saved_ms = 0.0
+
+    def decide(self, text: str) -> Decision:
+        if not self.enabled:
+            return Decision("agent", "router disabled")
+        for name, pattern in _TOOL_RE.items():
+            match = pattern.search(text)
+            if match:
+                return Decision("agent", f"{name}: '{match.group(0)}'")
+        return Decision("direct", "no tool keywords")
+
+    def needs_tools(self, text: str) -> bool:
+        """Tool keywords present, whether or not routing is enabled."""
+        return any(pattern.search(text) for pattern in _TOOL_RE.values())
+
+    def is_visual(self, text: str) -> bool:
+        """The question is about what the wearer sees (worth sending the current view)."""
+        return bool(_VISUAL_RE.search(text))
+
+    def record(self, decision: Decision, ms: float, escalated: bool = False):
+        """Log one routed turn and estimate the time saved against the agent path."""
+        route = "escalated" if escalated else decision.route
+        self.counts[route] += 1
+        metrics_registry.incr(f"route_{route}")
+        self._latency["direct" if route == "direct" else "agent"].append(ms)
+
+        saved = None
+        agent_avg = self._avg("agent")
+        if route == "direct" and agent_avg is not None:
+            saved = agent_avg - ms
+            self.saved_ms += saved
+        print(f"🧭 Route: {route} ({decision.reason}) in {ms:.0f} ms"
+              + (f", ~{saved:.0f} ms saved vs agent avg" if saved is not None else ""))
+        return saved
+
+    def _avg(self, route: str):
+        samples = self._latency[route]
+        return sum(samples) / len(samples) if samples else None
+
+    def get_stats(self) -> dict:
+        direct_avg = self._avg("direct")
+        agent_avg = self._avg("agent")
+        return {
+            "enabled": self.enabled,
+            "direct": self.counts["direct"],
+            "agent": self.counts["agent"],
+            "escalated": self.counts["escalated"],
+            "direct_avg_ms": round(direct_avg) if direct_avg is not None else None,
+            "agent_avg_ms": round(agent_avg) if agent_avg is not None else None,
+            "saved_ms": round(self.saved_ms),
+        }
@@ -0,0 +1,591 @@
+import asyncio
+import hashlib
+import io
+import json
+import lzma
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import wave
+import numpy as np
+
+# Storage settings
+STORAGE_ENABLED = os.getenv("STORAGE_ENABLED", "1") != "0"
+STORAGE_DIR = os.getenv("STORAGE_DIR", "storage")
+STORAGE_MAX_BYTES = int(os.getenv("STORAGE_MAX_BYTES", str(2 * 1024 ** 3)))              # Blobs on disk, all kinds
+STORAGE_MAX_AGE = float(os.getenv("STORAGE_MAX_AGE", str(30 * 24 * 3600)))               # Seconds a blob is kept
+INTERACTION_MAX_AGE = float(os.getenv("INTERACTION_MAX_AGE", str(365 * 24 * 3600)))      # Seconds index rows are kept
+COMPACT_AFTER = float(os.getenv("STORAGE_COMPACT_AFTER", str(6 * 3600)))                 # Seconds before audio is compressed
+MAINTENANCE_INTERVAL = float(os.getenv("STORAGE_MAINTENANCE_INTERVAL", "300"))           # Seconds between compaction/retention runs
+COMPACT_BATCH = 50                 # Audio files compressed per maintenance run
+STALE_CLAIM_SECONDS = 3600         # A compaction claim older than this was abandoned (worker died)
+HASH_CHUNK = 1024 * 1024
+
+WAVZ_MAGIC = b"WLZ2"                # Header and trailing bytes kept verbatim: decodes to the exact original file
+WAVZ_MAGIC_V1 = b"WLZ1"             # Samples only: decodes to an equivalent WAV with a fresh header
+WAVZ_EXT = ".wavz"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,              -- audio | image | reply
+    path TEXT NOT NULL,
+    codec TEXT NOT NULL,             -- wav | wavz | jpeg
+    bytes INTEGER NOT NULL,          -- on disk now
+    original_bytes INTEGER NOT NULL,
+    refs INTEGER NOT NULL DEFAULT 1,
+    created_at REAL NOT NULL,
+    last_used_at REAL,               -- latest upload or reply that stored this content; retention counts from it
+    compacting_since REAL
+);
+CREATE INDEX IF NOT EXISTS blobs_created ON blobs (created_at);
+CREATE INDEX IF NOT EXISTS blobs_compact ON blobs (codec, created_at);
+
+CREATE TABLE IF NOT EXISTS interactions (
+    id INTEGER PRIMARY KEY,
+    trace_id TEXT,
+    device_id TEXT,
+    endpoint TEXT,
+    created_at REAL NOT NULL,
+    transcript TEXT,
+    response TEXT,
+    with_image INTEGER NOT NULL DEFAULT 0,
+    success INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    audio_sha256 TEXT,
+    image_sha256 TEXT,
+    total_ms REAL,
+    timings TEXT                     -- JSON: stage -> ms
+);
+CREATE INDEX IF NOT EXISTS interactions_device_time ON interactions (device_id, created_at);
+CREATE INDEX IF NOT EXISTS interactions_time ON interactions (created_at);
+CREATE INDEX IF NOT EXISTS interactions_trace ON interactions (trace_id);
+
+CREATE TABLE IF NOT EXISTS replies (
+    trace_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (trace_id, position)
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS interactions_fts USING fts5(
+    transcript, response, content='interactions', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS interactions_ai AFTER INSERT ON interactions BEGIN
+    INSERT INTO interactions_fts (rowid, transcript, response) VALUES (new.id, new.transcript, new.response);
+END;
+CREATE TRIGGER IF NOT EXISTS interactions_ad AFTER DELETE ON interactions BEGIN
+    INSERT INTO interactions_fts (interactions_fts, rowid, transcript, response)
+    VALUES ('delete', old.id, old.transcript, old.response);
+END;
+"""
+
+
+# -- lossless audio compaction ----------------------------------------------
+
+def _pcm_span(data: bytes):
+    """(channels, sample width, rate, start, end) of a WAV's whole frames, trusting the bytes present over the header."""
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("not a RIFF/WAVE file")
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        size = struct.unpack("<I", data[pos + 4:pos + 8])[0]
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            tag, channels, rate, _, _, bits = struct.unpack("<HHIIHH", data[body:body + 16])
+            fmt = (tag, channels, rate, bits // 8)
+        elif chunk_id == b"data":
+            if fmt is None or fmt[0] != 1:
+                raise ValueError("not a PCM WAV")
+            _, channels, rate, width = fmt
+            end = min(body + size, len(data))
+            end -= (end - body) % (channels * width)
+            return channels, width, rate, body, end
+        pos = body + size + (size & 1)
+    raise ValueError("WAV has no data chunk")
+
+
+def compress_wav(data: bytes) -> bytes:
+    """
+    16-bit PCM WAV -> .wavz: second-order fixed prediction (as in FLAC's fixed
+    predictors), zigzag residuals split into byte planes, then LZMA. Roughly 55%
+    of the WAV on our recordings and TTS replies. The bytes around the samples
+    (header, odd trailing bytes, extra chunks) are kept as they are, so
+    decompress_wav gives back the exact file and its sha256 still addresses it.
+    """
+    channels, width, rate, start, end = _pcm_span(data)
+    if width != 2:
+        raise ValueError("only 16-bit PCM is compacted")
+    samples = np.frombuffer(data[start:end], dtype="<i2").astype(np.int32).reshape(-1, channels)
+    residual = np.diff(samples, n=2, axis=0, prepend=np.zeros((2, channels), dtype=np.int32))
+    zigzag = ((residual << 1) ^ (residual >> 31)).astype(np.uint32).ravel()
+    planes = b"".join(((zigzag >> shift) & 0xFF).astype(np.uint8).tobytes() for shift in (0, 8, 16))
+    head, tail = data[:start], data[end:]
+    header = WAVZ_MAGIC + struct.pack("<HHIIII", channels, width, rate, len(zigzag) // channels, len(head), len(tail))
+    return header + head + tail + lzma.compress(planes, preset=6)
+
+
+def _unpredict(packed: bytes, channels: int, frames: int) -> bytes:
+    planes = np.frombuffer(lzma.decompress(packed), dtype=np.uint8)
+    n = frames * channels
+    zigzag = (planes[:n].astype(np.uint32) | (planes[n:2 * n].astype(np.uint32) << 8)
+              | (planes[2 * n:3 * n].astype(np.uint32) << 16))
+    residual = ((zigzag >> 1).astype(np.int32) ^ -(zigzag & 1).astype(np.int32)).reshape(-1, channels)
+    return np.cumsum(np.cumsum(residual, axis=0), axis=0).astype("<i2").tobytes()
+
+
+def decompress_wav(data: bytes) -> bytes:
+    """.wavz -> the original WAV (16-bit PCM); files from before WLZ2 get a fresh header."""
+    if data[:4] == WAVZ_MAGIC:
+        channels, width, rate, frames, head_len, tail_len = struct.unpack("<HHIIII", data[4:24])
+        head = data[24:24 + head_len]
+        tail = data[24 + head_len:24 + head_len + tail_len]
+        return head + _unpredict(data[24 + head_len + tail_len:], channels, frames) + tail
+    if data[:4] != WAVZ_MAGIC_V1:
+        raise ValueError("not a .wavz file")
+    channels, width, rate, frames = struct.unpack("<HHII", data[4:16])
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(width)
+        wf.setframerate(rate)
+        wf.writeframes(_unpredict(data[16:], channels, frames))
+    return buf.getvalue()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fts_query(text: str) -> str:
+    """User text as an FTS5 query: every word must appear (no FTS syntax passes through)."""
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", text))
+
+
+class InteractionStore:
+    """
+    Content-addressed blob store plus a SQLite index of interactions.
+
+    Uploads and reply audio are moved to blobs/<sha[:2]>/<sha>.<ext>; a file whose
+    hash is already stored is deleted instead (a retried upload, a repeated reply).
+    Each answered request gets one indexed row (device, transcript, response,
+    hashes, stage timings), so "what did I ask an hour ago" is an index range scan
+    and transcripts are full-text searchable. A background task compresses audio
+    older than COMPACT_AFTER losslessly (.wavz) and enforces age and size limits.
+    The database is in WAL mode, so several workers can share one store.
+    """
+
+    def __init__(self, root: str = STORAGE_DIR, enabled: bool = STORAGE_ENABLED,
+                 max_bytes: int = STORAGE_MAX_BYTES, max_age: float = STORAGE_MAX_AGE,
+                 compact_after: float = COMPACT_AFTER):
+        self.root = root
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compact_after = compact_after
+        self._lock = threading.Lock()
+        self._conn = None
+        self._maintenance = None
+        self._pending = set()
+        self.dedup_hits = 0
+        self.dedup_bytes = 0
+        self.compacted = 0
+        self.compacted_saved = 0
+        self.expired = 0
+        self.last_maintenance_ms = None
+        if enabled:
+            os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False,
+                                         isolation_level=None, timeout=5)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._migrate()
+
+    def _migrate(self):
+        """Bring an index created by an older version up to the current schema."""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(blobs)")}
+        if "last_used_at" not in columns:
+            self._conn.execute("ALTER TABLE blobs ADD COLUMN last_used_at REAL")
+        self._conn.execute("UPDATE blobs SET last_used_at = created_at WHERE last_used_at IS NULL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used_at)")
+
+    # -- blobs ---------------------------------------------------------------
+
+    def _blob_path(self, sha256: str, ext: str) -> str:
+        return os.path.join(self.root, "blobs", sha256[:2], sha256 + ext)
+
+    def put_file(self, path: str, kind: str, sha256: str = None) -> tuple:
+        """
+        Move a finished file into the blob store (blocking; call from a thread).
+        Returns (sha256, stored path). A duplicate is deleted and the existing
+        blob's path returned.
+        """
+        sha256 = sha256 or file_sha256(path)
+        ext = os.path.splitext(path)[1].lower() or ".bin"
+        size = os.path.getsize(path)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT path FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE blobs SET refs = refs + 1, last_used_at = ? WHERE sha256 = ?",
+                                   (now, sha256))
+        if row is None:
+            # The row goes in only once the file is in place: a duplicate arriving meanwhile
+            # must not be handed a path that doesn't exist yet
+            target = self._blob_path(sha256, ext)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+            with self._lock:
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO blobs (sha256, kind, path, codec, bytes, original_bytes, created_at, "
+                    "last_used_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (sha256, kind, target, "jpeg" if ext in (".jpg", ".jpeg") else ext.lstrip("."), size, size,
+                     now, now),
+                ).rowcount
+                if inserted:
+                    return sha256, target
+                # Same content stored by a concurrent upload (renamed onto the same target)
+                row = self._conn.execute("SELECT path FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+                self._conn.execute("UPDATE blobs SET refs = refs + 1, last_used_at = ? WHERE sha256 = ?",
+                                   (now, sha256))
+            path = target
+        self.dedup_hits += 1
+        self.dedup_bytes += size
+        if os.path.abspath(path) != os.path.abspath(row["path"]):
+            os.remove(path)
+        return sha256, row["path"]
+
+    def put_bytes(self, data: bytes, kind: str, ext: str) -> tuple:
+        """Store in-memory content (e.g. a stream keyframe). Returns (sha256, path)."""
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            known = self._conn.execute("SELECT path FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if known is not None:
+                self._conn.execute("UPDATE blobs SET refs = refs + 1, last_used_at = ? WHERE sha256 = ?",
+                                   (time.time(), sha256))
+        if known is not None:
+            self.dedup_hits += 1
+            self.dedup_bytes += len(data)
+            return sha256, known["path"]
+        tmp = os.path.join(self.root, f"{sha256}.{threading.get_ident()}{ext}")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        return self.put_file(tmp, kind, sha256)
+
+    def sha_for_path(self, path: str):
+        with self._lock:
+            row = self._conn.execute("SELECT sha256 FROM blobs WHERE path = ?", (path,)).fetchone()
+        return row["sha256"] if row else None
+
+    def read_blob(self, sha256: str):
+        """
+        (bytes, media type, sha256 of those bytes) of a blob; None if gone. Compacted
+        audio is decoded back to the original WAV, so the digest is the address,
+        except for audio compacted before WLZ2 (same samples, a rebuilt header).
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT path, codec FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is None or not os.path.exists(row["path"]):
+            return None
+        with open(row["path"], "rb") as f:
+            data = f.read()
+        if row["codec"] == "wavz":
+            exact = data[:4] == WAVZ_MAGIC
+            data = decompress_wav(data)
+            return data, "audio/wav", sha256 if exact else hashlib.sha256(data).hexdigest()
+        return data, "image/jpeg" if row["codec"] == "jpeg" else "audio/wav", sha256
+
+    # -- interactions --------------------------------------------------------
+
+    def _insert_interaction(self, values: dict):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO interactions ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})",
+                tuple(values.values()),
+            )
+
+    def _insert_replies(self, trace_id: str, shas: list):
+        with self._lock:
+            start = self._conn.execute("SELECT COUNT(*) FROM replies WHERE trace_id = ?", (trace_id,)).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO replies (trace_id, position, sha256) VALUES (?, ?, ?)",
+                [(trace_id, start + i, sha) for i, sha in enumerate(shas)],
+            )
+
+    async def record(self, trace, result: dict, audio_path: str = None, audio_sha256: str = None):
+        """
+        Index one answered upload: move its audio into the store and write the row.
+        Never raises; storage trouble must not fail the request. Updates
+        result["path"] to the stored location.
+        """
+        if not self.enabled:
+            return
+        try:
+            if audio_path and os.path.exists(audio_path):
+                audio_sha256, result["path"] = await asyncio.to_thread(self.put_file, audio_path, "audio", audio_sha256)
+            image_sha256 = result.get("image_sha256")
+            if image_sha256 is None and result.get("image_path"):
+                image_sha256 = await asyncio.to_thread(self.sha_for_path, result["image_path"])
+            timings = {}
+            for s in trace.spans:
+                timings[s["stage"]] = round(timings.get(s["stage"], 0) + s["ms"], 1)
+            await asyncio.to_thread(self._insert_interaction, {
+                "trace_id": trace.trace_id,
+                "device_id": trace.device_id,
+                "endpoint": trace.endpoint,
+                "created_at": trace.started,
+                "transcript": result.get("transcription"),
+                "response": result.get("response"),
+                "with_image": int(bool(result.get("processed_with_image"))),
+                "success": int(bool(result.get("success"))),
+                "error": result.get("error"),
+                "audio_sha256": audio_sha256,
+                "image_sha256": image_sha256,
+                "total_ms": round((time.time() - trace.started) * 1000, 1),
+                "timings": json.dumps(timings),
+            })
+        except Exception as e:
+            print(f"⚠️ Storage: could not record interaction {trace.trace_id}: {e}")
+
+    async def store_image(self, path: str, sha256: str = None) -> str:
+        """Move an uploaded photo into the store; returns its new path (the old one if disabled or failed)."""
+        if not self.enabled:
+            return path
+        try:
+            _, stored = await asyncio.to_thread(self.put_file, path, "image", sha256)
+            return stored
+        except Exception as e:
+            print(f"⚠️ Storage: could not store image {path}: {e}")
+            return path
+
+    async def store_keyframe(self, jpeg: bytes):
+        """Keep the stream frame a question was answered from; returns its sha256."""
+        if not self.enabled:
+            return None
+        try:
+            sha256, _ = await asyncio.to_thread(self.put_bytes, jpeg, "image", ".jpg")
+            return sha256
+        except Exception as e:
+            print(f"⚠️ Storage: could not store keyframe: {e}")
+            return None
+
+    def attach_reply(self, trace, files: list):
+        """TTSEngine.on_reply hook: file the spoken reply's WAVs under its trace, in the background."""
+        if not self.enabled or not files:
+            return
+        task = asyncio.create_task(self._store_reply(trace.trace_id, files))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _store_reply(self, trace_id: str, files: list):
+        shas = []
+        for path in files:
+            try:
+                sha256, _ = await asyncio.to_thread(self.put_file, path, "reply")
+                shas.append(sha256)
+            except Exception as e:
+                print(f"⚠️ Storage: could not store reply audio {path}: {e}")
+        if shas:
+            await asyncio.to_thread(self._insert_replies, trace_id, shas)
+
+    def _query(self, device_id, since, until, text, limit):
+        where, args = [], []
+        if device_id:
+            where.append("i.device_id = ?")
+            args.append(device_id)
+        if since is not None:
+            where.append("i.created_at >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("i.created_at <= ?")
+            args.append(until)
+        source = "interactions i"
+        if text and fts_query(text):
+            source = "interactions_fts f JOIN interactions i ON i.id = f.rowid"
+            where.append("interactions_fts MATCH ?")
+            args.append(fts_query(text))
+        sql = (f"SELECT i.* FROM {source}" + (f" WHERE {' AND '.join(where)}" if where else "")
+               + " ORDER BY i.created_at DESC LIMIT ?")
+        with self._lock:
+            rows = self._conn.execute(sql, (*args, limit)).fetchall()
+            replies = {}
+            for row in rows:
+                replies[row["trace_id"]] = [r["sha256"] for r in self._conn.execute(
+                    "SELECT r.sha256 FROM replies r JOIN blobs b ON b.sha256 = r.sha256 "
+                    "WHERE r.trace_id = ? ORDER BY r.position", (row["trace_id"],))]
+            stored = {r["sha256"] for r in self._conn.execute(
+                f"SELECT sha256 FROM blobs WHERE sha256 IN ({', '.join('?' * (2 * len(rows)))})",
+                [sha for row in rows for sha in (row["audio_sha256"], row["image_sha256"])],
+            )} if rows else set()
+        result = []
+        for row in rows:
+            item = dict(row)
+            item["timings"] = json.loads(item["timings"] or "{}")
+            item["time"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(item["created_at"]))
+            item["audio_url"] = f"/blobs/{row['audio_sha256']}" if row["audio_sha256"] in stored else None
+            item["image_url"] = f"/blobs/{row['image_sha256']}" if row["image_sha256"] in stored else None
+            item["reply_audio_urls"] = [f"/blobs/{sha}" for sha in replies[row["trace_id"]]]
+            result.append(item)
+        return result
+
+    async def query(self, device_id: str = None, since: float = None, until: float = None,
+                    text: str = None, limit: int = 20) -> list:
+        """Newest-first interactions in a time range, optionally matching words in transcript/response."""
+        if not self.enabled:
+            return []
+        return await asyncio.to_thread(self._query, device_id, since, until, text, limit)
+
+    # -- maintenance ---------------------------------------------------------
+
+    def compact(self, limit: int = COMPACT_BATCH) -> int:
+        """Compress WAV blobs older than compact_after. Returns files compacted."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE blobs SET compacting_since = NULL WHERE compacting_since < ?",
+                               (now - STALE_CLAIM_SECONDS,))
+            candidates = self._conn.execute(
+                "SELECT sha256, path FROM blobs WHERE codec = 'wav' AND compacting_since IS NULL "
+                "AND created_at < ? ORDER BY created_at LIMIT ?", (now - self.compact_after, limit),
+            ).fetchall()
+        done = 0
+        for row in candidates:
+            with self._lock:
+                # Claim it, so another worker doesn't compress the same file
+                claimed = self._conn.execute(
+                    "UPDATE blobs SET compacting_since = ? WHERE sha256 = ? AND codec = 'wav' AND compacting_since IS NULL",
+                    (now, row["sha256"]),
+                ).rowcount
+            if not claimed:
+                continue
+            target = os.path.splitext(row["path"])[0] + WAVZ_EXT
+            try:
+                with open(row["path"], "rb") as f:
+                    packed = compress_wav(f.read())
+                if hashlib.sha256(decompress_wav(packed)).hexdigest() != row["sha256"]:
+                    # /blobs/{sha256} must keep serving bytes that hash to the address
+                    raise ValueError("decoded file differs from the original")
+                with open(target + ".part", "wb") as f:
+                    f.write(packed)
+                os.replace(target + ".part", target)
+                with self._lock:
+                    old = self._conn.execute("SELECT bytes FROM blobs WHERE sha256 = ?", (row["sha256"],)).fetchone()
+                    self._conn.execute(
+                        "UPDATE blobs SET path = ?, codec = 'wavz', bytes = ?, compacting_since = NULL WHERE sha256 = ?",
+                        (target, len(packed), row["sha256"]),
+                    )
+                os.remove(row["path"])
+                self.compacted += 1
+                self.compacted_saved += old["bytes"] - len(packed)
+                done += 1
+            except Exception as e:
+                print(f"⚠️ Storage: compaction of {row['path']} failed: {e}")
+                with self._lock:
+                    # Keep it as WAV for good (e.g. a header the device wrote wrongly)
+                    self._conn.execute("UPDATE blobs SET compacting_since = ? WHERE sha256 = ?", (float("inf"), row["sha256"]))
+        return done
+
+    def enforce_retention(self) -> int:
+        """
+        Drop blobs unused for max_age, then the least recently used until under
+        max_bytes; prune old index rows. Reuse (a re-sent photo, a repeated reply)
+        counts as use, so content that keeps coming back is kept.
+        """
+        now = time.time()
+        with self._lock:
+            doomed = self._conn.execute(
+                "SELECT sha256, path FROM blobs WHERE last_used_at < ?", (now - self.max_age,)
+            ).fetchall()
+            total = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM blobs WHERE last_used_at >= ?",
+                                       (now - self.max_age,)).fetchone()[0]
+            if total > self.max_bytes:
+                for row in self._conn.execute(
+                        "SELECT sha256, path, bytes FROM blobs WHERE last_used_at >= ? ORDER BY last_used_at",
+                        (now - self.max_age,)):
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append(row)
+                    total -= row["bytes"]
+            self._conn.executemany("DELETE FROM blobs WHERE sha256 = ?", [(row["sha256"],) for row in doomed])
+            self._conn.execute("DELETE FROM interactions WHERE created_at < ?", (now - INTERACTION_MAX_AGE,))
+            self._conn.execute("DELETE FROM replies WHERE sha256 NOT IN (SELECT sha256 FROM blobs)")
+        for row in doomed:
+            try:
+                os.remove(row["path"])
+            except FileNotFoundError:
+                pass
+        self.expired += len(doomed)
+        return len(doomed)
+
+    def _maintain(self):
+        start = time.perf_counter()
+        compacted = self.compact()
+        expired = self.enforce_retention()
+        self.last_maintenance_ms = (time.perf_counter() - start) * 1000
+        if compacted or expired:
+            print(f"🗃️ Storage: {compacted} audio file(s) compacted, {expired} blob(s) expired "
+                  f"in {self.last_maintenance_ms:.0f} ms")
+
+    async def _run_maintenance(self):
+        while True:
+            try:
+                await asyncio.to_thread(self._maintain)
+            except Exception as e:
+                print(f"⚠️ Storage maintenance failed: {e}")
+            await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+    def start(self):
+        if self.enabled and self._maintenance is None:
+            self._maintenance = asyncio.create_task(self._run_maintenance())
+
+    async def close(self):
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            try:
+                await self._maintenance
+            except asyncio.CancelledError:
+                pass
+            self._maintenance = None
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+            self._conn = None
+
+    def _stats(self) -> dict:
+        with self._lock:
+            blobs = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0), COALESCE(SUM(original_bytes), 0), "
+                "COALESCE(SUM(codec = 'wavz'), 0) FROM blobs"
+            ).fetchone()
+            interactions = self._conn.execute("SELECT COUNT(*) FROM interactions").fetchone()[0]
+        return {
+            "enabled": True,
+            "interactions": interactions,
+            "blobs": blobs[0],
+            "bytes": blobs[1],
+            "original_bytes": blobs[2],
+            "compacted_blobs": blobs[3],
+            "max_bytes": self.max_bytes,
+            "dedup_hits": self.dedup_hits,
+            "dedup_bytes": self.dedup_bytes,
+            "compacted_saved_bytes": self.compacted_saved,
+            "expired": self.expired,
+            "last_maintenance_ms": round(self.last_maintenance_ms) if self.last_maintenance_ms is not None else None,
+        }
+
+    async def get_stats(self) -> dict:
+        if not self.enabled:
+            return {"enabled": False}
+        return await asyncio.to_thread(self._stats)
@@ -0,0 +1,185 @@
+import bisect
+import collections
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+
+# Instrumentation settings
+METRICS_PREFIX = "wave_lens"
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+RESERVOIR_SIZE = 1024                                   # Recent samples kept per series for percentiles
+TRACE_LOG = os.getenv("TRACE_LOG", "1") != "0"          # Emit one JSON log line per span
+
+logger = logging.getLogger("wave_lens.trace")
+if TRACE_LOG and not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class Histogram:
+    """Cumulative-bucket histogram plus a bounded reservoir for exact recent percentiles."""
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.recent = collections.deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, q: float):
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class MetricsRegistry:
+    """Stage latency histograms keyed by (stage, extra labels)."""
+
+    def __init__(self):
+        self._series = {}
+        self.counters = collections.Counter()
+
+    def observe(self, stage: str, ms: float, **labels):
+        key = (stage, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = Histogram()
+        series.observe(ms)
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def summary(self) -> dict:
+        """p50/p95/p99 per stage over the recent reservoir."""
+        out = {}
+        for (stage, labels), h in sorted(self._series.items()):
+            name = stage + "".join(f"[{k}={v}]" for k, v in labels)
+            out[name] = {
+                "count": h.count,
+                "avg_ms": round(h.sum / h.count, 1) if h.count else None,
+                "p50_ms": _round(h.percentile(0.50)),
+                "p95_ms": _round(h.percentile(0.95)),
+                "p99_ms": _round(h.percentile(0.99)),
+            }
+        return out
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format."""
+        name = f"{METRICS_PREFIX}_stage_duration_ms"
+        lines = [
+            f"# HELP {name} Per-request stage latency in milliseconds.",
+            f"# TYPE {name} histogram",
+        ]
+        for (stage, labels), h in sorted(self._series.items()):
+            base = [("stage", stage), *labels]
+            cumulative = 0
+            for le, count in zip([*map(str, h.buckets), "+Inf"], h.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(base + [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(base)} {h.sum:.3f}")
+            lines.append(f"{name}_count{_labels(base)} {h.count}")
+        for counter, value in sorted(self.counters.items()):
+            metric = f"{METRICS_PREFIX}_{counter}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _round(value):
+    return round(value, 1) if value is not None else None
+
+
+def _labels(pairs) -> str:
+    def esc(v):
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+registry = MetricsRegistry()
+_current = contextvars.ContextVar("wave_lens_trace", default=None)
+
+
+class Trace:
+    """One request's trace: an ID plus the stage spans recorded against it."""
+
+    def __init__(self, endpoint: str, device_id: str = None):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.endpoint = endpoint
+        self.device_id = device_id
+        self.started = time.time()
+        self.spans = []
+        self.finished = False
+
+    def record(self, stage: str, ms: float, **attrs):
+        """Record a span measured elsewhere (e.g. TTS TTFB on the engine's task)."""
+        labels = {"tool": attrs["tool"]} if "tool" in attrs else {}
+        registry.observe(stage, ms, **labels)
+        self.spans.append({"stage": stage, "ms": round(ms, 1), **attrs})
+        if TRACE_LOG:
+            logger.info(json.dumps({
+                "event": "span", "trace_id": self.trace_id, "endpoint": self.endpoint,
+                "device_id": self.device_id, "stage": stage, "ms": round(ms, 1), **attrs,
+            }, default=str))
+
+    @contextlib.contextmanager
+    def span(self, stage: str, **attrs):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000, **attrs)
+
+    def finish(self, success: bool = True):
+        if self.finished:
+            return
+        self.finished = True
+        total_ms = (time.time() - self.started) * 1000
+        registry.observe("request", total_ms, endpoint=self.endpoint)
+        registry.incr("requests" if success else "request_failures")
+        if TRACE_LOG:
+            logger.info(json.dumps({
+                "event": "request", "trace_id": self.trace_id, "endpoint": self.endpoint,
+                "device_id": self.device_id, "success": success, "ms": round(total_ms, 1),
+                "spans": self.spans,
+            }, default=str))
+
+
+def start_trace(endpoint: str, device_id: str = None) -> Trace:
+    """Start a trace and make it current for this request's task."""
+    trace = Trace(endpoint, device_id)
+    _current.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(stage: str, **attrs):
+    """Time a stage against the current trace (or just the histograms if there is none)."""
+    trace = _current.get()
+    if trace is not None:
+        with trace.span(stage, **attrs):
+            yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(stage, (time.perf_counter() - start) * 1000)
@@ -0,0 +1,114 @@
+"""
+Local stand-in for the glasses' MJPEG stream (handleStream in final/finall.ino):
+multipart/x-mixed-replace with boundary=frame at a fixed frame rate, so the frame
+ingester can be exercised without the device.
+
+    python mjpeg_standin.py --port 8081                    # synthetic scenes
+    python mjpeg_standin.py --frames uploads --fps 10      # cycle through real JPEGs
+    curl -X POST -H "X-Device-Id: test" "localhost:8000/stream/ingest?url=http://127.0.0.1:8081/stream"
+
+Synthetic mode cycles through a few scenes, each with a moving object and a
+couple of motion-blurred frames, so keyframe selection has something to choose.
+"""
+import argparse
+import asyncio
+import glob
+import io
+import os
+import random
+from aiohttp import web
+from PIL import Image, ImageDraw, ImageFilter
+
+FRAME_SIZE = (800, 600)   # FRAMESIZE_SVGA, as configured in the firmware
+
+
+def synthetic_frames(scenes: int, frames_per_scene: int, quality: int, seed: int = 0) -> list:
+    """Pre-encoded JPEGs: `scenes` distinct views, some frames blurred as if the head moved."""
+    rng = random.Random(seed)
+    frames = []
+    for scene in range(scenes):
+        background = tuple(rng.randrange(40, 220) for _ in range(3))
+        shapes = [(rng.randrange(0, 700), rng.randrange(0, 500), rng.randrange(40, 200),
+                   tuple(rng.randrange(256) for _ in range(3))) for _ in range(12)]
+        for i in range(frames_per_scene):
+            image = Image.new("RGB", FRAME_SIZE, background)
+            draw = ImageDraw.Draw(image)
+            for x, y, size, color in shapes:
+                draw.rectangle((x + i * 3, y, x + i * 3 + size, y + size // 2), fill=color)
+            draw.text((20, 20), f"scene {scene} frame {i}", fill=(0, 0, 0))
+            if i % 4 == 0:
+                image = image.filter(ImageFilter.GaussianBlur(4))
+            buf = io.BytesIO()
+            image.save(buf, format="JPEG", quality=quality)
+            frames.append(buf.getvalue())
+    return frames
+
+
+def file_frames(directory: str) -> list:
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.jpg")) + glob.glob(os.path.join(directory, "*.jpeg"))):
+        with open(path, "rb") as f:
+            frames.append(f.read())
+    return frames
+
+
+class MJPEGStandIn:
+    def __init__(self, frames: list, fps: float, send_length: bool = True):
+        self.frames = frames
+        self.fps = fps
+        self.send_length = send_length
+        self.clients = 0
+
+    async def stream(self, request):
+        resp = web.StreamResponse(headers={"Content-Type": "multipart/x-mixed-replace; boundary=frame"})
+        await resp.prepare(request)
+        self.clients += 1
+        print(f"📹 Client connected to stream ({self.clients} active)")
+        i = 0
+        try:
+            while True:
+                frame = self.frames[i % len(self.frames)]
+                head = "--frame\r\nContent-Type: image/jpeg\r\n"
+                if self.send_length:
+                    head += f"Content-Length: {len(frame)}\r\n"
+                await resp.write(head.encode() + b"\r\n" + frame + b"\r\n")
+                i += 1
+                await asyncio.sleep(1 / self.fps)
+        except ConnectionResetError:
+            pass
+        finally:
+            self.clients -= 1
+            print("📹 Client disconnected from stream")
+        return resp
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/stream", self.stream)
+        return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a stand-in MJPEG stream like the glasses' /stream.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--fps", type=float, default=10, help="STREAM_FRAMERATE in the firmware")
+    parser.add_argument("--frames", help="Directory of JPEGs to cycle through instead of synthetic scenes")
+    parser.add_argument("--scenes", type=int, default=4)
+    parser.add_argument("--frames-per-scene", type=int, default=30)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--no-length", action="store_true", help="Omit Content-Length (parts split on the boundary only)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    frames = file_frames(args.frames) if args.frames else synthetic_frames(args.scenes, args.frames_per_scene, args.quality)
+    if not frames:
+        raise SystemExit(f"No JPEGs found in {args.frames}")
+    print(f"🎬 Serving {len(frames)} frames at {args.fps} fps on http://{args.host}:{args.port}/stream")
+    web.run_app(MJPEGStandIn(frames, args.fps, not args.no_length).app(), host=args.host, port=args.port,
+                print=None, shutdown_timeout=1)   # Streams never end on their own
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import asyncio
+import collections
+import os
+import statistics
+import time
+from image_pipeline import prepare_image
+from metrics import registry as metrics_registry
+
+# Pre-warm settings
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "1") != "0"
+PREWARM_TTL = float(os.getenv("PREWARM_TTL", "30"))   # Seconds warmed state waits for the upload it was started for
+PREWARM_STEP_TIMEOUT = 10       # Seconds one warm step may take
+PREWARM_MIN_INTERVAL = 5        # Seconds a shared connection counts as freshly warmed (not warmed again)
+PREWARM_STATS_WINDOW = 100      # Recent upload latencies kept per endpoint, warm and cold
+
+
+def _read_and_prepare(path: str):
+    with open(path, "rb") as f:
+        return prepare_image(f.read())
+
+
+class WarmSession:
+    """What one session-start signal warmed for a device, until an upload claims it or the TTL runs out."""
+
+    def __init__(self, device_id: str, kind: str, ttl: float):
+        self.device_id = device_id
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.expires_at = time.time() + ttl
+        self.tasks = {}             # step -> task
+        self.warmed = {}            # step -> ms it took
+        self.finished = {}          # step -> ms after the signal it finished at
+        self.failed = {}            # step -> error
+        self.image_path = None
+        self.image_task = None      # Task giving prepare_image()'s (bytes, hash, stats)
+        self.claimed = False
+        self.timer = None
+
+    def age_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    async def image_for(self, path: str):
+        """The preloaded, prepared image if it is `path`, else None (the caller loads it as usual)."""
+        task = self.image_task
+        if task is None or self.image_path != path:
+            return None
+        try:
+            # Still loading: finishing it is never slower than starting again
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                return None
+            raise
+
+    def done(self, name: str, ms: float):
+        self.warmed[name] = ms
+        self.finished[name] = self.age_ms()
+
+    def saved_ms(self) -> float:
+        """Wall-clock time the steps finished within: they run concurrently, so their durations overlap."""
+        return max(self.finished.values(), default=0.0)
+
+    def info(self) -> dict:
+        return {
+            "kind": self.kind,
+            "age_ms": round(self.age_ms()),
+            "warmed": {name: round(ms, 1) for name, ms in self.warmed.items()},
+            "pending": [name for name, task in self.tasks.items() if not task.done()],
+            "failed": self.failed,
+            "image": self.image_path,
+        }
+
+
+class Prewarmer:
+    """
+    Speculative warm-up between the device's recording-start signal and its upload.
+    Each registered step (an async callable: open the STT/LLM/TTS connections, ping
+    the MCP sessions) runs in the background; a shared connection warmed in the
+    last PREWARM_MIN_INTERVAL seconds is left alone. The device's pending photo is
+    read and prepared into memory. The upload claims the warm session and records
+    the wall-clock span from the signal to the last finished step as cold-start
+    latency taken off its critical path; a session nobody claims within the TTL
+    has its unfinished steps cancelled and its image dropped (idle connections
+    close on their own keep-alive timers).
+    """
+
+    def __init__(self, ttl: float = PREWARM_TTL, enabled: bool = PREWARM_ENABLED):
+        self.ttl = ttl
+        self.enabled = enabled
+        self._steps = {}                  # name -> async callable; returning False means nothing to warm
+        self._sessions = {}               # device_id -> WarmSession
+        self._last_warmed = {}            # step -> time.monotonic() of its last successful run
+        self._step_ms = collections.defaultdict(lambda: collections.deque(maxlen=PREWARM_STATS_WINDOW))
+        self._uploads = collections.defaultdict(lambda: collections.deque(maxlen=PREWARM_STATS_WINDOW))
+        self.started = 0
+        self.extended = 0
+        self.claimed = 0
+        self.expired = 0
+        self.cancelled_steps = 0
+        self.step_failures = 0
+        self.fresh_skips = 0
+        self.saved_ms = 0.0
+
+    def register(self, name: str, warm):
+        self._steps[name] = warm
+
+    def start(self, device_id: str, kind: str = "audio", image_path: str = None):
+        """Warm everything for this device's next turn; a session already warming just gets a longer TTL."""
+        if not self.enabled:
+            return None
+        warm = self._sessions.get(device_id)
+        if warm is not None:
+            self.extended += 1
+            warm.kind = kind
+            self._schedule_expiry(warm)
+        else:
+            warm = self._sessions[device_id] = WarmSession(device_id, kind, self.ttl)
+            self.started += 1
+            now = time.monotonic()
+            for name, step in self._steps.items():
+                if now - self._last_warmed.get(name, float("-inf")) < PREWARM_MIN_INTERVAL:
+                    self.fresh_skips += 1
+                    continue
+                warm.tasks[name] = asyncio.create_task(self._run_step(warm, name, step))
+            self._schedule_expiry(warm)
+        if image_path:
+            self.preload_image(device_id, image_path)
+        return warm
+
+    def preload_image(self, device_id: str, path: str) -> bool:
+        """Read and prepare a photo for the device's warm session (a no-op without one)."""
+        warm = self._sessions.get(device_id)
+        if warm is None or warm.image_path == path:
+            return False
+        if warm.image_task is not None:
+            warm.image_task.cancel()
+        warm.image_path = path
+        warm.image_task = asyncio.create_task(self._load_image(warm, path))
+        return True
+
+    def claim(self, device_id: str, trace=None):
+        """The upload this session was warmed for has arrived: hand it over and record what it saved."""
+        warm = self._sessions.pop(device_id, None)
+        if warm is None:
+            return None
+        if warm.timer is not None:
+            warm.timer.cancel()
+        warm.claimed = True
+        self.claimed += 1
+        # Steps still running are left to finish; the upload gets whatever is warm by the time it needs it
+        saved = warm.saved_ms()
+        self.saved_ms += saved
+        if trace is not None:
+            trace.record("prewarm_saved", saved, **warm.info())
+        return warm
+
+    def record_upload(self, trace, warm):
+        """End-to-end latency of an upload, kept apart for warm and cold ones."""
+        ms = (time.time() - trace.started) * 1000
+        state = "warm" if warm is not None else "cold"
+        self._uploads[(trace.endpoint, state)].append(ms)
+        metrics_registry.observe("upload_latency", ms, endpoint=trace.endpoint, prewarmed=state)
+
+    async def _run_step(self, warm: WarmSession, name: str, step):
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(PREWARM_STEP_TIMEOUT):
+                result = await step()
+        except asyncio.CancelledError:
+            self.cancelled_steps += 1
+            raise
+        except Exception as e:
+            self.step_failures += 1
+            warm.failed[name] = str(e)[:200]
+            return
+        if result is False:
+            return
+        ms = (time.perf_counter() - start) * 1000
+        warm.done(name, ms)
+        self._last_warmed[name] = time.monotonic()
+        self._step_ms[name].append(ms)
+        metrics_registry.observe("prewarm_step", ms, step=name)
+
+    async def _load_image(self, warm: WarmSession, path: str):
+        start = time.perf_counter()
+        try:
+            prepared = await asyncio.to_thread(_read_and_prepare, path)
+        except asyncio.CancelledError:
+            self.cancelled_steps += 1
+            raise
+        except Exception as e:
+            # The upload reads the file itself
+            self.step_failures += 1
+            warm.failed["image"] = str(e)[:200]
+            return None
+        ms = (time.perf_counter() - start) * 1000
+        warm.done("image", ms)
+        self._step_ms["image"].append(ms)
+        metrics_registry.observe("prewarm_step", ms, step="image")
+        return prepared
+
+    def _schedule_expiry(self, warm: WarmSession):
+        if warm.timer is not None:
+            warm.timer.cancel()
+        warm.expires_at = time.time() + self.ttl
+        warm.timer = asyncio.get_running_loop().call_later(self.ttl, self._expire, warm)
+
+    def _expire(self, warm: WarmSession):
+        """No upload came: cancel what is still warming and let go of the image."""
+        if self._sessions.get(warm.device_id) is not warm:
+            return
+        self.expired += 1
+        self._drop(warm)
+        print(f"⌛ Pre-warm for {warm.device_id} expired unused after {self.ttl:g}s")
+
+    def _drop(self, warm: WarmSession):
+        del self._sessions[warm.device_id]
+        if warm.timer is not None:
+            warm.timer.cancel()
+        for task in warm.tasks.values():
+            task.cancel()
+        if warm.image_task is not None:
+            warm.image_task.cancel()
+        warm.image_task = None
+
+    def close(self):
+        for warm in list(self._sessions.values()):
+            self._drop(warm)
+
+    def get_stats(self) -> dict:
+        uploads = {}
+        for (endpoint, state), values in self._uploads.items():
+            uploads.setdefault(endpoint, {})[state] = {
+                "count": len(values), "p50_ms": round(statistics.median(values), 1)}
+        for endpoint, states in uploads.items():
+            if "warm" in states and "cold" in states:
+                # How much faster a pre-warmed upload is than a cold one, at the median
+                states["removed_ms"] = round(states["cold"]["p50_ms"] - states["warm"]["p50_ms"], 1)
+        return {
+            "enabled": self.enabled,
+            "ttl_s": self.ttl,
+            "active": {device_id: warm.info() for device_id, warm in self._sessions.items()},
+            "started": self.started,
+            "extended": self.extended,
+            "claimed": self.claimed,
+            "expired": self.expired,
+            "cancelled_steps": self.cancelled_steps,
+            "step_failures": self.step_failures,
+            "fresh_skips": self.fresh_skips,
+            "saved_ms": round(self.saved_ms, 1),
+            "steps": {name: {"runs": len(values), "avg_ms": round(sum(values) / len(values), 1)}
+                      for name, values in self._step_ms.items() if values},
+            "uploads": uploads,
+        }
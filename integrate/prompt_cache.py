@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import time
+from langchain_core.callbacks import AsyncCallbackHandler
+from metrics import registry as metrics_registry, current_trace
+import prompt as prompt_module
+
+# Prompt cache settings
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "1") != "0"
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))                # Seconds a registered prefix lives at Gemini
+PROMPT_CACHE_RENEW = 300            # Extend the TTL once less than this is left
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))  # Gemini's floor for explicit caches (2.5 Flash)
+PROMPT_CACHE_RETRY = 600            # Seconds before retrying a prefix Gemini refused to cache
+PROMPT_CHECK_INTERVAL = 5           # Seconds between prompt.py modification checks
+CHARS_PER_TOKEN = 4                 # Rough estimate used to skip prefixes that are obviously too small
+
+
+def prefix_fingerprint(system_prompt: str, tools=()) -> str:
+    """Hash of a static prefix: the system prompt plus each tool's name, description and argument schema."""
+    digest = hashlib.sha256(system_prompt.encode())
+    for tool in sorted(tools, key=lambda t: t.name):
+        digest.update(json.dumps([tool.name, tool.description, getattr(tool, "args", None)],
+                                 sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def direct_prefix(direct_prompt: str, tools=()) -> str:
+    """
+    The direct path's static prefix: DIRECT_PROMPT followed by the agent's MCP tool
+    catalogue (name, description, argument schema; in name order, so the text is
+    byte-identical on every turn). The catalogue tells the tool-free model exactly
+    what needs escalating, and with it the prefix clears Gemini's explicit-cache
+    minimum, which DIRECT_PROMPT alone (~150 tokens) never would.
+    """
+    if not tools:
+        return direct_prompt
+    lines = [json.dumps({"name": tool.name, "description": tool.description, "parameters": getattr(tool, "args", None)},
+                        sort_keys=True, default=str)
+             for tool in sorted(tools, key=lambda t: t.name)]
+    return (f"{direct_prompt.rstrip()}\n\n"
+            "The full assistant has the tools below. You cannot call them in this mode; "
+            "if a request needs any of them, escalate as instructed above.\n" + "\n".join(lines))
+
+
+class PromptSource:
+    """The prompts in prompt.py, reloaded when the file changes so a running server picks up edits."""
+
+    def __init__(self, module=prompt_module, interval: float = PROMPT_CHECK_INTERVAL):
+        self.module = module
+        self.interval = interval
+        self._mtime = self._stat()
+        self._checked = time.monotonic()
+        self.reloads = 0
+
+    def _stat(self):
+        try:
+            return os.path.getmtime(self.module.__file__)
+        except OSError:
+            return None
+
+    def current(self):
+        now = time.monotonic()
+        if now - self._checked >= self.interval:
+            self._checked = now
+            mtime = self._stat()
+            if mtime != self._mtime:
+                self._mtime = mtime
+                try:
+                    importlib.reload(self.module)
+                    self.reloads += 1
+                    print("📝 prompt.py changed, prompts reloaded")
+                except Exception as e:
+                    # Keep serving the previous prompts until the file is fixed
+                    print(f"⚠️ prompt.py reload failed: {e}")
+        return self.module
+
+
+class _Prefix:
+    __slots__ = ("fingerprint", "handle", "tokens", "expires_at", "failed_until", "error", "hits")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.handle = None
+        self.tokens = None
+        self.expires_at = 0.0
+        self.failed_until = 0.0
+        self.error = None
+        self.hits = 0
+
+
+class UsageCallback(AsyncCallbackHandler):
+    """Reports input/cached tokens and duration of every LangChain LLM call (agent and direct paths)."""
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._started = {}
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    async def on_llm_end(self, response, *, run_id, tags=None, **kwargs):
+        start = self._started.pop(run_id, None)
+        try:
+            usage = response.generations[0][0].message.usage_metadata or {}
+        except (IndexError, AttributeError):
+            usage = {}
+        path = next((tag for tag in tags or () if tag in ("direct", "memory")), "agent")
+        self._cache.record_usage(path, usage.get("input_tokens"), (usage.get("input_token_details") or {}).get("cache_read"),
+                                 (time.perf_counter() - start) * 1000 if start is not None else None)
+
+    async def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+
+class PrefixCache:
+    """
+    Registers static prompt prefixes with Gemini's context cache (client.caches)
+    once per process and hands out the cached-content name for each turn. Only the
+    direct path can use a handle (mcp_use rebinds the agent's system message and
+    tools on every call, and the vision path has no static instructions); its
+    prefix is direct_prefix(), the direct prompt plus the MCP tool catalogue. A prefix
+    is re-registered when its fingerprint changes (prompt.py edited, tools changed)
+    and its TTL is extended while in use. Prefixes under Gemini's minimum size, a
+    refused create or a missing client all give None, and the caller sends the
+    prefix inline as before (Gemini 2.5 still caches repeated prefixes implicitly).
+    Token usage per path is recorded either way, so hits show up in /status.
+    """
+
+    def __init__(self, model: str, enabled: bool = PROMPT_CACHE_ENABLED, ttl: int = PROMPT_CACHE_TTL,
+                 min_tokens: int = PROMPT_CACHE_MIN_TOKENS):
+        self.model = model
+        self.enabled = enabled
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.client = None
+        self._prefixes = {}
+        self._locks = {}
+        self.usage_callback = UsageCallback(self)
+        self.hits = 0
+        self.fallbacks = 0
+        self.creates = 0
+        self.renewals = 0
+        self.create_failures = 0
+        self.invalidations = 0
+        self.usage = {}
+
+    def attach(self, client):
+        """Use this google.genai client to create caches (server.gemini_client)."""
+        self.client = client
+
+    async def handle(self, name: str, system_prompt: str, tools=()) -> str:
+        """Cached-content name for this prefix, or None to send it inline."""
+        if not self.enabled or self.client is None:
+            self.fallbacks += 1
+            return None
+        fingerprint = prefix_fingerprint(system_prompt, tools)
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            prefix = self._prefixes.get(name)
+            if prefix is None or prefix.fingerprint != fingerprint:
+                if prefix is not None and prefix.handle:
+                    print(f"🔄 Prompt prefix '{name}' changed, re-registering")
+                    await self._delete(prefix.handle)
+                prefix = self._prefixes[name] = _Prefix(fingerprint)
+            now = time.time()
+            if prefix.handle is None:
+                if now < prefix.failed_until:
+                    self.fallbacks += 1
+                    return None
+                await self._create(name, prefix, system_prompt)
+            elif prefix.expires_at - now < PROMPT_CACHE_RENEW:
+                await self._renew(prefix)
+            if prefix.handle is None:
+                self.fallbacks += 1
+                return None
+            prefix.hits += 1
+            self.hits += 1
+            return prefix.handle
+
+    async def _create(self, name: str, prefix: _Prefix, system_prompt: str):
+        estimate = len(system_prompt) // CHARS_PER_TOKEN
+        if estimate < self.min_tokens:
+            # Gemini would refuse it; don't spend a round trip finding out
+            prefix.error = f"~{estimate} tokens, under the {self.min_tokens} token minimum"
+            prefix.failed_until = float("inf")
+            return
+        from google.genai import types
+        try:
+            cache = await self.client.aio.caches.create(model=self.model, config=types.CreateCachedContentConfig(
+                display_name=f"wave_lens-{name}-{prefix.fingerprint[:12]}",
+                system_instruction=system_prompt,
+                ttl=f"{self.ttl}s",
+            ))
+        except Exception as e:
+            self.create_failures += 1
+            prefix.error = str(e)[:200]
+            prefix.failed_until = time.time() + PROMPT_CACHE_RETRY
+            print(f"⚠️ Prompt prefix '{name}' not cached, sending it inline: {prefix.error}")
+            return
+        prefix.handle = cache.name
+        prefix.tokens = cache.usage_metadata.total_token_count if cache.usage_metadata else None
+        prefix.expires_at = time.time() + self.ttl
+        prefix.error = None
+        self.creates += 1
+        print(f"📌 Prompt prefix '{name}' cached as {cache.name} ({prefix.tokens} tokens)")
+
+    async def _renew(self, prefix: _Prefix):
+        from google.genai import types
+        try:
+            await self.client.aio.caches.update(name=prefix.handle, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"))
+            prefix.expires_at = time.time() + self.ttl
+            self.renewals += 1
+        except Exception as e:
+            # Gone or unreachable: register again on the next turn
+            prefix.handle = None
+            prefix.error = str(e)[:200]
+
+    def invalidate(self, name: str, error=None):
+        """Forget a handle Gemini rejected (expired, deleted); the next turn registers the prefix again."""
+        prefix = self._prefixes.get(name)
+        if prefix is not None and prefix.handle is not None:
+            prefix.handle = None
+            prefix.error = str(error)[:200] if error else "invalidated"
+            self.invalidations += 1
+
+    async def _delete(self, handle: str):
+        try:
+            await self.client.aio.caches.delete(name=handle)
+        except Exception:
+            pass   # It expires on its own
+
+    async def close(self):
+        """Delete this process's caches rather than paying for them until the TTL runs out."""
+        for prefix in self._prefixes.values():
+            if prefix.handle is not None:
+                await self._delete(prefix.handle)
+                prefix.handle = None
+
+    def record_usage(self, path: str, input_tokens, cached_tokens=None, ms: float = None):
+        """One LLM call's token usage (and duration), into /status totals, histograms and the current trace."""
+        if input_tokens is None:
+            return
+        cached_tokens = cached_tokens or 0
+        totals = self.usage.setdefault(path, {"calls": 0, "input_tokens": 0, "cached_tokens": 0})
+        totals["calls"] += 1
+        totals["input_tokens"] += input_tokens
+        totals["cached_tokens"] += cached_tokens
+        metrics_registry.observe("input_tokens", input_tokens, path=path)
+        metrics_registry.observe("cached_input_tokens", cached_tokens, path=path)
+        trace = current_trace()
+        if trace is not None and ms is not None:
+            trace.record("llm_call", ms, path=path, input_tokens=input_tokens, cached_tokens=cached_tokens)
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "attached": self.client is not None,
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "creates": self.creates,
+            "renewals": self.renewals,
+            "create_failures": self.create_failures,
+            "invalidations": self.invalidations,
+            "prefixes": {
+                name: {
+                    "handle": p.handle,
+                    "tokens": p.tokens,
+                    "hits": p.hits,
+                    "expires_in_s": round(p.expires_at - time.time()) if p.handle else None,
+                    "error": p.error,
+                }
+                for name, p in self._prefixes.items()
+            },
+            "usage": {
+                path: {**totals, "cached_ratio": round(totals["cached_tokens"] / totals["input_tokens"], 3)
+                       if totals["input_tokens"] else None}
+                for path, totals in self.usage.items()
+            },
+        }
@@ -0,0 +1,310 @@
+"""
+Batch reprocessing of recorded audio (and optionally photos) after an STT or
+prompt change: every clip goes back through preprocessing and STT, and in chat
+mode through the direct LLM path; photos go through the vision path.
+
+    python reprocess.py                                      # STT over audio_history/ and uploads/
+    python reprocess.py --mode chat --concurrency 16 --rate 8
+    python reprocess.py uploads --images --image-prompt "Read the text in front of me."
+    python reprocess.py storage/blobs --output reprocess_results/store.jsonl   # .wavz too
+
+Decoding and preprocessing run in a process pool; vendor calls run concurrently
+(--concurrency in flight, at most --rate starts per second per vendor) and are
+retried with backoff. Results are appended to the output as JSON lines shaped
+like requests.jsonl: request_id (the file's path), title, body. The output is
+the checkpoint: rerunning with the same --output skips clips already in it, so
+an interrupted run resumes. Failures go to <output>.failed.jsonl and are
+retried on the next run.
+
+Tool requests are not replayed through the agent: they would act on the user's
+accounts again. In chat mode such a clip's body is the direct path's NEEDS_TOOLS.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import glob
+import json
+import os
+import random
+import sys
+import time
+from dotenv import load_dotenv
+from audio_preproc import preprocess_wav
+from image_pipeline import prepare_image
+from interaction_store import decompress_wav, WAVZ_EXT
+from metrics import registry as metrics_registry
+from prompt import DIRECT_PROMPT
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, "reprocess_results")
+DEFAULT_SOURCES = ("audio_history", "uploads")
+AUDIO_EXTENSIONS = (".wav", WAVZ_EXT)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")     # Override for a local stub (benchmarks)
+TITLE_CHARS = 80                                    # STT mode: title is the transcript's start
+
+
+class RateLimiter:
+    """Token bucket: at most `rate` acquisitions per second, bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited_ms = 0.0
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / self.rate
+                self.waited_ms += wait * 1000
+                await asyncio.sleep(wait)
+                self._updated = time.monotonic()
+                self._tokens = 1
+            self._tokens -= 1
+
+
+# -- process pool work (top level so it pickles) --------------------------------
+
+def load_audio(path: str) -> tuple:
+    """Read (and un-compact) a clip, then preprocess it as /upload_raw does. Returns (wav or None, stats)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(WAVZ_EXT):
+        data = decompress_wav(data)
+    return preprocess_wav(data)
+
+
+def load_image(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return prepare_image(f.read())[0]
+
+
+class Reprocessor:
+    """Runs the discovered jobs through a bounded worker pool and appends results as they finish."""
+
+    def __init__(self, args, pool, gemini):
+        self.args = args
+        self.pool = pool
+        self.gemini = gemini
+        self.stt_limit = RateLimiter(args.rate, args.burst)
+        self.llm_limit = RateLimiter(args.rate, args.burst)
+        self.done = 0
+        self.failed = 0
+        self.retries = 0
+        self._out = None
+        self._failed_out = None
+
+    async def _offload(self, fn, *args):
+        if self.pool is None:
+            return await asyncio.to_thread(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+
+    async def _retry(self, stage: str, limiter: RateLimiter, call):
+        """One vendor call: rate limited, timed, retried with exponential backoff and jitter."""
+        for attempt in range(self.args.retries + 1):
+            await limiter.acquire()
+            start = time.perf_counter()
+            try:
+                async with asyncio.timeout(self.args.timeout):
+                    result = await call()
+                metrics_registry.observe(stage, (time.perf_counter() - start) * 1000)
+                return result
+            except Exception as e:
+                if attempt == self.args.retries:
+                    raise
+                delay = self.args.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                self.retries += 1
+                print(f"🔁 {stage} failed ({type(e).__name__}: {str(e)[:80]}), retry {attempt + 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _generate(self, stage: str, contents, system_prompt: str = None) -> str:
+        from google.genai import types
+        config = types.GenerateContentConfig(system_instruction=system_prompt) if system_prompt else None
+        response = await self._retry(stage, self.llm_limit, lambda: self.gemini.aio.models.generate_content(
+            model=self.args.model, contents=contents, config=config))
+        return (response.text or "").strip()
+
+    async def process_audio(self, path: str) -> dict:
+        from stt import transcribe_bytes_async
+        start = time.perf_counter()
+        clean_wav, _ = await self._offload(load_audio, path)
+        metrics_registry.observe("preprocess", (time.perf_counter() - start) * 1000)
+        if clean_wav is None:
+            return {"title": "(no speech)", "body": ""}
+        transcript = await self._retry("stt", self.stt_limit, lambda: transcribe_bytes_async(
+            clean_wav, os.path.basename(path), quiet=True, raise_errors=True))
+        if self.args.mode == "stt" or not transcript:
+            return {"title": transcript[:TITLE_CHARS] or "(no speech)", "body": transcript}
+        return {"title": transcript, "body": await self._generate("direct_llm", transcript, DIRECT_PROMPT)}
+
+    async def process_image(self, path: str) -> dict:
+        from google.genai import types
+        start = time.perf_counter()
+        jpeg = await self._offload(load_image, path)
+        metrics_registry.observe("image_prepare", (time.perf_counter() - start) * 1000)
+        answer = await self._generate("gemini_vision", [
+            types.Part.from_bytes(data=jpeg, mime_type="image/jpeg"), self.args.image_prompt])
+        return {"title": self.args.image_prompt, "body": answer}
+
+    def _write(self, stream, record: dict):
+        stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        stream.flush()
+
+    async def _run_job(self, request_id: str, path: str):
+        start = time.perf_counter()
+        try:
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                result = await self.process_image(path)
+            else:
+                result = await self.process_audio(path)
+        except Exception as e:
+            self.failed += 1
+            self._write(self._failed_out, {"request_id": request_id, "path": path,
+                                           "error": f"{type(e).__name__}: {e}"})
+            print(f"❌ {request_id}: {type(e).__name__}: {str(e)[:120]}")
+            return
+        metrics_registry.observe("job", (time.perf_counter() - start) * 1000)
+        self._write(self._out, {"request_id": request_id, **result})
+        self.done += 1
+        if self.done % self.args.progress_every == 0:
+            print(f"⏳ {self.done} done, {self.failed} failed")
+
+    async def run(self, jobs: list, output: str):
+        jobs = iter(jobs)
+
+        async def worker():
+            for request_id, path in jobs:
+                await self._run_job(request_id, path)
+
+        with open(output, "a", encoding="utf-8") as self._out, \
+                open(output + ".failed.jsonl", "w", encoding="utf-8") as self._failed_out:
+            await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+
+def discover(sources, images: bool, limit: int = None) -> list:
+    """(request_id, path) per file, sorted; request_id is the path relative to this directory."""
+    extensions = AUDIO_EXTENSIONS + (IMAGE_EXTENSIONS if images else ())
+    paths = []
+    for source in sources:
+        source = source if os.path.isabs(source) else os.path.join(HERE, source)
+        if os.path.isfile(source):
+            paths.append(source)
+            continue
+        for path in glob.glob(os.path.join(source, "**", "*"), recursive=True):
+            if path.lower().endswith(extensions):
+                paths.append(path)
+    jobs = sorted({os.path.relpath(path, HERE).replace(os.sep, "/"): path for path in paths}.items())
+    return jobs[:limit] if limit else jobs
+
+
+def completed(output: str) -> set:
+    """request_ids already in the output; a line cut off by an interrupted run is ignored."""
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, "rb+") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["request_id"])
+            except (ValueError, KeyError):
+                continue
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                # Start the next record on a fresh line
+                f.write(b"\n")
+    return done
+
+
+def print_report(reprocessor: Reprocessor, elapsed: float, skipped: int):
+    rate = reprocessor.done / elapsed if elapsed else 0
+    print(f"\n📊 {reprocessor.done} done, {reprocessor.failed} failed, {skipped} already done "
+          f"in {elapsed:.1f}s -> {rate:.2f} files/s ({reprocessor.retries} retries)")
+    print(f"{'stage':<20}{'count':>7}{'p50':>9}{'p95':>9}")
+    for name, p in metrics_registry.summary().items():
+        print(f"{name:<20}{p['count']:>7}{str(p['p50_ms']):>9}{str(p['p95_ms']):>9}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Reprocess recorded audio/photos through STT and the chat/vision paths.")
+    parser.add_argument("sources", nargs="*", default=list(DEFAULT_SOURCES),
+                        help="Files or directories (searched recursively), relative to this directory")
+    parser.add_argument("--mode", choices=("stt", "chat"), default="stt", help="stt: transcripts; chat: transcript + answer")
+    parser.add_argument("--images", action="store_true", help="Also send JPEGs through the vision path")
+    parser.add_argument("--image-prompt", default="What am I looking at?")
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N files")
+    pool = parser.add_argument_group("pool")
+    pool.add_argument("--concurrency", type=int, default=8, help="Files in flight")
+    pool.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                      help="Decode/preprocess processes (0 = threads in this process)")
+    pool.add_argument("--rate", type=float, default=5, help="Max calls started per second, per vendor (0 = unlimited)")
+    pool.add_argument("--burst", type=int, default=5, help="Calls allowed back to back before --rate applies")
+    pool.add_argument("--retries", type=int, default=3)
+    pool.add_argument("--backoff", type=float, default=1.0, help="Seconds before the first retry (doubles each time)")
+    pool.add_argument("--timeout", type=float, default=60, help="Seconds per vendor call")
+    out = parser.add_argument_group("output")
+    out.add_argument("--output", default=None, help="JSONL path (default reprocess_results/<mode>.jsonl)")
+    out.add_argument("--fresh", action="store_true", help="Start over instead of resuming from --output")
+    out.add_argument("--progress-every", type=int, default=25)
+    return parser.parse_args(argv)
+
+
+async def run(args, jobs: list, output: str) -> Reprocessor:
+    from google import genai
+    from google.genai import types
+    gemini = None
+    if args.mode == "chat" or args.images:
+        gemini = genai.Client(http_options=types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None)
+    pool = concurrent.futures.ProcessPoolExecutor(args.processes) if args.processes > 0 else None
+    reprocessor = Reprocessor(args, pool, gemini)
+    try:
+        await reprocessor.run(jobs, output)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        from stt import close_clients
+        await close_clients()
+    return reprocessor
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    load_dotenv()
+    # Read by stt.py on import: let --concurrency clips be in STT at once
+    os.environ.setdefault("STT_MAX_CONCURRENCY", str(args.concurrency))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{args.mode}.jsonl")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    if args.fresh and os.path.exists(output):
+        os.remove(output)
+    jobs = discover(args.sources, args.images, args.limit)
+    done = completed(output)
+    pending = [job for job in jobs if job[0] not in done]
+    print(f"▶️ {len(jobs)} files found, {len(jobs) - len(pending)} already in {output}, "
+          f"{len(pending)} to process ({args.mode} mode, {args.concurrency} in flight, "
+          f"{args.rate or 'unlimited'}/s per vendor)")
+    if not pending:
+        return 0
+
+    start = time.perf_counter()
+    try:
+        reprocessor = asyncio.run(run(args, pending, output))
+    except KeyboardInterrupt:
+        print(f"\n⏹️ Interrupted; finished results are in {output}, rerun the same command to resume")
+        return 130
+    print_report(reprocessor, time.perf_counter() - start, len(jobs) - len(pending))
+    print(f"💾 Results in {output}" + (f", failures in {output}.failed.jsonl" if reprocessor.failed else ""))
+    return 1 if reprocessor.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
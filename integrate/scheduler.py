@@ -0,0 +1,126 @@
+import asyncio
+import contextlib
+import os
+from fastapi import HTTPException
+from metrics import registry as metrics_registry
+
+# Scheduler settings
+MAX_ACTIVE_TURNS = int(os.getenv("MAX_ACTIVE_TURNS", "8"))        # Model turns running at once, across devices
+MAX_QUEUED_TURNS = int(os.getenv("MAX_QUEUED_TURNS", "32"))       # Turns waiting for a slot before we answer 503
+MAX_DEVICE_REQUESTS = int(os.getenv("MAX_DEVICE_REQUESTS", "3"))  # Uploads in flight per device before we answer 429
+RETRY_AFTER_SECONDS = 2
+
+
+class TurnInterrupted(Exception):
+    """The turn was cancelled because the same device sent newer audio."""
+
+
+class TurnScheduler:
+    """
+    Coordinates model turns. Each device runs one turn at a time (its session lock);
+    across devices at most MAX_ACTIVE_TURNS run and MAX_QUEUED_TURNS wait, beyond
+    which uploads are refused with 503. A device with too many uploads in flight
+    gets 429. New audio from a device barges in: its in-flight turn and any reply
+    still being spoken are cancelled, so stale answers stop costing model and
+    speaker time.
+    """
+
+    def __init__(self, max_active: int = MAX_ACTIVE_TURNS, max_queued: int = MAX_QUEUED_TURNS,
+                 max_device_requests: int = MAX_DEVICE_REQUESTS):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_device_requests = max_device_requests
+        self._slots = asyncio.Semaphore(max_active)
+        self.active = 0
+        self.waiting = 0
+        self.rejected_busy = 0
+        self.rejected_device = 0
+        self.interrupted = 0
+
+    @contextlib.contextmanager
+    def admit(self, session):
+        """Admission control for one upload; raises 503/429 before any work is done."""
+        if self.waiting >= self.max_queued:
+            self.rejected_busy += 1
+            metrics_registry.incr("rejected_503")
+            raise HTTPException(status_code=503, detail="Server busy, try again shortly",
+                                headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+        if session.active_requests >= self.max_device_requests:
+            self.rejected_device += 1
+            metrics_registry.incr("rejected_429")
+            raise HTTPException(status_code=429, detail="Too many requests in flight for this device",
+                                headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+        session.active_requests += 1
+        try:
+            yield
+        finally:
+            session.active_requests -= 1
+
+    def barge_in(self, session) -> int:
+        """
+        Cancel the device's in-flight turn and silence its current reply. Returns the
+        upload's sequence number: uploads that arrived earlier but haven't started
+        their turn yet are stale and will be interrupted when they try.
+        """
+        session.audio_seq += 1
+        stopped = False
+        for turn in list(session.turns):
+            if not turn.done():
+                turn.cancel()
+                stopped = True
+        if session.speech is not None:
+            session.speech.cancel()
+            session.speech = None
+            stopped = True
+        if stopped:
+            self.interrupted += 1
+            metrics_registry.incr("barge_ins")
+            print(f"✋ Barge-in from {session.device_id}: previous answer cancelled")
+        return session.audio_seq
+
+    async def run_turn(self, session, turn_fn, seq: int = None):
+        """
+        Run `turn_fn()` (a coroutine factory) as the device's current turn: after any
+        earlier turn of the same device, within the global slot limit. Raises
+        TurnInterrupted if a newer upload from the device cancels it, or already
+        superseded upload `seq` before it started.
+        """
+        if seq is not None and seq != session.audio_seq:
+            self.interrupted += 1
+            raise TurnInterrupted()
+        task = asyncio.create_task(self._turn(session, turn_fn))
+        session.turns.add(task)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if task.cancelled() and not asyncio.current_task().cancelling():
+                raise TurnInterrupted()
+            raise
+        finally:
+            session.turns.discard(task)
+
+    async def _turn(self, session, turn_fn):
+        # Device order first, so a turn waiting on its own device doesn't hold a global slot
+        async with session.lock:
+            self.waiting += 1
+            try:
+                await self._slots.acquire()
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            try:
+                return await turn_fn()
+            finally:
+                self.active -= 1
+                self._slots.release()
+
+    def get_stats(self) -> dict:
+        return {
+            "active_turns": self.active,
+            "queued_turns": self.waiting,
+            "max_active": self.max_active,
+            "max_queued": self.max_queued,
+            "rejected_503": self.rejected_busy,
+            "rejected_429": self.rejected_device,
+            "barge_ins": self.interrupted,
+        }
@@ -0,0 +1,57 @@
+"""
+Production launcher for server:app: several uvicorn worker processes, no reload.
+
+    python serve.py --workers 4 --state sqlite:///state.db
+    python serve.py --workers 4 --state redis://localhost:6379/0
+
+Workers share pending images, device sessions and conversation memory through the
+state backend, so a photo and its question may land on different workers. What
+stays inside one worker: the in-flight turn (barge-in, per-device ordering) and the
+reply audio for /audio/reply. For those, route each device to one worker from the
+proxy (e.g. nginx `hash $http_x_device_id consistent;` over one port per worker
+started with --workers 1), or accept that they are best effort.
+"""
+import argparse
+import os
+import sys
+import uvicorn
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Smart Glass API for production.")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--state", default=os.getenv("STATE_BACKEND", "memory"),
+                        help="memory | sqlite:///path.db | redis://host:port/db")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--keep-alive", type=int, default=30,
+                        help="Seconds an idle device connection is kept open")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.workers > 1 and args.state == "memory":
+        print("❌ --workers > 1 needs a shared --state backend (sqlite:///... or redis://...): "
+              "with in-process state a photo uploaded to one worker is invisible to the others")
+        return 2
+    # Read by server.py in every worker process
+    os.environ["STATE_BACKEND"] = args.state
+    os.environ.setdefault("STARTUP_MODE", "fast")
+    print(f"🚀 Smart Glass API: {args.workers} worker(s) on {args.host}:{args.port}, state: {args.state}")
+    uvicorn.run(
+        "server:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        reload=False,
+        proxy_headers=True,
+        timeout_keep_alive=args.keep_alive,
+        log_level=args.log_level,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
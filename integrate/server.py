@@ -1,69 +1,225 @@
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import asyncio
 import os
 import time
+import wave
+from urllib.parse import urlparse
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
-from prompt import SYSTEM_PROMPT, STARTUP_PROMPT
-from mcp_use import MCPAgent, MCPClient
-from streaming_tts import speak_text
+from speech_pipeline import SpeechPipeline
+from streaming_tts import engine as tts_engine
 from contextlib import asynccontextmanager
-from stt import transcribe
-from langchain.chat_models import init_chat_model
+from stt import transcribe_bytes_async, get_async_client as get_stt_client, close_clients as close_stt_clients, warm as warm_stt
+from stream_stt import IncrementalTranscriber, STREAM_SAMPLE_RATE
+from audio_preproc import preprocess_wav_file
+from upload_store import (stream_to_file, sanitize_filename, unique_upload_path, check_content_length,
+                          parse_sample_rate, MAX_AUDIO_BYTES, MAX_IMAGE_BYTES)
+from sessions import SessionStore, device_id_from, PENDING_IMAGE_TTL
+from image_pipeline import prepare_image, VisionCache
+from metrics import registry as metrics_registry, start_trace, current_trace, span
+from intent_router import IntentRouter, Decision, ESCALATE_TOKEN
+from tool_cache import ToolResultCache
+from scheduler import TurnScheduler, TurnInterrupted
+from state_backend import open_backend, STATE_BACKEND
+from frame_ingest import IngestManager, STREAM_PATH
+from audio_out import hub as audio_hub, AudioEncoder, DEFAULT_OUTPUT_RATE, DEFAULT_CODEC
+from interaction_store import InteractionStore
+from prompt_cache import PrefixCache, PromptSource, direct_prefix
+from prewarm import Prewarmer
+# google.genai, mcp_use and langchain are imported during startup, off the event loop
 
 # Load environment variables
 load_dotenv()
 
 agent = None
 gemini_client = None  # Native Gemini client
-latest_image_path = None
-pending_image_path = None
-image_upload_time = None
-AUDIO_WAIT_TIMEOUT = 30
+AUDIO_WAIT_TIMEOUT = PENDING_IMAGE_TTL
+VISION_MODEL = 'gemini-2.5-flash'
+VISION_TIMEOUT = float(os.getenv("VISION_TIMEOUT", "30"))  # Seconds per image question
+
+# Pending images, device sessions and conversation memory shared between workers
+# (STATE_BACKEND=sqlite:///state.db or redis://...); in-process by default
+state = open_backend(STATE_BACKEND)
+
+# Per-device state (pending/latest image), keyed by the X-Device-Id header
+sessions = SessionStore(backend=state)
+
+# (image hash, prompt) -> answer, for repeat questions about the same scene
+vision_cache = VisionCache()
+
+# Keyword router: tool requests to the agent, everything else to a direct LLM call
+router = IntentRouter()
+
+# Read-only MCP tool results (gmail_find_email, ...) reused for a short TTL
+tool_cache = ToolResultCache()
+
+# prompt.py (reloaded when edited) and its static prefixes registered with Gemini's context cache
+prompts = PromptSource()
+prefix_cache = PrefixCache(VISION_MODEL)
+
+# Per-device turn ordering, global backpressure and barge-in
+scheduler = TurnScheduler()
+
+# Background readers of the glasses' MJPEG /stream, keeping recent keyframes in memory
+ingest = IngestManager()
+MJPEG_STREAMS = os.getenv("MJPEG_STREAMS", "")           # device=url,... ingested from startup
+INGEST_ANY_HOST = os.getenv("INGEST_ANY_HOST", "0") == "1"  # Allow /stream/ingest URLs not on the caller's address
+
+# Content-addressed uploads/replies plus an indexed history of every interaction
+storage = InteractionStore()
+tts_engine.on_reply = storage.attach_reply
+
+# Connections, MCP sessions and the pending photo warmed on the device's session-start signal
+prewarmer = Prewarmer()
+
+WAV_HEADER_SIZE = 44
 
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Initialize MCPAgent and Gemini client when the server starts."""
-    global agent, gemini_client
+MCP_CONFIG_FILE = os.getenv("MCP_CONFIG_FILE", r"C:\Users\Surya Narayanan K V\smart_glass\backend\broswer_mcp.json")
+# fast: accept traffic immediately, init in the background; blocking: old behavior, wait for everything
+STARTUP_MODE = os.getenv("STARTUP_MODE", "fast")
+
+# Startup progress, reported by /health: component -> "starting" | "ready" | "failed: ..."
+components = {"tts": "starting", "stt": "starting", "gemini": "starting", "agent": "starting", "warmup": "starting"}
+process_started = time.time()
+startup_ms = None
+warmup_task = None
+startup_task = None
+
+async def _init_component(name, init):
+    """Run one init step, recording its outcome and duration; a failure doesn't stop the others."""
+    start = time.perf_counter()
     try:
-        # Initialize native Gemini client (for image processing)
-        gemini_client = genai.Client()
-        print("✅ Native Gemini client initialized successfully")
-        
-        # Initialize MCP Agent (for text-only queries with tools)
-        config_file = r"C:\Users\Surya Narayanan K V\smart_glass\backend\broswer_mcp.json"
-        client = MCPClient.from_config_file(config_file)
+        await init()
+        components[name] = "ready"
+        print(f"✅ {name} ready in {(time.perf_counter() - start) * 1000:.0f} ms")
+    except Exception as e:
+        components[name] = f"failed: {e}"
+        print(f"❌ Failed to initialize {name}: {e}")
+    metrics_registry.observe("startup", (time.perf_counter() - start) * 1000, component=name)
+
+async def _init_gemini():
+    """Native Gemini client (for image processing)"""
+    global gemini_client
+    def build():
+        from google import genai
+        return genai.Client()
+    gemini_client = await asyncio.to_thread(build)
+    prefix_cache.attach(gemini_client)
+
+async def _init_agent():
+    """MCP Agent (for text-only queries with tools): build it off the loop, then start the MCP servers"""
+    global agent
+    def build():
+        from mcp_use import MCPAgent, MCPClient
+        from langchain.chat_models import init_chat_model
+        from agent_memory import AgentMemory
+        client = MCPClient.from_config_file(MCP_CONFIG_FILE)
         llm = init_chat_model(
             "gemini-2.5-flash",
             model_provider="google_genai",
             temperature=0.00000001,
             top_p=0,
             max_tokens=1000,
+            callbacks=[prefix_cache.usage_callback],   # Input/cached tokens per LLM call
         )
-
-        agent = MCPAgent(
+        # Token-bounded history with a rolling summary, so turns don't slow down over a long day
+        return AgentMemory(MCPAgent(
             llm=llm,
             client=client,
             max_steps=100,
             memory_enabled=True,
-            system_prompt=SYSTEM_PROMPT,
-        )
+            system_prompt=prompts.current().SYSTEM_PROMPT,
+        ), store=state)
+    new_agent = await asyncio.to_thread(build)
+    await new_agent.agent.initialize()
+    await new_agent.refresh_prefix(prompts.current().SYSTEM_PROMPT)
+    tool_cache.attach(new_agent.agent.client)
+    agent = new_agent
 
-        # Run startup prompt
-        await agent.run(STARTUP_PROMPT)
-        print("✅ Smart Glass API is ready!")
+async def _init_stt():
+    # Imports elevenlabs and builds the pooled client so the first upload doesn't pay for it
+    await asyncio.to_thread(get_stt_client)
 
-    except Exception as e:
-        print(f"❌ Failed to initialize: {e}")
+async def _warm_up():
+    """Run the startup prompt (it also sets the agent's speaking style in its memory)."""
+    if agent is None:
+        raise RuntimeError("agent not initialized")
+    await agent.run(prompts.current().STARTUP_PROMPT)
+    agent.pin()
+
+async def _warm_llm():
+    """Connections for both model paths: the vision client and the agent's chat model (model lookups, no tokens)."""
+    if gemini_client is None:
+        return False
+    steps = [gemini_client.aio.models.get(model=VISION_MODEL)]
+    if hasattr(agent, "warm_llm"):
+        steps.append(agent.warm_llm())
+    await asyncio.gather(*steps)
+
+async def _warm_tools():
+    if not hasattr(agent, "warm_tools"):
+        return False
+    return await agent.warm_tools()
+
+prewarmer.register("stt", warm_stt)
+prewarmer.register("llm", _warm_llm)
+prewarmer.register("tts", tts_engine.warm)
+prewarmer.register("mcp", _warm_tools)
+
+async def _startup():
+    """Independent clients start concurrently; the warm-up prompt follows once the agent exists."""
+    global warmup_task, startup_ms
+    await asyncio.gather(
+        # One audio device, one Deepgram session and one utterance queue for the whole process
+        _init_component("tts", tts_engine.start),
+        _init_component("stt", _init_stt),
+        _init_component("gemini", _init_gemini),
+        _init_component("agent", _init_agent),
+    )
+    startup_ms = (time.time() - process_started) * 1000
+    warmup_task = asyncio.create_task(_init_component("warmup", _warm_up))
+    if is_ready():
+        print(f"✅ Smart Glass API is ready! ({startup_ms:.0f} ms, warm-up running in background)")
+    else:
+        print(f"⚠️ Startup finished with failures after {startup_ms:.0f} ms: {components}")
+
+def is_ready() -> bool:
+    """Ready to answer: both model paths are up (warm-up may still be running)."""
+    return components["gemini"] == "ready" and components["agent"] == "ready"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the clients; in fast mode traffic is accepted while they come up."""
+    global startup_task
+    sessions.start()
+    ingest.start_configured(MJPEG_STREAMS)
+    storage.start()
+
+    startup_task = asyncio.create_task(_startup())
+    if STARTUP_MODE == "blocking":
+        await startup_task
+        await warmup_task
 
     yield 
 
     print("Shutting down Smart Glass API...")
+    for task in (startup_task, warmup_task):
+        if task is not None and not task.done():
+            task.cancel()
+    if hasattr(agent, "close"):
+        await agent.close()
+    await prefix_cache.close()
+    prewarmer.close()
+    await close_stt_clients()
+    await tts_engine.stop()
+    await ingest.close()
+    await storage.close()
+    await sessions.stop()
+    await state.close()
 
 app = FastAPI(title="Smart Glass API", lifespan=lifespan)
 
@@ -74,71 +230,222 @@ class ChatResponse(BaseModel):
     response: str
     success: bool
 
-async def chat_with_image_native(text_prompt, image_path):
-    """Send a message with image using native Gemini client"""
+def read_file_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+async def chat_with_image_native(text_prompt, image_path, session=None, image_bytes=None):
+    """
+    Send a message with image using the native Gemini async client. The answer is
+    streamed: sentences are spoken as they arrive and the text so far is exposed
+    as the device's partial response. Bounded by VISION_TIMEOUT. `image_bytes`
+    (a keyframe already in memory) is used instead of reading `image_path`.
+    """
     if not gemini_client:
-        raise HTTPException(status_code=500, detail="Gemini client not initialized")
+        raise HTTPException(status_code=503, detail="Gemini client not initialized")
+    from google.genai import types
     
+    pipeline = SpeechPipeline()
+    if session is not None:
+        session.speech = pipeline
     try:
-        print(f"🔍 Processing image: {image_path}")
+        print(f"🔍 Processing image: {image_path or 'live keyframe'}")
         print(f"🔍 With prompt: {text_prompt}")
         
-        # Read image bytes (same as your working code)
-        with open(image_path, 'rb') as f:
-            image_bytes = f.read()
+        # Read, downscale/recompress and hash the frame off the event loop
+        warm = session.prewarm if session is not None else None
+        with span("image_prepare"):
+            # Preloaded by /session_start while the wearer was still speaking
+            prepared = await warm.image_for(image_path) if warm is not None and image_bytes is None else None
+            if prepared is None:
+                if image_bytes is None:
+                    image_bytes = await asyncio.to_thread(read_file_bytes, image_path)
+                prepared = await asyncio.to_thread(prepare_image, image_bytes)
+            image_bytes, image_hash, image_stats = prepared
+        print(f"✅ Image loaded: {image_stats['bytes_in']} -> {image_stats['bytes_out']} bytes "
+              f"({image_stats['size_out'][0]}x{image_stats['size_out'][1]})")
         
-        print(f"✅ Image loaded: {len(image_bytes)} bytes")
+        # Same scene, same question: answer from cache without a model call
+        cached = vision_cache.get(image_hash, text_prompt)
+        if cached is not None:
+            print("⚡ Vision cache hit")
+            pipeline.feed(cached)
+            pipeline.close()
+            return ChatResponse(response=cached, success=True)
         
-        # Use native Gemini API (same as your working code)
-        response = gemini_client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=[
-                types.Part.from_bytes(data=image_bytes, mime_type='image/jpeg'),
-                text_prompt
-            ]
-        )
+        # Stream the answer so speech can start with the first sentence
+        trace = current_trace()
+        vision_start = time.perf_counter()
+        first_token = None
+        usage = None
+        with span("gemini_vision"):
+            async with asyncio.timeout(VISION_TIMEOUT):
+                stream = await gemini_client.aio.models.generate_content_stream(
+                    model=VISION_MODEL,
+                    contents=[
+                        types.Part.from_bytes(data=image_bytes, mime_type='image/jpeg'),
+                        text_prompt
+                    ]
+                )
+                async for chunk in stream:
+                    if chunk.usage_metadata:
+                        usage = chunk.usage_metadata
+                    if chunk.text:
+                        if first_token is None:
+                            first_token = (time.perf_counter() - vision_start) * 1000
+                            if trace is not None:
+                                trace.record("gemini_vision_ttft", first_token)
+                        pipeline.feed(chunk.text)
+                        if session is not None:
+                            session.partial_response = pipeline.text
+        pipeline.close()
+        if usage is not None:
+            prefix_cache.record_usage("vision", usage.prompt_token_count, usage.cached_content_token_count,
+                                      (time.perf_counter() - vision_start) * 1000)
         
-        final_response = response.text
+        final_response = pipeline.text
         print(f"✅ Got response from Gemini: {len(final_response)} characters")
-        
-        # Speak the response asynchronously
-        if final_response.strip():
-            asyncio.create_task(speak_text(final_response))
+        if final_response:
+            vision_cache.put(image_hash, text_prompt, final_response)
         
         return ChatResponse(
-            response=final_response.strip(),
+            response=final_response,
             success=True
         )
         
+    except asyncio.CancelledError:
+        pipeline.cancel()
+        print("⏹️ Image request cancelled")
+        raise
+    except TimeoutError:
+        pipeline.cancel()
+        print(f"⏰ Gemini vision timed out after {VISION_TIMEOUT}s")
+        raise HTTPException(status_code=504, detail=f"Image processing timed out after {VISION_TIMEOUT}s")
     except Exception as e:
+        pipeline.cancel()
         print(f"❌ Error processing image message: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing image message: {str(e)}")
+    finally:
+        if session is not None:
+            session.partial_response = None
+
+async def _answer_with_agent(request, pipeline):
+    """Full MCPAgent turn (tool schema attached, tool calls allowed)."""
+    trace = current_trace()
+    if hasattr(agent, "refresh_prefix"):
+        # Picks up prompt.py edits and MCP tool set changes before the prefix is sent
+        await agent.refresh_prefix(prompts.current().SYSTEM_PROMPT)
+    with span("agent_stream"):
+        turn_start = last_step = time.perf_counter()
+        first_text = True
+        async for step in agent.stream(request, max_steps=30):
+            now = time.perf_counter()
+            if isinstance(step, str):
+                # mcp_use yields the final answer in one piece: this is time to the whole
+                # answer text (after any tool calls), not to the model's first token
+                if first_text and trace is not None:
+                    trace.record("agent_first_text", (now - turn_start) * 1000)
+                first_text = False
+                pipeline.feed(step + " ")
+            else:
+                action, observation = step
+                print(f"🔧 Tool: {action.tool}, Input: {action.tool_input}")
+                # A tool step is yielded once the call returns: time since the previous step
+                if trace is not None:
+                    trace.record("tool_call", (now - last_step) * 1000, tool=action.tool)
+            last_step = now
+
+async def _answer_direct(request, pipeline):
+    """
+    Tool-free answer streamed straight from the LLM. Returns False, having spoken
+    nothing, if the model replied with ESCALATE_TOKEN (the request needs tools).
+    DIRECT_PROMPT and the MCP tool catalogue come from Gemini's context cache when
+    it could be registered.
+    """
+    tools = agent.tools() if hasattr(agent, "tools") else ()
+    direct_prompt = direct_prefix(prompts.current().DIRECT_PROMPT, tools)
+    handle = await prefix_cache.handle("direct", direct_prompt)
+    try:
+        return await _stream_direct(request, pipeline, direct_prompt, handle)
+    except Exception as e:
+        if handle is None or pipeline.text:
+            raise
+        # The cache expired or was deleted under us: answer inline, register it again next turn
+        print(f"⚠️ Cached prompt prefix rejected, sending it inline: {e}")
+        prefix_cache.invalidate("direct", e)
+        return await _stream_direct(request, pipeline, direct_prompt, None)
+
+async def _stream_direct(request, pipeline, direct_prompt, handle):
+    head = ""
+    stream = agent.stream_direct(request, direct_prompt, cached_content=handle)
+    trace = current_trace()
+    start = time.perf_counter()
+    first_text = True
+    try:
+        with span("direct_llm", cached_prefix=handle is not None):
+            async for text in stream:
+                if first_text and trace is not None:
+                    trace.record("direct_llm_ttft", (time.perf_counter() - start) * 1000)
+                first_text = False
+                if head is not None:
+                    # Hold back the first few characters until we know it isn't the escalation token
+                    head += text
+                    if len(head.lstrip()) < len(ESCALATE_TOKEN):
+                        continue
+                    if head.lstrip().startswith(ESCALATE_TOKEN):
+                        return False
+                    text, head = head, None
+                pipeline.feed(text)
+            if head:
+                if head.strip() == ESCALATE_TOKEN:
+                    return False
+                pipeline.feed(head)
+    finally:
+        await stream.aclose()
+    return True
 
-async def chat(request):
-    """Send a message to the smart glass agent (text-only, with tools)"""
+async def chat(request, session=None):
+    """
+    Send a message to the smart glass assistant. The intent router sends small talk
+    and general questions to a direct, tool-free LLM call; only requests that need
+    tools go through the MCPAgent.
+    """
     if not agent:
-        raise HTTPException(status_code=500, detail="Agent not initialized")
+        raise HTTPException(status_code=503, detail="Agent not initialized")
+    if warmup_task is not None and not warmup_task.done():
+        # Don't interleave with the startup prompt in the agent's memory
+        with span("warmup_wait"):
+            await asyncio.shield(warmup_task)
     
     try:
         print(f"🔍 Processing text query: {request}")
         
-        final_response = ""
+        # Sentences are spoken as soon as they stream in
+        pipeline = SpeechPipeline()
+        if session is not None:
+            session.speech = pipeline
         
-        async for step in agent.stream(request, max_steps=30):
-            if isinstance(step, str):
-                final_response += step + " "
-            else:
-                action, observation = step
-                print(f"🔧 Tool: {action.tool}, Input: {action.tool_input}")
+        decision = router.decide(request)
+        if decision.route == "direct" and not hasattr(agent, "stream_direct"):
+            decision = Decision("agent", "no direct path")
+        turn_start = time.perf_counter()
+        escalated = False
+        try:
+            if decision.route == "direct":
+                escalated = not await _answer_direct(request, pipeline)
+            if decision.route == "agent" or escalated:
+                await _answer_with_agent(request, pipeline)
+        except (Exception, asyncio.CancelledError):
+            pipeline.cancel()
+            raise
+        pipeline.close()
+        router.record(decision, (time.perf_counter() - turn_start) * 1000, escalated)
         
+        final_response = pipeline.text
         print(f"✅ Got text response: {len(final_response)} characters")
         
-        # Speak the response asynchronously
-        if final_response.strip():
-            asyncio.create_task(speak_text(final_response))
-        
         return ChatResponse(
-            response=final_response.strip(),
+            response=final_response,
             success=True
         )
         
@@ -146,106 +453,42 @@ async def chat(request):
         print(f"❌ Error processing text message: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
 
-def check_pending_image():
-    """Check if there's a pending image waiting for audio within timeout"""
-    global pending_image_path, image_upload_time
-    
-    if pending_image_path and image_upload_time:
-        elapsed_time = time.time() - image_upload_time
-        if elapsed_time <= AUDIO_WAIT_TIMEOUT:
-            return pending_image_path
-        else:
-            print(f"⏰ Image timeout exceeded ({elapsed_time:.1f}s), clearing pending image")
-            pending_image_path = None
-            image_upload_time = None
-    
-    return None
-
-async def process_audio_with_pending_image(sentence, image_path):
+async def process_audio_with_pending_image(sentence, image_path, session):
     """Process audio with the pending image"""
-    global pending_image_path, image_upload_time
-    
     try:
         print(f"🎤+📷 Processing audio '{sentence}' with image: {image_path}")
-        chat_response = await chat_with_image_native(sentence, image_path)
-        
-        # Clear pending image after processing
-        pending_image_path = None
-        image_upload_time = None
-        
-        return chat_response
-        
+        response = await chat_with_image_native(sentence, image_path, session)
+    except asyncio.CancelledError:
+        # Interrupted by newer audio: leave the photo pending for it
+        raise
     except Exception as e:
         print(f"❌ Error processing audio with image: {e}")
-        # Clear pending image on error
-        pending_image_path = None
-        image_upload_time = None
+        session.clear_pending()
+        await sessions.save(session)
         raise
+    # Clear pending image after processing
+    session.clear_pending()
+    await sessions.save(session)
+    return response
 
-@app.post("/upload_raw")
-async def upload_raw(request: Request):
-    """Upload raw audio data from ESP32"""
-    filename = request.headers.get("X-Filename", "uploaded.wav")
-
-    data = await request.body()
-    file_path = os.path.join(UPLOAD_DIR, filename)
-
-    with open(file_path, "wb") as f:
-        f.write(data)
-
-    print(f"🎤 Audio uploaded: {filename} ({len(data)} bytes)")
-
-    sentence = transcribe(file_path)
+async def respond_to_sentence(sentence, filename, file_path, session, seq=None):
+    """Route a transcribed sentence to the vision or agent path (via the turn scheduler) and build the upload response"""
     if sentence:
-        print(f"🎤 Transcribed: '{sentence}'")
+        print(f"🎤 Transcribed [{session.device_id}]: '{sentence}'")
         
-        # Check if there's a pending image waiting for this audio
-        pending_image = check_pending_image()
-        
-        if pending_image:
-            # Process audio with the pending image
-            try:
-                chat_response = await process_audio_with_pending_image(sentence, pending_image)
-                return {
-                    "message": f"Audio processed with image: {filename}",
-                    "path": file_path,
-                    "transcription": sentence,
-                    "processed_with_image": True,
-                    "image_path": pending_image,
-                    "response": chat_response.response,
-                    "success": True
-                }
-            except Exception as e:
-                return {
-                    "message": f"Error processing audio with image: {filename}",
-                    "path": file_path,
-                    "transcription": sentence,
-                    "processed_with_image": True,
-                    "image_path": pending_image,
-                    "error": str(e),
-                    "success": False
-                }
-        else:
-            # Process audio only (no pending image)
-            try:
-                chat_response = await chat(sentence)
-                return {
-                    "message": f"Audio processed: {filename}",
-                    "path": file_path,
-                    "transcription": sentence,
-                    "processed_with_image": False,
-                    "response": chat_response.response,
-                    "success": True
-                }
-            except Exception as e:
-                return {
-                    "message": f"Error processing audio: {filename}",
-                    "path": file_path,
-                    "transcription": sentence,
-                    "processed_with_image": False,
-                    "error": str(e),
-                    "success": False
-                }
+        try:
+            # One turn at a time per device, bounded across devices
+            return await scheduler.run_turn(session, lambda: _respond_locked(sentence, filename, file_path, session), seq)
+        except TurnInterrupted:
+            print(f"⏹️ Answer to '{sentence}' interrupted by newer audio from {session.device_id}")
+            return {
+                "message": f"Interrupted by newer audio: {filename}",
+                "path": file_path,
+                "transcription": sentence,
+                "interrupted": True,
+                "error": "Interrupted by newer audio",
+                "success": False
+            }
     else:
         print("❌ No transcription found")
         return {
@@ -256,79 +499,465 @@ async def upload_raw(request: Request):
             "success": False
         }
 
+async def _respond_locked(sentence, filename, file_path, session):
+    """Answer one sentence while holding the device's session lock"""
+    # Check if this device has a pending image waiting for this audio (possibly sent to another worker)
+    await sessions.refresh(session)
+    pending_image = session.pending_image()
+    # No photo: a device streaming video already has its current view in memory. Only
+    # questions about that view use it; the rest keep the direct/agent path and its memory
+    frame = None
+    if not pending_image and router.is_visual(sentence) and not router.needs_tools(sentence):
+        frame = ingest.best_frame(session.device_id)
+    
+    if pending_image:
+        # Process audio with the pending image
+        try:
+            chat_response = await process_audio_with_pending_image(sentence, pending_image, session)
+            return {
+                "message": f"Audio processed with image: {filename}",
+                "path": file_path,
+                "transcription": sentence,
+                "processed_with_image": True,
+                "image_path": pending_image,
+                "response": chat_response.response,
+                "success": True
+            }
+        except Exception as e:
+            return {
+                "message": f"Error processing audio with image: {filename}",
+                "path": file_path,
+                "transcription": sentence,
+                "processed_with_image": True,
+                "image_path": pending_image,
+                "error": str(e),
+                "success": False
+            }
+    elif frame is not None:
+        # Process audio with the latest keyframe from the video stream
+        try:
+            print(f"🎤+📹 Processing audio '{sentence}' with the live keyframe ({frame.age():.1f}s old)")
+            chat_response = await chat_with_image_native(sentence, None, session, image_bytes=frame.jpeg)
+            return {
+                "message": f"Audio processed with live keyframe: {filename}",
+                "path": file_path,
+                "transcription": sentence,
+                "processed_with_image": True,
+                "keyframe": frame.info(),
+                "image_sha256": await storage.store_keyframe(frame.jpeg),
+                "response": chat_response.response,
+                "success": True
+            }
+        except Exception as e:
+            return {
+                "message": f"Error processing audio with live keyframe: {filename}",
+                "path": file_path,
+                "transcription": sentence,
+                "processed_with_image": True,
+                "keyframe": frame.info(),
+                "error": str(e),
+                "success": False
+            }
+    else:
+        # Process audio only (no pending image)
+        try:
+            chat_response = await chat(sentence, session)
+            return {
+                "message": f"Audio processed: {filename}",
+                "path": file_path,
+                "transcription": sentence,
+                "processed_with_image": False,
+                "response": chat_response.response,
+                "success": True
+            }
+        except Exception as e:
+            return {
+                "message": f"Error processing audio: {filename}",
+                "path": file_path,
+                "transcription": sentence,
+                "processed_with_image": False,
+                "error": str(e),
+                "success": False
+            }
+
+def discard_partial(wf, path):
+    """Close and delete a WAV that was being written when its upload failed"""
+    try:
+        wf.close()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+def reply_audio_url(trace, result):
+    """Where the device fetches the spoken answer, if there is one"""
+    if not result.get("success") or not result.get("response"):
+        return None
+    return f"/audio/reply?reply={trace.trace_id}"
+
+@app.post("/upload_raw")
+async def upload_raw(request: Request):
+    """Upload raw audio data from ESP32"""
+    session = await sessions.load(device_id_from(request))
+    with scheduler.admit(session):
+        # New audio from this device: whatever it was still answering is stale
+        seq = scheduler.barge_in(session)
+        return await _upload_raw(request, session, seq)
+
+async def _upload_raw(request, session, seq):
+    trace = start_trace("/upload_raw", session.device_id)
+    # Whatever /session_start warmed for this turn
+    warm = session.prewarm = prewarmer.claim(session.device_id, trace)
+    filename = sanitize_filename(request.headers.get("X-Filename"), "uploaded.wav", (".wav",))
+    file_path = unique_upload_path(UPLOAD_DIR, filename)
+    filename = os.path.basename(file_path)
+
+    # Straight to disk (hashed on the way), never the whole body in memory
+    try:
+        with span("body_receive"):
+            size, sha256 = await stream_to_file(request, file_path, MAX_AUDIO_BYTES)
+    except HTTPException:
+        trace.finish(False)
+        raise
+
+    print(f"🎤 Audio uploaded: {filename} ({size} bytes)")
+
+    # Repair the header, drop silence and normalize before paying for STT
+    try:
+        with span("preprocess"):
+            clean_wav, preprocess = await asyncio.to_thread(preprocess_wav_file, file_path)
+    except Exception as e:
+        print(f"⚠️ Audio preprocessing skipped: {e}")
+        clean_wav, preprocess = await asyncio.to_thread(read_file_bytes, file_path), None
+
+    if preprocess:
+        print(f"✂️ Preprocessed: {preprocess['duration_in']}s -> {preprocess['duration_out']}s, "
+              f"{preprocess['bytes_saved']} bytes saved")
+
+    if clean_wav is None:
+        sentence = ""
+    else:
+        with span("stt", bytes=len(clean_wav)):
+            sentence = await transcribe_bytes_async(clean_wav, filename)
+
+    result = await respond_to_sentence(sentence, filename, file_path, session, seq)
+    result["size"] = size
+    result["sha256"] = sha256
+    result["preprocess"] = preprocess
+    result["trace_id"] = trace.trace_id
+    result["audio_url"] = reply_audio_url(trace, result)
+    await storage.record(trace, result, file_path, sha256)
+    trace.finish(result["success"])
+    prewarmer.record_upload(trace, warm)
+    if session.prewarm is warm:
+        session.prewarm = None
+    return result
+
+@app.post("/upload_stream")
+async def upload_stream(request: Request):
+    """
+    Streaming audio upload (chunked HTTP). The ESP32 can send 16-bit mono PCM frames
+    while it is still recording; finished speech segments are transcribed as they
+    arrive, so the transcript is ready shortly after the last frame. A leading WAV
+    header is accepted and skipped. /upload_raw stays as the whole-file fallback.
+    """
+    session = await sessions.load(device_id_from(request))
+    with scheduler.admit(session):
+        seq = scheduler.barge_in(session)
+        return await _upload_stream(request, session, seq)
+
+async def _upload_stream(request, session, seq):
+    trace = start_trace("/upload_stream", session.device_id)
+    warm = session.prewarm = prewarmer.claim(session.device_id, trace)
+    filename = sanitize_filename(request.headers.get("X-Filename"), f"stream_{int(time.time())}.wav", (".wav",))
+    file_path = unique_upload_path(UPLOAD_DIR, filename)
+    filename = os.path.basename(file_path)
+
+    try:
+        sample_rate = parse_sample_rate(request, STREAM_SAMPLE_RATE)
+        check_content_length(request, MAX_AUDIO_BYTES)
+    except HTTPException:
+        trace.finish(False)
+        raise
+
+    transcriber = IncrementalTranscriber(sample_rate=sample_rate, name=os.path.splitext(filename)[0])
+    head = b""
+    header_checked = False
+    carry = b""
+
+    wf = wave.open(file_path, "wb")
+    wf.setnchannels(1)
+    wf.setsampwidth(2)
+    wf.setframerate(sample_rate)
+    receive_start = time.perf_counter()
+    try:
+        async for chunk in request.stream():
+            if transcriber.bytes_received + len(head) + len(chunk) > MAX_AUDIO_BYTES:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds the {MAX_AUDIO_BYTES} byte limit")
+            if not header_checked:
+                # Look at the first 44 bytes to decide whether a WAV header needs skipping
+                head += chunk
+                if len(head) < WAV_HEADER_SIZE:
+                    continue
+                header_checked = True
+                chunk = head[WAV_HEADER_SIZE:] if head[:4] == b"RIFF" else head
+
+            # Keep frames sample-aligned across chunk boundaries
+            chunk = carry + chunk
+            cut = len(chunk) - len(chunk) % 2
+            chunk, carry = chunk[:cut], chunk[cut:]
+
+            transcriber.feed(chunk)
+            await asyncio.to_thread(wf.writeframes, chunk)
+
+        if not header_checked and head[:4] != b"RIFF":
+            # Very short body that never filled a header
+            transcriber.feed(head[:len(head) - len(head) % 2])
+            await asyncio.to_thread(wf.writeframes, head[:len(head) - len(head) % 2])
+    except (Exception, asyncio.CancelledError):
+        transcriber.cancel()
+        # Like stream_to_file: a rejected or broken upload leaves nothing behind
+        await asyncio.to_thread(discard_partial, wf, file_path)
+        trace.finish(False)
+        raise
+    await asyncio.to_thread(wf.close)
+    trace.record("body_receive", (time.perf_counter() - receive_start) * 1000)
+
+    print(f"🎤 Audio streamed: {filename} ({transcriber.bytes_received} bytes)")
+
+    with span("stt_tail"):
+        sentence = await transcriber.finish()
+    result = await respond_to_sentence(sentence, filename, file_path, session, seq)
+    result["trace_id"] = trace.trace_id
+    result["audio_url"] = reply_audio_url(trace, result)
+    await storage.record(trace, result, file_path)
+    trace.finish(result["success"])
+    prewarmer.record_upload(trace, warm)
+    if session.prewarm is warm:
+        session.prewarm = None
+    return result
+
+@app.get("/audio/reply")
+async def reply_audio(request: Request):
+    """
+    Stream a spoken reply to the device (chunked HTTP) while it is being synthesized.
+    Query: reply=<trace_id from the upload response> | latest | next (the first reply
+    that starts after this request, so the device can listen while its upload is
+    still being answered); rate=8000|16000|24000; codec=pcm16|mulaw; wav=1 prefixes
+    a streaming WAV header. 204 if no reply starts within the wait. The stream ends
+    when the reply is done or cut off by a barge-in.
+    """
+    device_id = device_id_from(request)
+    params = request.query_params
+    reply_id = params.get("reply", "latest")
+    since = None
+    if reply_id == "next":
+        reply_id, since = "latest", time.time()
+    try:
+        encoder = AudioEncoder(int(params.get("rate", DEFAULT_OUTPUT_RATE)), params.get("codec", DEFAULT_CODEC))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    reply = await audio_hub.find(device_id, reply_id, since=since)
+    if reply is None:
+        return Response(status_code=204)
+    print(f"🔈 Streaming reply {reply.reply_id} to {device_id} ({encoder.codec}, {encoder.rate} Hz)")
+    return StreamingResponse(
+        audio_hub.stream(reply, encoder, wav=params.get("wav") == "1"),
+        media_type="audio/wav" if params.get("wav") == "1" else encoder.media_type,
+        headers={
+            "X-Reply-Id": reply.reply_id,
+            "X-Sample-Rate": str(encoder.rate),
+            "X-Codec": encoder.codec,
+            "Cache-Control": "no-store",
+        },
+    )
+
 @app.post("/upload_image")
 async def upload_image(request: Request):
     """Upload image data from ESP32"""
-    global latest_image_path, pending_image_path, image_upload_time
+    session = await sessions.load(device_id_from(request))
+    trace = start_trace("/upload_image", session.device_id)
     
-    filename = request.headers.get("X-Filename", f"photo_{int(time.time())}.jpg")
+    filename = sanitize_filename(request.headers.get("X-Filename"), f"photo_{int(time.time())}.jpg", (".jpg", ".jpeg"))
+    file_path = unique_upload_path(UPLOAD_DIR, filename)
+    filename = os.path.basename(file_path)
     
-    data = await request.body()
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    
-    with open(file_path, "wb") as f:
-        f.write(data)
+    try:
+        with span("body_receive"):
+            size, sha256 = await stream_to_file(request, file_path, MAX_IMAGE_BYTES)
+    except HTTPException:
+        trace.finish(False)
+        raise
     
-    # Update the latest image path
-    latest_image_path = file_path
+    # Filed by content hash; a re-sent photo reuses the stored copy
+    with span("store"):
+        file_path = await storage.store_image(file_path, sha256)
     
-    # Set as pending image waiting for audio
-    pending_image_path = file_path
-    image_upload_time = time.time()
+    # Set as this device's latest image and pending image waiting for audio
+    session.set_pending_image(file_path, AUDIO_WAIT_TIMEOUT)
+    await sessions.save(session)
+    # A photo signalled by /session_start: load it now, the audio is still being recorded
+    prewarmer.preload_image(session.device_id, file_path)
     
-    print(f"📷 Image saved and set as pending: {filename} ({len(data)} bytes)")
+    print(f"📷 Image saved and set as pending for {session.device_id}: {filename} ({size} bytes)")
     print(f"⏰ Waiting for audio input within {AUDIO_WAIT_TIMEOUT} seconds...")
+    trace.finish()
     
     return {
         "message": f"Image saved as {filename} - waiting for audio input",
         "path": file_path,
-        "size": len(data),
+        "size": size,
+        "sha256": sha256,
         "status": "waiting_for_audio",
         "timeout_seconds": AUDIO_WAIT_TIMEOUT,
+        "device_id": session.device_id,
+        "trace_id": trace.trace_id,
+        "success": True
+    }
+
+@app.post("/session_start")
+async def session_start(request: Request):
+    """
+    The device started recording (?kind=audio) or took a photo (?kind=photo).
+    Warms what the next turn needs while the wearer is still speaking: the STT,
+    LLM and TTS connections, the MCP sessions and the pending photo, loaded into
+    memory (a photo uploaded after this is loaded as it lands). Returns at once;
+    whatever the next upload doesn't claim within PREWARM_TTL is cancelled. Warm
+    state is per worker, so an upload served by another worker runs cold.
+    """
+    session = await sessions.load(device_id_from(request))
+    kind = request.query_params.get("kind", "audio")
+    if kind not in ("audio", "photo"):
+        raise HTTPException(status_code=400, detail="kind must be audio or photo")
+    warm = prewarmer.start(session.device_id, kind, session.pending_image())
+    warming = []
+    if warm is not None:
+        warming = [name for name, task in warm.tasks.items() if not task.done()]
+        if warm.image_path:
+            warming.append("image")
+    return {
+        "device_id": session.device_id,
+        "kind": kind,
+        "warming": warming,
+        "ttl_seconds": prewarmer.ttl if warm is not None else None,
         "success": True
     }
 
+@app.post("/stream/ingest")
+async def stream_ingest(request: Request):
+    """
+    Start following the calling device's MJPEG stream. The URL defaults to the
+    firmware's /stream on the caller's own address; ?url= may point elsewhere (a
+    stand-in server), but only on the caller's host unless INGEST_ANY_HOST=1.
+    """
+    device_id = device_id_from(request)
+    client_host = request.client.host if request.client else None
+    url = request.query_params.get("url") or f"http://{client_host}{STREAM_PATH}"
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise HTTPException(status_code=400, detail="url must be an http(s) URL")
+    if not INGEST_ANY_HOST and parsed.hostname != client_host:
+        raise HTTPException(status_code=403, detail="Stream URL must be on the calling device's address")
+    ingester = ingest.start(device_id, url)
+    return {"device_id": device_id, "url": ingester.url, "ingesting": True, "success": True}
+
+@app.post("/stream/stop")
+async def stream_stop(request: Request):
+    """Stop following the calling device's MJPEG stream"""
+    device_id = device_id_from(request)
+    stopped = await ingest.stop(device_id)
+    return {"device_id": device_id, "ingesting": False, "was_ingesting": stopped, "success": True}
+
+@app.get("/stream/keyframe")
+async def stream_keyframe(request: Request):
+    """The calling device's current best keyframe as JPEG (404 if none is fresh)"""
+    frame = ingest.best_frame(device_id_from(request))
+    if frame is None:
+        raise HTTPException(status_code=404, detail="No recent keyframe")
+    return Response(content=frame.jpeg, media_type="image/jpeg",
+                    headers={"X-Keyframe-Age": f"{frame.age():.1f}", "X-Sharpness": f"{frame.sharpness:.1f}"})
+
+@app.get("/interactions")
+async def list_interactions(request: Request):
+    """
+    Past interactions, newest first, from the storage index (no directory walks).
+    Query: last=<seconds> (e.g. 3600 for "an hour ago"), or since/until as Unix
+    times; q=<words> matched against transcripts and replies; limit (max 100).
+    Scoped to the X-Device-Id header or ?device_id= when given, else all devices.
+    """
+    params = request.query_params
+    device_id = device_id_from(request) if (request.headers.get("X-Device-Id") or params.get("device_id")) else None
+    try:
+        since = float(params["since"]) if "since" in params else None
+        until = float(params["until"]) if "until" in params else None
+        if "last" in params:
+            since = time.time() - float(params["last"])
+        limit = min(max(int(params.get("limit", 20)), 1), 100)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since, until and last are seconds; limit is an integer")
+    items = await storage.query(device_id, since, until, params.get("q"), limit)
+    return {"device_id": device_id, "count": len(items), "interactions": items}
+
+@app.get("/blobs/{sha256}")
+async def get_blob(sha256: str):
+    """A stored upload or reply by hash; compacted audio is decoded back to the original WAV"""
+    if len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256):
+        raise HTTPException(status_code=400, detail="Expected a sha256 hex digest")
+    blob = await asyncio.to_thread(storage.read_blob, sha256) if storage.enabled else None
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Not stored (or expired)")
+    data, media_type, served_sha256 = blob
+    return Response(content=data, media_type=media_type, headers={
+        "Cache-Control": "max-age=31536000, immutable",
+        "ETag": f'"{served_sha256}"',
+        "X-Content-SHA256": served_sha256,   # Differs from the address only for audio compacted before WLZ2
+    })
+
 @app.get("/status")
-async def get_status():
-    """Get current status of pending operations"""
-    global pending_image_path, image_upload_time
+async def get_status(request: Request):
+    """Get current status of pending operations for the calling device"""
+    session = await sessions.lookup(device_id_from(request))
+    ingester = ingest.get(device_id_from(request))
     
     status = {
         "agent_ready": agent is not None,
         "gemini_ready": gemini_client is not None,
-        "latest_image": latest_image_path,
-        "pending_image": None,
-        "time_remaining": 0
+        "device_id": device_id_from(request),
+        "latest_image": session.latest_image_path if session else None,
+        "pending_image": session.pending_image() if session else None,
+        "time_remaining": int(session.time_remaining()) if session else 0,
+        "partial_response": session.partial_response if session else None,
+        "sessions": sessions.get_stats(),
+        "vision_cache": vision_cache.get_stats(),
+        "memory": agent.get_stats() if hasattr(agent, "get_stats") else None,
+        "router": router.get_stats(),
+        "tool_cache": tool_cache.get_stats(),
+        "prompt_cache": prefix_cache.get_stats(),
+        "prewarm": prewarmer.get_stats(),
+        "scheduler": scheduler.get_stats(),
+        "audio_out": audio_hub.get_stats(),
+        "ingest": ingester.get_stats() if ingester else None,
+        "storage": await storage.get_stats(),
+        "tts": tts_engine.get_stats()
     }
     
-    if pending_image_path and image_upload_time:
-        elapsed_time = time.time() - image_upload_time
-        time_remaining = max(0, AUDIO_WAIT_TIMEOUT - elapsed_time)
-        
-        if time_remaining > 0:
-            status["pending_image"] = pending_image_path
-            status["time_remaining"] = int(time_remaining)
-        else:
-            # Clear expired pending image
-            pending_image_path = None
-            image_upload_time = None
-    
     return status
 
 @app.post("/clear_pending")
-async def clear_pending():
-    """Clear any pending image (for testing/debugging)"""
-    global pending_image_path, image_upload_time
-    
-    pending_image_path = None
-    image_upload_time = None
+async def clear_pending(request: Request):
+    """Clear the calling device's pending image (for testing/debugging)"""
+    session = await sessions.lookup(device_id_from(request))
+    if session:
+        session.clear_pending()
+        await sessions.save(session)
     
     return {"message": "Pending image cleared", "success": True}
 
 @app.post("/test_image")
-async def test_image_processing():
+async def test_image_processing(request: Request):
     """Test endpoint to verify image processing works"""
-    global latest_image_path
+    session = await sessions.lookup(device_id_from(request))
+    latest_image_path = session.latest_image_path if session else None
     
     if not latest_image_path or not os.path.exists(latest_image_path):
         return {
@@ -355,6 +984,16 @@ async def test_image_processing():
             "success": False
         }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Stage latency histograms in Prometheus text format"""
+    return metrics_registry.render_prometheus()
+
+@app.get("/metrics/summary")
+async def metrics_summary():
+    """p50/p95/p99 per stage over recent requests"""
+    return metrics_registry.summary()
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -363,14 +1002,33 @@ async def root():
 @app.get("/health")
 async def health():
     """Health check with all components status"""
+    ready = is_ready()
+    failed = any(state.startswith("failed") for state in components.values())
     return {
-        "status": "healthy",
+        "status": "healthy" if ready else ("degraded" if failed else "starting"),
+        "live": True,
+        "ready": ready,
+        "components": components,
+        "uptime_s": round(time.time() - process_started, 1),
+        "startup_ms": round(startup_ms) if startup_ms is not None else None,
         "agent_ready": agent is not None,
         "gemini_ready": gemini_client is not None,
         "upload_dir": UPLOAD_DIR,
-        "pending_image": pending_image_path is not None
+        "pending_images": sessions.get_stats()["pending_images"]
     }
 
+@app.get("/health/live")
+async def health_live():
+    """Liveness: the process is up and serving HTTP"""
+    return {"live": True}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: 200 once the model clients are up, 503 while starting (or if one failed)"""
+    ready = is_ready()
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "components": components})
+
 if __name__ == "__main__":
+    # Development server; use serve.py for production (several workers, no reload)
     import uvicorn
     uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,206 @@
+import asyncio
+import collections
+import re
+import time
+
+# Session settings
+DEFAULT_DEVICE_ID = "default"       # Used when a device doesn't send X-Device-Id
+PENDING_IMAGE_TTL = 30              # Seconds a photo waits for the matching audio
+SESSION_IDLE_TTL = 3600             # Sessions unused this long are dropped
+MAX_SESSIONS = 256                  # Cap; least recently seen idle sessions go first
+SWEEP_INTERVAL = 1.0                # Seconds between expiry sweeps
+
+_DEVICE_ID_RE = re.compile(r"[^A-Za-z0-9:_.-]")
+
+# DeviceSession fields kept in the state backend
+SHARED_FIELDS = ("latest_image_path", "pending_image_path", "image_upload_time", "pending_expires_at")
+
+
+def device_id_from(request) -> str:
+    """Read and sanitize the X-Device-Id header."""
+    raw = request.headers.get("X-Device-Id", "") or request.query_params.get("device_id", "")
+    device_id = _DEVICE_ID_RE.sub("", raw)[:64]
+    return device_id or DEFAULT_DEVICE_ID
+
+
+class DeviceSession:
+    """
+    Per-device state: the photo waiting for audio and the latest photo. Those fields
+    are what to_state() shares with other workers; locks, turns and the reply being
+    spoken belong to this process.
+    """
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.lock = asyncio.Lock()
+        self.latest_image_path = None
+        self.pending_image_path = None
+        self.image_upload_time = None
+        self.pending_expires_at = None
+        self.partial_response = None      # Text streamed so far for the in-flight answer
+        self.turns = set()                # Model turns queued or running for this device
+        self.speech = None                # SpeechPipeline of the latest reply (cancelled on barge-in)
+        self.prewarm = None               # prewarm.WarmSession claimed by the upload being answered
+        self.active_requests = 0          # Uploads admitted and not finished yet
+        self.audio_seq = 0                # Bumped by every audio upload; older uploads are stale
+        self.last_seen = time.time()
+
+    def busy(self) -> bool:
+        """An upload, turn or the turn lock is live: dropping the session would split the device's serialization."""
+        return self.lock.locked() or bool(self.turns) or self.active_requests > 0
+
+    def set_pending_image(self, path: str, ttl: float = PENDING_IMAGE_TTL):
+        now = time.time()
+        self.latest_image_path = path
+        self.pending_image_path = path
+        self.image_upload_time = now
+        self.pending_expires_at = now + ttl
+
+    def pending_image(self):
+        """Pending image path if it hasn't expired yet."""
+        if self.pending_image_path and time.time() <= self.pending_expires_at:
+            return self.pending_image_path
+        return None
+
+    def time_remaining(self) -> float:
+        if not self.pending_image():
+            return 0
+        return max(0, self.pending_expires_at - time.time())
+
+    def clear_pending(self):
+        self.pending_image_path = None
+        self.image_upload_time = None
+        self.pending_expires_at = None
+
+    def to_state(self) -> dict:
+        return {
+            "latest_image_path": self.latest_image_path,
+            "pending_image_path": self.pending_image_path,
+            "image_upload_time": self.image_upload_time,
+            "pending_expires_at": self.pending_expires_at,
+        }
+
+    def apply_state(self, state: dict):
+        for field, value in state.items():
+            if field in SHARED_FIELDS:
+                setattr(self, field, value)
+
+
+class SessionStore:
+    """
+    Device sessions keyed by device ID. Lookups are O(1); memory is bounded by
+    MAX_SESSIONS (least recently seen idle session evicted first; a busy one is
+    never dropped) and a background sweeper
+    expires pending images and idle sessions without waiting for a request.
+    With a shared state backend, load()/refresh() pull the device's image state
+    written by any worker and save() publishes it; with the in-process backend
+    both are no-ops.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_ttl: float = SESSION_IDLE_TTL, backend=None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.backend = backend
+        self._sessions = collections.OrderedDict()
+        self._sweeper = None
+        self.expired_images = 0
+        self.evicted_sessions = 0
+
+    def get(self, device_id: str) -> DeviceSession:
+        """Fetch (or create) a session and mark it as recently seen."""
+        session = self._sessions.get(device_id)
+        if session is None:
+            session = DeviceSession(device_id)
+            self._sessions[device_id] = session
+            self._enforce_cap(keep=device_id)
+        else:
+            self._sessions.move_to_end(device_id)
+        session.last_seen = time.time()
+        return session
+
+    def peek(self, device_id: str):
+        """Fetch a session without creating it or refreshing it."""
+        return self._sessions.get(device_id)
+
+    @property
+    def shared(self) -> bool:
+        return self.backend is not None and self.backend.shared
+
+    async def load(self, device_id: str) -> DeviceSession:
+        """get(), plus the device's latest shared state."""
+        session = self.get(device_id)
+        await self.refresh(session)
+        return session
+
+    async def lookup(self, device_id: str):
+        """peek() for read-only endpoints; with a shared backend the device may only exist elsewhere."""
+        return await self.load(device_id) if self.shared else self.peek(device_id)
+
+    async def refresh(self, session: DeviceSession):
+        if self.shared:
+            state = await self.backend.get(f"session:{session.device_id}")
+            if state:
+                session.apply_state(state)
+
+    async def save(self, session: DeviceSession):
+        if self.shared:
+            await self.backend.set(f"session:{session.device_id}", session.to_state(), ttl=self.idle_ttl)
+
+    def _enforce_cap(self, keep: str = None):
+        """Evict the least recently seen idle sessions down to max_sessions; busy ones are kept over the cap."""
+        excess = len(self._sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        idle = [device_id for device_id, session in self._sessions.items()
+                if device_id != keep and not session.busy()]
+        for device_id in idle[:excess]:
+            self._evict(device_id)
+
+    def _evict(self, device_id: str):
+        session = self._sessions.pop(device_id)
+        self.evicted_sessions += 1
+        print(f"🧹 Session evicted: {session.device_id}")
+
+    def sweep(self):
+        """Expire pending images and drop idle sessions."""
+        now = time.time()
+        for session in self._sessions.values():
+            if session.pending_image_path and now > session.pending_expires_at and not session.lock.locked():
+                print(f"⏰ Image timeout exceeded for {session.device_id}, clearing pending image")
+                session.clear_pending()
+                self.expired_images += 1
+        # Sessions are ordered by last_seen, so idle ones are at the front
+        for device_id, session in list(self._sessions.items()):
+            if now - session.last_seen <= self.idle_ttl:
+                break
+            if not session.busy():
+                self._evict(device_id)
+        # Busy sessions kept over the cap by get() go once they are idle
+        self._enforce_cap()
+
+    async def _run_sweeper(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            self.sweep()
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._run_sweeper())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    def get_stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "backend": self.backend.name if self.backend is not None else "memory",
+            "pending_images": sum(1 for s in self._sessions.values() if s.pending_image()),
+            "expired_images": self.expired_images,
+            "evicted_sessions": self.evicted_sessions,
+        }
@@ -0,0 +1,123 @@
+import asyncio
+import re
+import time
+from streaming_tts import engine
+from metrics import current_trace, registry as metrics_registry
+
+# A sentence ends at . ! ? (optionally followed by quotes/brackets) plus whitespace, or at a line break
+SENTENCE_END = re.compile(r'(?<=[.!?])["\')\]]*\s+|\n+')
+MIN_SENTENCE_CHARS = 20   # Very short fragments ("Sure.") get merged with the next sentence
+
+
+class SentenceSplitter:
+    """Turns streamed text into speakable sentences as soon as each one is complete."""
+
+    def __init__(self, min_chars: int = MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> list:
+        """Add streamed text and return any sentences completed by it."""
+        self._buffer += text
+        sentences = []
+        start = 0
+        pending = ""
+        for match in SENTENCE_END.finditer(self._buffer):
+            pending += self._buffer[start:match.end()]
+            start = match.end()
+            if len(pending.strip()) >= self.min_chars:
+                sentences.append(pending.strip())
+                pending = ""
+        self._buffer = pending + self._buffer[start:]
+        return sentences
+
+    def flush(self) -> list:
+        """Return whatever is left once the stream has ended."""
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return [rest] if rest else []
+
+
+class SpeechPipeline:
+    """
+    Queues each sentence for speech the moment it is complete. The whole reply is
+    handed to the TTS engine as one ordered source, so its sentences play in text
+    order, back to back, while the rest of the answer (and any tool calls) is still
+    being generated, and never interleave with another reply.
+    """
+
+    def __init__(self, tts=None):
+        self._tts = tts or engine
+        self._splitter = SentenceSplitter()
+        self._queue = asyncio.Queue()
+        self._future = None
+        self._parts = []
+        self._started = time.time()
+        self._trace = current_trace()
+        self.first_audio_latency = None
+        self.sentences = 0
+
+    @property
+    def text(self) -> str:
+        """Full transcript fed so far."""
+        return "".join(self._parts).strip()
+
+    def feed(self, text: str):
+        """Add streamed LLM text; complete sentences are queued for speech immediately."""
+        if not text:
+            return
+        self._parts.append(text)
+        for sentence in self._splitter.feed(text):
+            self._enqueue(sentence)
+
+    def _enqueue(self, sentence: str):
+        if self._future is None:
+            try:
+                self._future = self._tts.submit(self._sentences(), self._trace)
+            except asyncio.QueueFull:
+                # Engine backlog is full: keep the text reply, skip speaking it
+                print("⚠️ TTS queue full, reply will not be spoken")
+                metrics_registry.incr("tts_dropped_replies")
+                self._future = asyncio.get_running_loop().create_future()
+                self._future.set_result([])
+        self.sentences += 1
+        self._queue.put_nowait(sentence)
+
+    async def _sentences(self):
+        """Async iterator the TTS engine consumes."""
+        while True:
+            sentence = await self._queue.get()
+            if sentence is None:
+                return
+            if self.first_audio_latency is None:
+                self.first_audio_latency = time.time() - self._started
+                print(f"🔊 First sentence spoken after {self.first_audio_latency:.2f}s")
+                if self._trace is not None:
+                    self._trace.record("first_sentence", self.first_audio_latency * 1000)
+            yield sentence
+
+    def close(self):
+        """Mark the end of the stream; the remaining text is queued and playback carries on."""
+        for sentence in self._splitter.flush():
+            self._enqueue(sentence)
+        if self._future is not None:
+            self._queue.put_nowait(None)
+
+    async def wait(self):
+        """Wait until everything queued has been spoken."""
+        if self._future is not None:
+            try:
+                await self._future
+            except asyncio.CancelledError:
+                if not self._future.cancelled():
+                    raise
+            except Exception as e:
+                print(f"❌ TTS failed: {e}")
+
+    def cancel(self):
+        """Drop sentences that have not been spoken yet and cut off the one playing."""
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        if self._future is not None:
+            self._queue.put_nowait(None)
+            self._tts.cancel(self._future)
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Where state shared between workers lives:
+#   memory                  in this process only (default; single worker)
+#   sqlite:///state.db      one SQLite file (WAL), for several workers on one host
+#   redis://host:6379/0     any Redis-protocol server (Redis, Valkey, KeyDB, ...)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+SQLITE_BUSY_TIMEOUT_MS = 5000      # Wait this long for another worker's write lock
+SQLITE_PURGE_EVERY = 200           # Writes between sweeps of expired rows
+
+
+class MemoryBackend:
+    """Dict with expiry. Nothing leaves the process, so callers can skip syncing."""
+
+    shared = False
+    name = "memory"
+
+    def __init__(self):
+        self._data = {}
+
+    async def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and time.time() > expires_at:
+            del self._data[key]
+            return None
+        return json.loads(value)
+
+    async def set(self, key: str, value, ttl: float = None):
+        self._data[key] = (json.dumps(value), time.time() + ttl if ttl else None)
+
+    async def compare_and_set(self, key: str, value, expected) -> bool:
+        """Store `value` only if the stored value's "version" is `expected` (None: no value stored)."""
+        current = await self.get(key)
+        if (current or {}).get("version") != expected:
+            return False
+        await self.set(key, value)
+        return True
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+    async def close(self):
+        self._data.clear()
+
+
+class SQLiteBackend:
+    """
+    Key/value table in one SQLite file, shared by every worker on the host. WAL mode
+    lets readers run alongside a writer; calls go through a worker thread so the
+    event loop never blocks on the file lock.
+    """
+
+    shared = True
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                     timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self._writes = 0
+
+    def _get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM state WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and time.time() > row[1]):
+            return None
+        return json.loads(row[0])
+
+    def _set(self, key: str, value: str, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO state (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (key, value, expires_at),
+            )
+            self._writes += 1
+            if self._writes % SQLITE_PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+
+    def _compare_and_set(self, key: str, value: str, expected) -> bool:
+        with self._lock:
+            if expected is None:
+                cursor = self._conn.execute(
+                    "INSERT INTO state (key, value, expires_at) VALUES (?, ?, NULL) ON CONFLICT(key) DO NOTHING",
+                    (key, value),
+                )
+            else:
+                # One statement, so another worker's write can't land between the check and the update
+                cursor = self._conn.execute(
+                    "UPDATE state SET value = ?, expires_at = NULL WHERE key = ? AND json_extract(value, '$.version') = ?",
+                    (value, key, expected),
+                )
+            return cursor.rowcount == 1
+
+    def _delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    async def get(self, key: str):
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value, ttl: float = None):
+        await asyncio.to_thread(self._set, key, json.dumps(value), time.time() + ttl if ttl else None)
+
+    async def compare_and_set(self, key: str, value, expected) -> bool:
+        """Store `value` only if the stored value's "version" is `expected` (None: no value stored)."""
+        return await asyncio.to_thread(self._compare_and_set, key, json.dumps(value), expected)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete, key)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisBackend:
+    """Redis-protocol server; expiry is left to the server."""
+
+    shared = True
+    name = "redis"
+
+    def __init__(self, url: str):
+        # Optional dependency, only needed when this backend is configured
+        import redis.asyncio
+        self._client = redis.asyncio.from_url(url, decode_responses=True)
+
+    async def get(self, key: str):
+        value = await self._client.get(key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value, ttl: float = None):
+        await self._client.set(key, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    async def compare_and_set(self, key: str, value, expected) -> bool:
+        """Store `value` only if the stored value's "version" is `expected` (None: no value stored)."""
+        from redis.exceptions import WatchError
+        async with self._client.pipeline(transaction=True) as pipe:
+            try:
+                # WATCH/MULTI: the SET is dropped if another client writes the key in between
+                await pipe.watch(key)
+                current = await pipe.get(key)
+                if (json.loads(current) if current is not None else {}).get("version") != expected:
+                    await pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.set(key, json.dumps(value))
+                await pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    async def delete(self, key: str):
+        await self._client.delete(key)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def open_backend(url: str = STATE_BACKEND):
+    """Backend for a STATE_BACKEND url."""
+    if url in ("", "memory"):
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unknown STATE_BACKEND '{url}' (use memory, sqlite:///path.db or redis://host:port/db)")
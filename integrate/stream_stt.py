@@ -0,0 +1,132 @@
+import asyncio
+import io
+import os
+import time
+import wave
+import numpy as np
+from stt import transcribe_bytes_async, format_transcription
+from audio_preproc import frame_rms
+
+# Incremental transcription settings
+STREAM_SAMPLE_RATE = 16000       # Matches the firmware's I2S config
+STREAM_SAMPLE_WIDTH = 2          # 16-bit PCM
+STREAM_FRAME_MS = 30             # Energy analysis window
+STREAM_SILENCE_RMS = float(os.getenv("STREAM_SILENCE_RMS", "1000"))  # int16 RMS below this counts as silence
+STREAM_PAUSE_MS = int(os.getenv("STREAM_PAUSE_MS", "600"))           # Pause that closes a segment
+STREAM_MIN_SEGMENT_MS = 1000     # Don't send tiny segments to STT
+STREAM_MAX_SEGMENT_MS = 15000    # Force a cut during long monologues
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int = STREAM_SAMPLE_RATE, sample_width: int = STREAM_SAMPLE_WIDTH) -> bytes:
+    """Wrap raw mono PCM in a WAV container."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(sample_width)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return buf.getvalue()
+
+
+class IncrementalTranscriber:
+    """
+    Accepts PCM frames while the wearer is still talking. Whenever a pause closes a
+    segment, that segment is sent to STT in the background, so by the time the
+    recording ends only the last few seconds still need transcribing.
+    """
+
+    def __init__(self, sample_rate: int = STREAM_SAMPLE_RATE, name: str = "stream"):
+        self.sample_rate = sample_rate
+        self.name = name
+        self.frame_bytes = sample_rate * STREAM_FRAME_MS // 1000 * STREAM_SAMPLE_WIDTH
+        self.bytes_received = 0
+
+        self._segment = bytearray()   # PCM of the segment currently being recorded
+        self._analyzed = 0            # Bytes of _segment already run through the energy check
+        self._voiced_bytes = 0        # Voiced audio in the current segment
+        self._silence_bytes = 0       # Trailing silence in the current segment
+        self._tasks = []              # One STT task per committed segment, in order
+        self._last_voice_time = None
+
+    def _ms_to_bytes(self, ms: int) -> int:
+        return self.sample_rate * ms // 1000 * STREAM_SAMPLE_WIDTH
+
+    def feed(self, pcm: bytes):
+        """Add PCM bytes; commits a segment to STT if a pause or max length is reached."""
+        if not pcm:
+            return
+        self.bytes_received += len(pcm)
+        self._segment += pcm
+
+        # Energy check on every complete analysis frame not yet looked at
+        end = len(self._segment) - (len(self._segment) - self._analyzed) % self.frame_bytes
+        if end > self._analyzed:
+            samples = np.frombuffer(self._segment, dtype=np.int16, count=(end - self._analyzed) // 2,
+                                    offset=self._analyzed)
+            voiced = frame_rms(samples, self.frame_bytes // 2) >= STREAM_SILENCE_RMS
+            for is_voiced in voiced:
+                if is_voiced:
+                    self._voiced_bytes += self.frame_bytes + self._silence_bytes
+                    self._silence_bytes = 0
+                    self._last_voice_time = time.time()
+                else:
+                    self._silence_bytes += self.frame_bytes
+            self._analyzed = end
+            del samples  # Release the view so the bytearray can grow again
+
+        pause_reached = self._silence_bytes >= self._ms_to_bytes(STREAM_PAUSE_MS)
+        long_enough = self._voiced_bytes >= self._ms_to_bytes(STREAM_MIN_SEGMENT_MS)
+        too_long = len(self._segment) >= self._ms_to_bytes(STREAM_MAX_SEGMENT_MS)
+        if (pause_reached and long_enough) or too_long:
+            self._commit()
+        elif pause_reached and self._voiced_bytes == 0:
+            # Nothing but silence so far: drop it instead of buffering it
+            self._reset_segment()
+
+    def _reset_segment(self):
+        self._segment = bytearray()
+        self._analyzed = 0
+        self._voiced_bytes = 0
+        self._silence_bytes = 0
+
+    def _commit(self):
+        """Send the current segment to STT in the background."""
+        if self._voiced_bytes == 0:
+            self._reset_segment()
+            return
+        wav = pcm_to_wav(bytes(self._segment), self.sample_rate)
+        index = len(self._tasks)
+        print(f"[STT] Segment {index} committed ({len(self._segment)} bytes)")
+        self._tasks.append(asyncio.create_task(
+            transcribe_bytes_async(wav, f"{self.name}_seg{index}.wav", quiet=True)
+        ))
+        self._reset_segment()
+
+    def partial_text(self) -> str:
+        """Text of the segments that have finished transcribing so far, in order."""
+        parts = []
+        for task in self._tasks:
+            if not task.done():
+                break
+            if not task.cancelled() and task.exception() is None and task.result():
+                parts.append(task.result())
+        return " ".join(parts)
+
+    async def finish(self) -> str:
+        """Commit whatever is left and wait for every segment's transcription."""
+        self._commit()
+        end_time = time.time()
+        results = await asyncio.gather(*self._tasks, return_exceptions=True)
+        texts = [r for r in results if isinstance(r, str) and r]
+
+        tail_ms = (time.time() - end_time) * 1000
+        if self._last_voice_time:
+            since_speech_ms = (time.time() - self._last_voice_time) * 1000
+            print(f"[STT] Final transcript {tail_ms:.0f}ms after end of stream, "
+                  f"{since_speech_ms:.0f}ms after end of speech ({len(self._tasks)} segments)")
+        return format_transcription(" ".join(texts))
+
+    def cancel(self):
+        """Abort any in-flight segment transcriptions."""
+        for task in self._tasks:
+            task.cancel()
@@ -1,11 +1,15 @@
 import os
 import asyncio
-import pyaudio
+import collections
+import itertools
 import aiohttp
 import wave
 import datetime
 from dotenv import load_dotenv
 import time
+from tts_cache import TTSCache
+from metrics import registry as metrics_registry, current_trace
+import audio_out
 
 # Load API key from .env or fallback
 load_dotenv()
@@ -13,132 +17,485 @@ API_KEY = os.getenv("DEEPGRAM_API_KEY") or ""
 
 # Deepgram TTS settings
 TTS_MODEL = "aura-2-thalia-en"
-DEEPGRAM_TTS_URL = f"https://api.deepgram.com/v1/speak?model={TTS_MODEL}&encoding=linear16&container=wav&sample_rate=24000"
+# container=none: raw PCM only, so no WAV header bytes end up on the speaker
+DEEPGRAM_BASE_URL = os.getenv("DEEPGRAM_BASE_URL", "https://api.deepgram.com")   # Override for a local stub (benchmarks)
+DEEPGRAM_TTS_URL = f"{DEEPGRAM_BASE_URL}/v1/speak?model={TTS_MODEL}&encoding=linear16&container=none&sample_rate=24000"
 
 # Audio playback constants (fixed for this model/encoding)
 SAMPLE_RATE = 24000        # Frames per second
 CHANNELS = 1               # Mono
-FORMAT = pyaudio.paInt16   # 16-bit PCM (2 bytes per sample)
 SAMPLE_WIDTH = 2          # Bytes per sample
 CHUNK = 4800  # Bytes per read (~0.2s of audio at 24kHz mono)
+FRAMES_PER_BUFFER = CHUNK // SAMPLE_WIDTH  # 2400 frames (PyAudio wants frames, not bytes)
+
+# Engine settings
+TTS_QUEUE_SIZE = 32        # Replies waiting to be spoken, per device
+TTS_LANE_IDLE = 60         # Seconds before an idle device's reply consumer exits
+TTS_MAX_CONNECTIONS = int(os.getenv("TTS_MAX_CONNECTIONS", "8"))   # Devices synthesizing at once
+TTS_KEEPALIVE = 60         # Seconds an idle Deepgram connection is kept open
+TTS_STATS_WINDOW = 100     # Recent TTFB samples kept for stats
+RING_CHUNKS = 4            # Ring buffer capacity, in playback chunks
+TTS_PLAYBACK = os.getenv("TTS_PLAYBACK", "1") != "0"   # 0: no local speaker; replies still stream to the device
 
 # Folder for saving audio history
 AUDIO_HISTORY_DIR = "audio_history"
 os.makedirs(AUDIO_HISTORY_DIR, exist_ok=True)
 
 
-async def speak_text(text: str, debug=True) -> str:
+class PCMRingBuffer:
+    """
+    Fixed-size ring buffer for streamed PCM. Network chunks are copied in once;
+    playback takes whole CHUNK-sized views out without any further copying.
+    Capacity is a multiple of the chunk size and reads always start on a chunk
+    boundary, so a full chunk never wraps around the end of the buffer.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK, chunks: int = RING_CHUNKS):
+        self.chunk_size = chunk_size
+        self.capacity = chunk_size * chunks
+        self._buf = bytearray(self.capacity)
+        self._view = memoryview(self._buf)
+        self._read = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def reset(self):
+        self._read = 0
+        self._size = 0
+
+    def write(self, data):
+        """Copy data into the buffer (wrapping at the end)."""
+        n = len(data)
+        if n > self.capacity - self._size:
+            raise BufferError("PCM ring buffer overflow")
+        start = (self._read + self._size) % self.capacity
+        first = min(n, self.capacity - start)
+        self._view[start:start + first] = data[:first]
+        if first < n:
+            self._view[:n - first] = data[first:]
+        self._size += n
+
+    def pop_chunk(self):
+        """Read-only view of the next full chunk, or None if one isn't buffered yet."""
+        if self._size < self.chunk_size:
+            return None
+        chunk = self._view[self._read:self._read + self.chunk_size].toreadonly()
+        self._read = (self._read + self.chunk_size) % self.capacity
+        self._size -= self.chunk_size
+        return chunk
+
+    def pop_rest(self):
+        """Read-only view of what's left (trimmed to whole 16-bit samples)."""
+        n = self._size - self._size % SAMPLE_WIDTH
+        chunk = self._view[self._read:self._read + n].toreadonly()
+        self.reset()
+        return chunk
+
+
+class _SpeakerReply:
+    """One reply's PCM for the host speaker, played whole, in the order replies started."""
+
+    def __init__(self):
+        self.chunks = asyncio.Queue()
+        self.played = asyncio.get_running_loop().create_future()
+
+    def append(self, data):
+        self.chunks.put_nowait(bytes(data))   # The engine reuses its ring buffers; copy
+
+    def finish(self):
+        self.chunks.put_nowait(None)
+
+    def cancel(self):
+        while not self.chunks.empty():
+            self.chunks.get_nowait()
+        self.chunks.put_nowait(None)
+
+
+class _Lane:
+    """Replies bound for one device (or, key None, only for the host speaker), with their own consumer."""
+
+    def __init__(self, key, queue_size: int = TTS_QUEUE_SIZE):
+        self.key = key
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.ring = PCMRingBuffer()
+        self.worker = None
+        self.future = None         # Reply being spoken
+        self.playback = None       # Task speaking it
+        self.reply = None          # audio_out.ReplyAudio it streams to
+        self.speaker = None        # _SpeakerReply it plays through, with TTS_PLAYBACK
+
+
+class TTSEngine:
+    """
+    Long-lived text-to-speech engine. Owns one keep-alive HTTP session to Deepgram.
+    Each device gets its own ordered reply queue and consumer, so one device's reply
+    never waits for another's to be synthesized: audio streams to the requesting
+    device (audio_out.hub) as it arrives. The host speaker (TTS_PLAYBACK) is an
+    optional extra sink with a single consumer of its own, playing whole replies in
+    the order they started without holding up synthesis.
+    """
+
+    def __init__(self, queue_size: int = TTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lanes = {}           # device_id (None: host only) -> _Lane
+        self._speaker_queue = asyncio.Queue()
+        self._speaker = None
+        self._speaker_busy = False
+        self._pyaudio = None
+        self._stream = None
+        self._session = None
+        self._ttfb_ms = collections.deque(maxlen=TTS_STATS_WINDOW)
+        self._file_seq = itertools.count()
+        self.cache = TTSCache(TTS_MODEL, SAMPLE_RATE)
+        self.on_reply = None       # Called with (trace, new audio_history files) after a traced reply is spoken
+        self.utterances = 0
+        self.failures = 0
+        self.interrupted = 0
+        # Cheap counters instead of per-chunk debug prints
+        self.chunks_received = 0
+        self.bytes_received = 0
+        self.frames_played = 0
+        self.max_chunk_gap_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._session is not None
+
+    @property
+    def speaking(self) -> bool:
+        return (any(lane.future is not None for lane in self._lanes.values())
+                or self._speaker_busy or not self._speaker_queue.empty())
+
+    async def start(self):
+        """Open the audio device and HTTP session (lanes start with their first reply)."""
+        if self.running:
+            return
+        if TTS_PLAYBACK:
+            # Imported here so a headless server never loads PortAudio
+            import pyaudio
+            self._pyaudio = await asyncio.to_thread(pyaudio.PyAudio)
+            self._stream = await asyncio.to_thread(
+                self._pyaudio.open,
+                format=pyaudio.paInt16,   # 16-bit PCM (2 bytes per sample)
+                channels=CHANNELS,
+                rate=SAMPLE_RATE,
+                output=True,
+                frames_per_buffer=FRAMES_PER_BUFFER,
+            )
+            self._speaker = asyncio.create_task(self._run_speaker())
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=TTS_MAX_CONNECTIONS, keepalive_timeout=TTS_KEEPALIVE),
+            headers={"Authorization": f"Token {API_KEY}"},
+        )
+        print("🔊 TTS engine started")
+
+    async def stop(self):
+        """Stop the consumers and release the device and session."""
+        tasks = [lane.worker for lane in self._lanes.values() if lane.worker is not None]
+        if self._speaker is not None:
+            tasks.append(self._speaker)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._lanes.clear()
+        self._speaker = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._pyaudio is not None:
+            self._pyaudio.terminate()
+            self._pyaudio = None
+        print("🔊 TTS engine stopped")
+
+    def submit(self, source, trace=None) -> asyncio.Future:
+        """
+        Queue a reply for speech. `source` is a string or an async iterator of
+        sentences; all sentences of one source are spoken before the next source
+        for the same device starts. TTFB and playback spans are recorded against
+        `trace` if given, and its device receives the audio. Returns a future
+        resolved with the WAVs saved to audio_history/ once the reply is
+        synthesized (sentences played from the TTS cache save none).
+        """
+        key = trace.device_id if trace is not None and trace.device_id else None
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane(key, self.queue_size)
+            lane.worker = asyncio.create_task(self._run(lane))
+        future = asyncio.get_running_loop().create_future()
+        lane.queue.put_nowait((source, future, trace))
+        return future
+
+    async def speak(self, text: str) -> str:
+        """Queue text and wait until it has been spoken; returns the saved WAV, or None on a cache hit."""
+        files = await self.submit(text, current_trace())
+        return files[0] if files else None
+
+    async def warm(self):
+        """Open a keep-alive connection to Deepgram ahead of the next reply."""
+        if self._session is None:
+            return False
+        async with self._session.head(DEEPGRAM_BASE_URL):
+            pass
+
+    def get_stats(self) -> dict:
+        ttfb = sorted(self._ttfb_ms)
+        return {
+            "running": self.running,
+            "speaking": self.speaking,
+            "queue_depth": sum(lane.queue.qsize() for lane in self._lanes.values()),
+            "lanes": len(self._lanes),
+            "speaker_backlog": self._speaker_queue.qsize(),
+            "utterances": self.utterances,
+            "failures": self.failures,
+            "interrupted": self.interrupted,
+            "ttfb_ms_last": round(self._ttfb_ms[-1]) if ttfb else None,
+            "ttfb_ms_avg": round(sum(ttfb) / len(ttfb)) if ttfb else None,
+            "ttfb_ms_p95": round(ttfb[min(len(ttfb) - 1, int(len(ttfb) * 0.95))]) if ttfb else None,
+            "chunks_received": self.chunks_received,
+            "bytes_received": self.bytes_received,
+            "frames_played": self.frames_played,
+            "max_chunk_gap_ms": round(self.max_chunk_gap_ms),
+            "cache": self.cache.get_stats(),
+        }
+
+    def cancel(self, future):
+        """Stop a submitted reply: dropped if still queued, cut off mid-utterance if playing."""
+        if future is None or future.done():
+            return
+        for lane in self._lanes.values():
+            if future is lane.future:
+                if lane.speaker is not None:
+                    lane.speaker.cancel()
+                if lane.playback is not None:
+                    lane.playback.cancel()
+                    return
+        future.cancel()
+
+    async def _run(self, lane: _Lane):
+        while True:
+            try:
+                source, future, trace = await asyncio.wait_for(lane.queue.get(), TTS_LANE_IDLE)
+            except TimeoutError:
+                # Idle device: drop its lane; the next reply starts a new one
+                del self._lanes[lane.key]
+                return
+            if future.done():
+                # Cancelled while it was waiting in the queue
+                continue
+            lane.future = future
+            if trace is not None and trace.device_id:
+                lane.reply = audio_out.hub.begin(trace.device_id, trace.trace_id)
+            if self._speaker is not None:
+                lane.speaker = _SpeakerReply()
+                self._speaker_queue.put_nowait(lane.speaker)
+            lane.playback = asyncio.create_task(self._play_source(lane, source, trace))
+            try:
+                files = await lane.playback
+                if lane.key is None and lane.speaker is not None:
+                    # Host-only speech (the REPL): spoken means out of the speaker
+                    lane.speaker.finish()
+                    await asyncio.shield(lane.speaker.played)
+                if not future.done():
+                    future.set_result(files)
+                if self.on_reply is not None and trace is not None:
+                    self.on_reply(trace, files)
+            except asyncio.CancelledError:
+                if lane.reply is not None:
+                    lane.reply.cancel()
+                if lane.speaker is not None:
+                    lane.speaker.cancel()
+                if not future.done():
+                    future.cancel()
+                if asyncio.current_task().cancelling():
+                    raise
+                # Only this reply was cancelled (barge-in); keep serving the queue
+                self.interrupted += 1
+                print("⏹️ TTS playback interrupted")
+            except Exception as e:
+                print(f"❌ TTS engine error: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                if lane.reply is not None and not lane.reply.done:
+                    lane.reply.finish()
+                if lane.speaker is not None:
+                    lane.speaker.finish()
+                lane.reply = None
+                lane.speaker = None
+                lane.future = None
+                lane.playback = None
+
+    async def _run_speaker(self):
+        """Single consumer for the host speaker: one whole reply at a time, in the order they started."""
+        while True:
+            reply = await self._speaker_queue.get()
+            self._speaker_busy = True
+            try:
+                while (data := await reply.chunks.get()) is not None:
+                    await asyncio.to_thread(self._stream.write, data)
+            finally:
+                self._speaker_busy = False
+                if not reply.played.done():
+                    reply.played.set_result(None)
+
+    async def _play_source(self, lane: _Lane, source, trace) -> list:
+        files = []
+        if isinstance(source, str):
+            files.append(await self._speak_safe(lane, source, trace))
+        else:
+            async for sentence in source:
+                files.append(await self._speak_safe(lane, sentence, trace))
+        return [f for f in files if f]
+
+    async def _speak_safe(self, lane: _Lane, text: str, trace=None) -> str:
+        """Speak one utterance; a failed sentence is logged and skipped, not fatal to the reply."""
+        start = time.perf_counter()
+        try:
+            return await self._speak_one(lane, text, trace)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            print(f"❌ TTS failed for utterance: {e}")
+            return None
+        finally:
+            self._record(trace, "tts_playback", (time.perf_counter() - start) * 1000)
+
+    def _record(self, trace, stage: str, ms: float, **attrs):
+        if trace is not None:
+            trace.record(stage, ms, **attrs)
+        else:
+            metrics_registry.observe(stage, ms)
+
+    async def _speak_one(self, lane, text: str, trace=None) -> str:
+        """
+        Stream one utterance from Deepgram to the sinks and save it to audio_history/.
+        Returns the WAV, or None if nothing was saved (a cache hit or a failed request).
+        """
+        if not text.strip():
+            return None
+
+        # Repeated phrases play straight from the cache, no network round trip
+        cached = self.cache.lookup(text)
+        if cached:
+            await self._play_file(lane, cached)
+            if self._ttfb_ms:
+                self.cache.saved_ms += sum(self._ttfb_ms) / len(self._ttfb_ms)
+            self.utterances += 1
+            # Played from the raw .pcm cache entry: no new WAV in audio_history/
+            return None
+
+        # Millisecond and sequence suffixes: devices' replies are synthesized side by side
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")[:-3]
+        output_file = os.path.join(AUDIO_HISTORY_DIR, f"{timestamp}_{next(self._file_seq)}.wav")
+
+        ring = lane.ring
+        ring.reset()
+        start_time = time.time()
+        last_chunk_time = None
+
+        # The WAV is written as audio arrives; the header is patched on close.
+        # The same PCM is teed into a cache entry that is published only if the stream completes.
+        wf = None
+        cache_key, cache_tmp = self.cache.begin(text)
+        cache_file = None
+        completed = False
+        try:
+            async with self._session.post(DEEPGRAM_TTS_URL, json={"text": text}) as resp:
+                if resp.status != 200:
+                    print("Failed to get audio stream:", await resp.text())
+                    self.failures += 1
+                    return None
+
+                async for chunk in resp.content.iter_chunked(CHUNK):
+                    if not chunk:
+                        continue
+                    now = time.time()
+                    if last_chunk_time is None:
+                        self._ttfb_ms.append((now - start_time) * 1000)
+                        self._record(trace, "tts_ttfb", self._ttfb_ms[-1])
+                    else:
+                        self.max_chunk_gap_ms = max(self.max_chunk_gap_ms, (now - last_chunk_time) * 1000)
+                    last_chunk_time = now
+                    self.chunks_received += 1
+                    self.bytes_received += len(chunk)
+
+                    if wf is None:
+                        wf = wave.open(output_file, 'wb')
+                        wf.setnchannels(CHANNELS)
+                        wf.setsampwidth(SAMPLE_WIDTH)
+                        wf.setframerate(SAMPLE_RATE)
+                        cache_file = open(cache_tmp, 'wb')
+                    wf.writeframesraw(chunk)
+                    cache_file.write(chunk)
+                    ring.write(chunk)
+
+                    # Play complete frames from the ring
+                    frame_data = ring.pop_chunk()
+                    while frame_data is not None:
+                        await self._write(lane, frame_data)
+                        self.frames_played += 1
+                        frame_data = ring.pop_chunk()
+
+                # Play any remaining buffered data
+                rest = ring.pop_rest()
+                if len(rest):
+                    await self._write(lane, rest)
+                    self.frames_played += 1
+            completed = True
+        finally:
+            if wf is not None:
+                wf.close()
+            if cache_file is not None:
+                cache_file.close()
+                if completed:
+                    self.cache.commit(cache_key, cache_tmp)
+                else:
+                    self.cache.discard(cache_tmp)
+
+        if wf is None:
+            return None
+        self.utterances += 1
+        print(f"Audio saved as: {output_file}")
+        return output_file
+
+
+    async def _write(self, lane: _Lane, data):
+        """Hand PCM to the sinks: the device's reply stream and, if enabled, the host speaker's queue."""
+        if lane.reply is not None:
+            lane.reply.append(data)
+        if lane.speaker is not None:
+            lane.speaker.append(data)
+
+    async def _play_file(self, lane: _Lane, path: str):
+        """Play raw PCM from disk chunk by chunk."""
+        with open(path, 'rb') as f:
+            while True:
+                data = await asyncio.to_thread(f.read, CHUNK)
+                if not data:
+                    break
+                data = data[:len(data) - len(data) % SAMPLE_WIDTH]
+                await self._write(lane, data)
+                self.frames_played += 1
+
+
+# Shared engine used by the server and the REPL
+engine = TTSEngine()
+
+
+async def speak_text(text: str) -> str:
     """
-    Converts text to speech using Deepgram TTS, streams playback, 
-    and saves it to a timestamped file in audio_history/.
+    Converts text to speech using Deepgram TTS, streams playback,
+    and saves it to a timestamped file in audio_history/, which is returned
+    (None when the phrase played from the TTS cache and nothing was saved).
+    Goes through the shared engine, starting it on first use.
     """
-    # Create unique file name
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    output_file = os.path.join(AUDIO_HISTORY_DIR, f"{timestamp}.wav")
-
-    headers = {
-        "Authorization": f"Token {API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {"text": text}
-
-    # Open PyAudio stream
-    p = pyaudio.PyAudio()
-    
-    # IMPORTANT: Use frames (samples) for frames_per_buffer, not bytes
-    FRAMES_PER_BUFFER = CHUNK // SAMPLE_WIDTH  # 2400 frames
-    
-    stream = p.open(format=FORMAT,
-                    channels=CHANNELS,
-                    rate=SAMPLE_RATE,
-                    output=True,
-                    frames_per_buffer=FRAMES_PER_BUFFER)
-
-    audio_frames = []
-    audio_buffer = b''  # Buffer to accumulate data
-    
-    # Debug variables
-    chunk_count = 0
-    start_time = time.time()
-    last_chunk_time = start_time
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(DEEPGRAM_TTS_URL, headers=headers, json=payload) as resp:
-            if resp.status != 200:
-                print("Failed to get audio stream:", await resp.text())
-                return None
-
-            print("[INFO] Sample width:", SAMPLE_WIDTH, "bytes")
-            print(f"[INFO] Frame size: {SAMPLE_WIDTH} bytes (channels={CHANNELS})")
-            print(f"[INFO] Bytes per chunk: {CHUNK}")
-            print("Speaking response...")
-
-            async for chunk in resp.content.iter_chunked(CHUNK):
-                if not chunk:
-                    continue
-                    
-                chunk_count += 1
-                current_time = time.time()
-                
-                if debug:
-                    gap = (current_time - last_chunk_time) * 1000
-                    print(f"Chunk #{chunk_count}: {len(chunk)} bytes, gap: {gap:.1f}ms")
-                    
-                    # First chunk timing
-                    if chunk_count == 1:
-                        ttfb = (current_time - start_time) * 1000
-                        print(f"⚡ Time to first byte: {ttfb:.0f}ms")
-                
-                # Add chunk to buffer
-                audio_buffer += chunk
-                audio_frames.append(chunk)  # Save all chunks for file
-                
-                # Play complete frames from buffer
-                while len(audio_buffer) >= CHUNK:
-                    # Extract exactly CHUNK bytes (which equals FRAMES_PER_BUFFER frames)
-                    frame_data = audio_buffer[:CHUNK]
-                    audio_buffer = audio_buffer[CHUNK:]  # Remove played data
-                    
-                    # Ensure even number of bytes (for 16-bit samples)
-                    if len(frame_data) % 2 != 0:
-                        frame_data = frame_data[:-1]  # Remove last byte if odd
-                        if debug:
-                            print("⚠️  Trimmed odd byte from frame")
-                    
-                    # Play the frame
-                    stream.write(frame_data)
-                    if debug:
-                        print(f"✅ Played frame: {len(frame_data)} bytes")
-                
-                last_chunk_time = current_time
-
-            # Play any remaining buffered data
-            if len(audio_buffer) > 0:
-                # Ensure even length
-                if len(audio_buffer) % 2 != 0:
-                    audio_buffer = audio_buffer[:-1]
-                
-                if len(audio_buffer) > 0:
-                    stream.write(audio_buffer)
-                    if debug:
-                        print(f"✅ Played final buffer: {len(audio_buffer)} bytes")
-
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
-
-    # Save the complete audio to a WAV file
-    with wave.open(output_file, 'wb') as wf:
-        wf.setnchannels(CHANNELS)
-        wf.setsampwidth(p.get_sample_size(FORMAT))
-        wf.setframerate(SAMPLE_RATE)
-        wf.writeframes(b''.join(audio_frames))
-
-    # Final debug summary
-    if debug:
-        total_time = time.time() - start_time
-        audio_duration = len(b''.join(audio_frames)) / (SAMPLE_RATE * SAMPLE_WIDTH * CHANNELS)
-        print(f"📊 Total chunks: {chunk_count}, Total time: {total_time:.1f}s, Audio duration: {audio_duration:.1f}s")
-
-    print(f"Audio saved as: {output_file}")
-    return output_file
+    if not engine.running:
+        await engine.start()
+    return await engine.speak(text)
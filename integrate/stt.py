@@ -1,8 +1,96 @@
+import asyncio
+import os
+import threading
 import time
-from elevenlabs.client import ElevenLabs
+import httpx
+
+# elevenlabs is imported on first use: it is slow to import and not needed to start serving
 
 ELEVENLABS_API_KEY = ""
 
+# Shared client / pool settings
+STT_MODEL = "scribe_v1"
+STT_MAX_CONCURRENCY = int(os.getenv("STT_MAX_CONCURRENCY", "4"))  # Parallel uploads to ElevenLabs
+STT_TIMEOUT = float(os.getenv("STT_TIMEOUT", "60"))               # Seconds per request
+STT_KEEPALIVE = float(os.getenv("STT_KEEPALIVE", "120"))          # Idle pooled connection lifetime
+ELEVENLABS_BASE_URL = os.getenv("ELEVENLABS_BASE_URL")            # Override for a local stub (benchmarks)
+
+# Long-lived clients, created on first use and reused for every request
+_client = None
+_async_client = None
+_async_http = None
+_client_lock = threading.Lock()
+_semaphore = asyncio.Semaphore(STT_MAX_CONCURRENCY)
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=STT_MAX_CONCURRENCY,
+        max_keepalive_connections=STT_MAX_CONCURRENCY,
+        keepalive_expiry=STT_KEEPALIVE,
+    )
+
+
+def get_client():
+    """Return the shared blocking ElevenLabs client (pooled HTTP connection)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            from elevenlabs.client import ElevenLabs
+            http_client = httpx.Client(timeout=STT_TIMEOUT, limits=_pool_limits())
+            _client = ElevenLabs(api_key=ELEVENLABS_API_KEY, base_url=ELEVENLABS_BASE_URL, httpx_client=http_client)
+    return _client
+
+
+def get_async_client():
+    """Return the shared async ElevenLabs client (pooled HTTP connection)."""
+    global _async_client, _async_http
+    if _async_client is None:
+        from elevenlabs.client import AsyncElevenLabs
+        _async_http = httpx.AsyncClient(timeout=STT_TIMEOUT, limits=_pool_limits())
+        _async_client = AsyncElevenLabs(api_key=ELEVENLABS_API_KEY, base_url=ELEVENLABS_BASE_URL, httpx_client=_async_http)
+    return _async_client
+
+
+async def close_clients():
+    """Close pooled connections (call on server shutdown)."""
+    global _client, _async_client, _async_http
+    if _async_http is not None:
+        await _async_http.aclose()
+    _async_client = None
+    _async_http = None
+    with _client_lock:
+        _client = None
+
+
+async def warm():
+    """Build the async client and open a pooled connection to ElevenLabs ahead of an upload."""
+    get_async_client()
+    # Any response will do: the connection stays in the pool for STT_KEEPALIVE
+    await _async_http.head(ELEVENLABS_BASE_URL or "https://api.elevenlabs.io")
+
+
+def format_transcription(text: str) -> str:
+    """Print each sentence of the transcription and return the concatenated text."""
+    full_text = ""
+    if text:
+        print("[STT] Transcription:")
+        # Split the transcription into sentences for printing (similar to original format)
+        sentences = text.split('. ')
+        for sentence in sentences:
+            if sentence.strip():
+                # Add period back if it's not the last sentence
+                part = sentence.strip()
+                if not part.endswith('.') and sentence != sentences[-1]:
+                    part += '.'
+                print(f"[STT] {part}")
+                full_text += part + " "
+        full_text = full_text.strip()
+    else:
+        print("[STT] No transcription found")
+    return full_text
+
+
 def transcribe(audio_path: str) -> str:
     """
     Transcribe audio file using ElevenLabs, print each sentence, and return full concatenated text.
@@ -10,7 +98,7 @@ def transcribe(audio_path: str) -> str:
     """
     full_text = ""
     try:
-        elevenlabs = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+        elevenlabs = get_client()
 
         # Start timer
         start_time = time.time()
@@ -18,34 +106,78 @@ def transcribe(audio_path: str) -> str:
         with open(audio_path, "rb") as audio_file:
             transcription = elevenlabs.speech_to_text.convert(
                 file=audio_file,
-                model_id="scribe_v1",
+                model_id=STT_MODEL,
                 tag_audio_events=True,
                 language_code="eng",
                 diarize=True,
             )
 
         # End timer
-        end_time = time.time()
-        elapsed_time = end_time - start_time
+        elapsed_time = time.time() - start_time
         print(f"[STT] Transcription took {elapsed_time:.2f} seconds")
 
-        if transcription.text:
-            print("[STT] Transcription:")
-            # Split the transcription into sentences for printing (similar to original format)
-            sentences = transcription.text.split('. ')
-            for sentence in sentences:
-                if sentence.strip():
-                    # Add period back if it's not the last sentence
-                    text = sentence.strip()
-                    if not text.endswith('.') and sentence != sentences[-1]:
-                        text += '.'
-                    print(f"[STT] {text}")
-                    full_text += text + " "
-            full_text = full_text.strip()
+        full_text = format_transcription(transcription.text)
+
+    except Exception as e:
+        print(f"STT Exception: {e}")
+
+    return full_text
+
+
+async def transcribe_async(audio_path: str) -> str:
+    """
+    Non-blocking variant of transcribe() for use inside the server's event loop.
+    At most STT_MAX_CONCURRENCY transcriptions run at once; the rest wait their turn
+    without holding up other requests.
+    """
+    try:
+        # Read the file off the event loop
+        audio_bytes = await asyncio.to_thread(_read_file, audio_path)
+    except Exception as e:
+        print(f"STT Exception: {e}")
+        return ""
+
+    return await transcribe_bytes_async(audio_bytes, os.path.basename(audio_path))
+
+
+async def transcribe_bytes_async(audio_bytes: bytes, filename: str = "audio.wav", quiet: bool = False,
+                                 raise_errors: bool = False) -> str:
+    """
+    Transcribe an in-memory WAV clip through the shared async client. Failures are
+    logged and give "" unless raise_errors (callers that retry need to tell them apart).
+    """
+    full_text = ""
+    try:
+        elevenlabs = get_async_client()
+
+        queued_at = time.time()
+        async with _semaphore:
+            start_time = time.time()
+            transcription = await elevenlabs.speech_to_text.convert(
+                file=(filename, audio_bytes, "audio/wav"),
+                model_id=STT_MODEL,
+                tag_audio_events=True,
+                language_code="eng",
+                diarize=True,
+            )
+
+        elapsed_time = time.time() - start_time
+        waited = start_time - queued_at
+        print(f"[STT] Transcription took {elapsed_time:.2f} seconds (queued {waited:.2f}s)")
+
+        if quiet:
+            full_text = (transcription.text or "").strip()
         else:
-            print("[STT] No transcription found")
+            full_text = format_transcription(transcription.text)
 
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"STT Exception: {e}")
 
     return full_text
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
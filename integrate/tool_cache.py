@@ -0,0 +1,188 @@
+import asyncio
+import collections
+import json
+import os
+import re
+import time
+from metrics import registry as metrics_registry
+
+# Tool cache settings
+TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE_ENABLED", "1") != "0"
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", "256"))             # Cached results across all tools
+TOOL_CACHE_DEFAULT_TTL = float(os.getenv("TOOL_CACHE_DEFAULT_TTL", "30"))  # Seconds, read-only tools without their own TTL
+
+# Per-tool TTLs (seconds). 0 means never cache, even if the tool looks read-only.
+TOOL_TTLS = {
+    "gmail_find_email": 60,
+    "gmail_get_email": 300,
+    "google_calendar_find_event": 60,
+}
+
+# Name-based classification for tools without MCP annotations. Anything that is
+# neither clearly a read nor clearly a write is treated as side-effecting (never cached).
+READ_VERBS = re.compile(r"(^|_)(find|search|get|list|read|lookup|fetch|retrieve|query|count)(_|$)")
+WRITE_VERBS = re.compile(
+    r"(^|_)(send|create|update|delete|remove|reply|draft|add|move|archive|mark|forward|post|write|set|edit|"
+    r"upload|copy|label|star|trash|invite|cancel)(_|$)"
+)
+STATEFUL_PREFIXES = ("browser_",)   # Answers depend on page state, not just on the input
+
+
+def normalize_arguments(value):
+    """Case/whitespace-insensitive, key-order-insensitive form of tool input."""
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, dict):
+        return {k: normalize_arguments(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [normalize_arguments(v) for v in value]
+    return value
+
+
+def tool_group(name: str) -> str:
+    """Tools sharing a prefix (gmail_find_email / gmail_send_email) touch the same data."""
+    return name.split("_", 1)[0]
+
+
+class ToolResultCache:
+    """
+    TTL + LRU cache for read-only MCP tool results, keyed by (tool, normalized input).
+    It wraps each connector's call_tool, so every path that reaches a tool (the
+    LangChain adapter, direct calls) goes through it. Side-effecting tools are never
+    cached and drop the cached reads of their group; identical concurrent reads
+    share one call.
+    """
+
+    def __init__(self, max_entries: int = TOOL_CACHE_SIZE, default_ttl: float = TOOL_CACHE_DEFAULT_TTL,
+                 ttls: dict = None, enabled: bool = TOOL_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.ttls = dict(TOOL_TTLS if ttls is None else ttls)
+        self.enabled = enabled
+        self._entries = collections.OrderedDict()   # key -> (result, expires_at, call_ms)
+        self._inflight = {}
+        self._annotations = {}                       # tool -> ToolAnnotations from the server
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.invalidations = 0
+        self.saved_ms = 0.0
+
+    # -- classification ------------------------------------------------------
+
+    def ttl_for(self, tool: str):
+        """Seconds to cache this tool's results, or None if it must not be cached."""
+        if tool in self.ttls:
+            return self.ttls[tool] or None
+        if tool.startswith(STATEFUL_PREFIXES):
+            return None
+        hints = self._annotations.get(tool)
+        if hints is not None and hints.readOnlyHint is not None:
+            return self.default_ttl if hints.readOnlyHint else None
+        if WRITE_VERBS.search(tool) or not READ_VERBS.search(tool):
+            return None
+        return self.default_ttl
+
+    def is_side_effecting(self, tool: str) -> bool:
+        hints = self._annotations.get(tool)
+        if hints is not None and hints.readOnlyHint is not None:
+            return not hints.readOnlyHint
+        return self.ttl_for(tool) is None and not tool.startswith(STATEFUL_PREFIXES)
+
+    # -- wiring --------------------------------------------------------------
+
+    def attach(self, client) -> int:
+        """Wrap call_tool on every active session of an MCPClient. Returns connectors wrapped."""
+        wrapped = 0
+        for session in client.get_all_active_sessions().values():
+            connector = session.connector
+            if getattr(connector, "_tool_cache_wrapped", False):
+                continue
+            for tool in getattr(connector, "tools", None) or []:
+                if getattr(tool, "annotations", None) is not None:
+                    self._annotations[tool.name] = tool.annotations
+            original = connector.call_tool
+
+            async def call_tool(name, arguments, *args, _original=original, **kwargs):
+                return await self.call(name, arguments, lambda: _original(name, arguments, *args, **kwargs))
+
+            connector.call_tool = call_tool
+            connector._tool_cache_wrapped = True
+            wrapped += 1
+        print(f"🗄️ Tool cache attached to {wrapped} MCP connector(s)")
+        return wrapped
+
+    async def call(self, tool: str, arguments: dict, call_next):
+        """Serve a tool call from the cache or run `call_next()` (a coroutine factory)."""
+        ttl = self.ttl_for(tool) if self.enabled else None
+        if ttl is None:
+            self.bypassed += 1
+            try:
+                return await call_next()
+            finally:
+                if self.enabled and self.is_side_effecting(tool):
+                    self.invalidate_group(tool_group(tool), reason=tool)
+
+        key = (tool, json.dumps(normalize_arguments(arguments or {}), sort_keys=True, default=str))
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None and entry[1] >= now:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_ms += entry[2]
+            metrics_registry.incr("tool_cache_hits")
+            print(f"⚡ Tool cache hit: {tool} (saved ~{entry[2]:.0f} ms)")
+            return entry[0]
+        if entry is not None:
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            # Same read already running: share its result
+            self.hits += 1
+            metrics_registry.incr("tool_cache_hits")
+        else:
+            self.misses += 1
+            metrics_registry.incr("tool_cache_misses")
+            # Its own task, so a caller cancelled by barge-in doesn't cancel the call under the others
+            task = self._inflight[key] = asyncio.create_task(self._fetch(key, ttl, call_next))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())   # Waiters may all be gone
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, ttl: float, call_next):
+        start = time.perf_counter()
+        try:
+            result = await call_next()
+        finally:
+            self._inflight.pop(key, None)
+        call_ms = (time.perf_counter() - start) * 1000
+        if not getattr(result, "isError", False):
+            self._entries[key] = (result, time.time() + ttl, call_ms)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def invalidate_group(self, group: str, reason: str = None):
+        stale = [key for key in self._entries if tool_group(key[0]) == group]
+        for key in stale:
+            del self._entries[key]
+        if stale:
+            self.invalidations += len(stale)
+            print(f"🗄️ Tool cache: {len(stale)} '{group}' result(s) invalidated by {reason or 'request'}")
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "invalidations": self.invalidations,
+            "saved_ms": round(self.saved_ms),
+        }
@@ -0,0 +1,133 @@
+import os
+import time
+import hashlib
+import collections
+import itertools
+import unicodedata
+
+# Cache settings
+TTS_CACHE_DIR = "tts_cache"
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))   # Total PCM kept on disk
+TTS_CACHE_MAX_AGE = float(os.getenv("TTS_CACHE_MAX_AGE", str(7 * 24 * 3600)))          # Seconds before an entry expires
+TTS_CACHE_MAX_ENTRY = 4 * 1024 * 1024                                                   # Don't cache very long replies
+CACHE_KEY_VERSION = 2               # Bumped when normalize_text changes; older entries are never hit and age out
+
+
+def normalize_text(text: str) -> str:
+    """
+    Unicode (NFC) and whitespace normalization so trivially different strings share
+    an entry. Case is kept: "US" and "us", "IT" and "it" are spoken differently.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text: str, model: str, sample_rate: int) -> str:
+    raw = f"v{CACHE_KEY_VERSION}|{model}|{sample_rate}|{normalize_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Content-addressed store of synthesized PCM, keyed by (normalized text, model,
+    sample rate). Audio lives on disk as <key>.pcm; an in-memory LRU index tracks
+    size and age so eviction never has to scan the directory.
+    """
+
+    def __init__(self, model: str, sample_rate: int, cache_dir: str = TTS_CACHE_DIR,
+                 max_bytes: int = TTS_CACHE_MAX_BYTES, max_age: float = TTS_CACHE_MAX_AGE):
+        self.model = model
+        self.sample_rate = sample_rate
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._index = collections.OrderedDict()   # key -> (size, created_at), least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_ms = 0.0
+        self._tmp_seq = itertools.count()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pcm")
+
+    def _load_index(self):
+        """Rebuild the index once at startup, oldest access first."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".pcm"):
+                st = entry.stat()
+                entries.append((st.st_atime, entry.name[:-4], st.st_size, st.st_mtime))
+        for _, key, size, created in sorted(entries):
+            self._index[key] = (size, created)
+            self.total_bytes += size
+        self._evict()
+
+    def lookup(self, text: str):
+        """Return the cached PCM path for text, or None. Counts a hit or miss."""
+        key = cache_key(text, self.model, self.sample_rate)
+        entry = self._index.get(key)
+        if entry is not None and time.time() - entry[1] > self.max_age:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._index.move_to_end(key)
+        self.hits += 1
+        return self._path(key)
+
+    def begin(self, text: str):
+        """Start a cache write; returns (key, temp path) to stream PCM into."""
+        key = cache_key(text, self.model, self.sample_rate)
+        # A temp file per write: two devices can be synthesizing the same sentence at once
+        return key, f"{self._path(key)}.{next(self._tmp_seq)}.tmp"
+
+    def commit(self, key: str, tmp_path: str):
+        """Publish a finished temp file as a cache entry."""
+        size = os.path.getsize(tmp_path)
+        if size == 0 or size > TTS_CACHE_MAX_ENTRY:
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, self._path(key))
+        if key in self._index:
+            self.total_bytes -= self._index[key][0]
+        self._index[key] = (size, time.time())
+        self._index.move_to_end(key)
+        self.total_bytes += size
+        self._evict()
+
+    def discard(self, tmp_path: str):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    def _remove(self, key: str):
+        size, _ = self._index.pop(key)
+        self.total_bytes -= size
+        self.evictions += 1
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until under the size budget."""
+        now = time.time()
+        for key in [k for k, (_, created) in self._index.items() if now - created > self.max_age]:
+            self._remove(key)
+        while self.total_bytes > self.max_bytes and self._index:
+            self._remove(next(iter(self._index)))
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "saved_ms": round(self.saved_ms),
+        }
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+from fastapi import HTTPException
+
+# Upload limits
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_BYTES", str(16 * 1024 * 1024)))   # 240 s at 16 kHz/16-bit is ~7.7 MB
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(4 * 1024 * 1024)))    # OV2640 UXGA JPEGs are well under this
+WRITE_BUFFER_BYTES = 256 * 1024                                              # Chunks are coalesced to this before a disk write
+MAX_FILENAME_CHARS = 96
+SAMPLE_RATE_RANGE = (8000, 48000)                                            # Rates accepted in X-Sample-Rate (Hz)
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def sanitize_filename(raw: str, default: str, allowed_exts: tuple) -> str:
+    """
+    Reduce a client-supplied X-Filename to a safe basename: no directories or
+    traversal, a conservative character set, bounded length and an allowed
+    extension. Falls back to `default` if nothing usable is left.
+    """
+    name = os.path.basename((raw or "").replace("\\", "/"))
+    name = _UNSAFE_CHARS.sub("_", name).lstrip(".")
+    stem, ext = os.path.splitext(name)
+    if ext.lower() not in allowed_exts:
+        stem, ext = name, allowed_exts[0]
+    stem = stem[:MAX_FILENAME_CHARS - len(ext)]
+    return f"{stem}{ext.lower()}" if stem else default
+
+
+def unique_upload_path(upload_dir: str, filename: str) -> str:
+    """
+    Where to save an upload: its sanitized name plus a per-request suffix. Client
+    names are not unique (the firmware sends none, and the defaults only carry the
+    second), so two devices uploading at once never write to the same file.
+    """
+    stem, ext = os.path.splitext(filename)
+    return os.path.join(upload_dir, f"{stem}_{uuid.uuid4().hex[:8]}{ext}")
+
+
+def check_content_length(request, max_bytes: int):
+    """Reject an upload before reading it if the declared size is already too big."""
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload of {declared} bytes exceeds the {max_bytes} byte limit")
+
+
+def parse_sample_rate(request, default: int) -> int:
+    """X-Sample-Rate of a raw PCM stream, or `default` if absent; a 400 unless it is an integer in SAMPLE_RATE_RANGE."""
+    raw = request.headers.get("X-Sample-Rate")
+    if raw is None:
+        return default
+    low, high = SAMPLE_RATE_RANGE
+    try:
+        rate = int(raw)
+    except ValueError:
+        rate = None
+    if rate is None or not low <= rate <= high:
+        raise HTTPException(status_code=400, detail=f"X-Sample-Rate must be an integer from {low} to {high} Hz")
+    return rate
+
+
+async def stream_to_file(request, path: str, max_bytes: int):
+    """
+    Stream a request body to `path` without holding it in memory. Chunks are hashed
+    as they arrive and written from a worker thread in WRITE_BUFFER_BYTES batches,
+    so memory per upload is bounded by the buffer, not the body. The file appears
+    under its final name only once complete; an oversized body is cut off with a
+    413 and leaves nothing behind.
+    Returns (size in bytes, sha256 hex digest).
+    """
+    check_content_length(request, max_bytes)
+    tmp_path = f"{path}.part"
+    digest = hashlib.sha256()
+    size = 0
+    pending = bytearray()
+    f = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds the {max_bytes} byte limit")
+            digest.update(chunk)
+            pending += chunk
+            if len(pending) >= WRITE_BUFFER_BYTES:
+                data, pending = bytes(pending), bytearray()
+                await asyncio.to_thread(f.write, data)
+        if pending:
+            await asyncio.to_thread(f.write, bytes(pending))
+        await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.replace, tmp_path, path)
+    except BaseException:
+        await asyncio.to_thread(_discard, f, tmp_path)
+        raise
+    return size, digest.hexdigest()
+
+
+def _discard(f, path: str):
+    f.close()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass